@@ -0,0 +1,345 @@
+"""本地压测脚本：用假的 google.generativeai 替换真实 SDK，测量各端点的吞吐与延迟
+
+不消耗任何 Gemini 配额。示例：
+    python benchmark.py --concurrency 8 --requests 40 --latency 1.5 --tokens-per-second 80
+    python benchmark.py --endpoints translate,generate-word --error-rate 0.05 --json bench.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import types
+from typing import Optional
+
+# 必须在导入 main 之前设置：压测时关闭响应缓存与相同请求合并 (@idempotent)，
+# 否则字节完全相同的压测请求会命中缓存或共用一次上游调用，结果失真
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("IDEMPOTENCY_ENABLED", "false")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark-fake-key")
+
+ALL_ENDPOINTS = ["generate", "generate-stream", "analyze-experiences", "translate", "generate-word"]
+
+# ==========================================
+# 1. 假的 Gemini SDK
+# ==========================================
+class FakeGeminiConfig:
+    latency = 1.0             # 首个 token 前的等待时间 (秒)
+    tokens_per_second = 80.0  # 输出速度
+    output_tokens = 600       # 每次调用输出的 token 数
+    chunk_tokens = 20         # 流式输出时每个 chunk 的 token 数
+    error_rate = 0.0          # 注入错误的概率 (503 / 429)
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeStreamIterator:
+    """模拟 SDK 的流式迭代器，支持 cancel() 以验证断开取消逻辑"""
+
+    def __init__(self, chunks):
+        self._chunks = list(chunks)
+        self._cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._cancelled or not self._chunks:
+            raise StopIteration
+        time.sleep(FakeGeminiConfig.chunk_tokens / FakeGeminiConfig.tokens_per_second)
+        return self._chunks.pop(0)
+
+    def cancel(self):
+        self._cancelled = True
+
+class FakeStreamResponse:
+    def __init__(self, chunks):
+        self._iterator = FakeStreamIterator(chunks)
+
+    def __iter__(self):
+        return self._iterator
+
+def _fake_output(prompt: str) -> str:
+    body = "这是一段用于压测的模拟输出内容。" * max(FakeGeminiConfig.output_tokens // 16, 1)
+    if "[TRENDS_START]" in prompt:
+        return f"[TRENDS_START]<div>Option 1: Benchmark</div>[TRENDS_END][DRAFT_START]{body}[DRAFT_END]"
+    if "Chinese Header" in prompt:
+        return "压测大学个人陈述|Personal Statement for Benchmark_University"
+    return body
+
+def _maybe_fail():
+    if FakeGeminiConfig.error_rate and random.random() < FakeGeminiConfig.error_rate:
+        from google.api_core import exceptions as google_exceptions
+        error_cls = random.choice([google_exceptions.ServiceUnavailable, google_exceptions.ResourceExhausted])
+        raise error_cls("injected by benchmark")
+
+class FakeGenerativeModel:
+    def __init__(self, model_name: str = "gemini-fake", **kwargs):
+        self.model_name = model_name
+        self._client = None
+
+    def generate_content(self, contents, stream: bool = False, **kwargs):
+        prompt = contents[0] if isinstance(contents, list) else str(contents)
+        time.sleep(FakeGeminiConfig.latency)
+        _maybe_fail()
+        text = _fake_output(prompt)
+        if stream:
+            size = max(len(text) * FakeGeminiConfig.chunk_tokens // max(FakeGeminiConfig.output_tokens, 1), 1)
+            return FakeStreamResponse([FakeResponse(text[i:i + size]) for i in range(0, len(text), size)])
+        time.sleep(FakeGeminiConfig.output_tokens / FakeGeminiConfig.tokens_per_second)
+        return FakeResponse(text)
+
+class FakeClientManager:
+    def configure(self, **kwargs):
+        pass
+
+    def get_default_client(self, name):
+        return types.SimpleNamespace(
+            generate_content=lambda *a, **k: None,
+            stream_generate_content=lambda *a, **k: None,
+            transport=types.SimpleNamespace(close=lambda: None),
+        )
+
+def install_fake_genai():
+    """把假的 SDK 注册到 sys.modules，之后导入的 main 会使用它"""
+    fake_client = types.ModuleType("google.generativeai.client")
+    fake_client._ClientManager = FakeClientManager
+    fake_genai = types.ModuleType("google.generativeai")
+    fake_genai.GenerativeModel = FakeGenerativeModel
+    fake_genai.configure = lambda **kwargs: None
+    fake_genai.client = fake_client
+    sys.modules["google.generativeai"] = fake_genai
+    sys.modules["google.generativeai.client"] = fake_client
+
+# ==========================================
+# 2. 测试数据
+# ==========================================
+def make_material_docx() -> bytes:
+    import docx
+    doc = docx.Document()
+    for i in range(40):
+        doc.add_paragraph(f"2023.0{i % 9 + 1}-2023.12 压测公司{i}｜数据分析实习生：负责数据清洗、建模与可视化报告。")
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+def build_request(endpoint: str, material: bytes) -> dict:
+    """返回 httpx 请求参数"""
+    form = {
+        "api_key": "",
+        "model_name": "gemini-fake",
+        "target_school_name": "Benchmark University MSc Business Analytics",
+    }
+    files = {"material_file": ("material.docx", material, "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+    if endpoint in ("generate", "generate-stream"):
+        data = dict(form, selected_modules=json.dumps(["Motivation", "Academic", "Internship", "Why_School", "Career_Goal"]),
+                    curriculum_text="Machine Learning; Optimisation; Data Visualisation")
+        return {"url": f"/api/{endpoint}", "data": data, "files": files}
+    if endpoint == "analyze-experiences":
+        return {"url": "/api/analyze-experiences", "data": dict(form, curriculum_text="Machine Learning; Econometrics"), "files": files}
+    if endpoint == "translate":
+        return {"url": "/api/translate", "json": {
+            "api_key": "", "model_name": "gemini-fake", "module_type": "Motivation",
+            "chinese_text": "我在实习中负责搭建数据看板，并据此理解了业务分析的价值。" * 10,
+        }}
+    if endpoint == "generate-word":
+        return {"url": "/api/generate-word", "json": {
+            "content": "--- Motivation ---\n" + "This is a benchmark paragraph for Word export.\n" * 30,
+            "header_text": "Personal Statement for Benchmark", "is_chinese": False, "font_name": "Times New Roman",
+        }}
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+# ==========================================
+# 3. 服务端 (同进程线程内运行 uvicorn) 与事件循环延迟探针
+# ==========================================
+class LoopLagProbe:
+    """在服务端事件循环中周期性 sleep，记录实际唤醒时间与预期之间的差值"""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.samples = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(loop.time() - started - self.interval, 0.0))
+
+def read_rss_mb() -> Optional[float]:
+    """当前进程的常驻内存 (VmRSS)；非 Linux 平台返回 None"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+class RssSampler:
+    """在后台线程中定期读取 VmRSS，记录单个端点压测期间的起始值与峰值
+
+    服务端与压测客户端在同一进程内，所以数值包含客户端本身；ru_maxrss 是进程启动以来的峰值，
+    不会回落，不能用来比较各端点。
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = read_rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    def _sample(self):
+        rss = read_rss_mb()
+        if rss is not None:
+            self.peak_mb = max(self.peak_mb or 0.0, rss)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+def start_server(app, port: int, probe: LoopLagProbe):
+    import uvicorn
+
+    async def start_probe():
+        asyncio.get_running_loop().create_task(probe.run())
+
+    app.router.on_startup.append(start_probe)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+# ==========================================
+# 4. 压测客户端
+# ==========================================
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+async def run_endpoint(base_url: str, endpoint: str, total: int, concurrency: int, material: bytes, timeout: float) -> dict:
+    import httpx
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, first_byte, errors = [], [], 0
+
+    async def one(client):
+        nonlocal errors
+        request = build_request(endpoint, material)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with client.stream("POST", request.pop("url"), **request) as response:
+                    ttfb = None
+                    async for _ in response.aiter_bytes():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                    if response.status_code >= 400:
+                        errors += 1
+                        return
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - started)
+            first_byte.append(ttfb or latencies[-1])
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(total)))
+        wall = time.perf_counter() - started
+
+    return {
+        "endpoint": endpoint,
+        "requests": total,
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "p99": round(percentile(latencies, 99), 3),
+        "ttfb_p50": round(percentile(first_byte, 50), 3),
+    }
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Personal Statement API benchmark with a fake Gemini backend")
+    parser.add_argument("--endpoints", default=",".join(ALL_ENDPOINTS), help=f"comma separated, from: {', '.join(ALL_ENDPOINTS)}")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=20, help="requests per endpoint")
+    parser.add_argument("--latency", type=float, default=FakeGeminiConfig.latency, help="fake time to first token (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeGeminiConfig.tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=FakeGeminiConfig.output_tokens)
+    parser.add_argument("--chunk-tokens", type=int, default=FakeGeminiConfig.chunk_tokens)
+    parser.add_argument("--error-rate", type=float, default=FakeGeminiConfig.error_rate)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--json", dest="json_path", help="also write results to this JSON file")
+    args = parser.parse_args()
+
+    FakeGeminiConfig.latency = args.latency
+    FakeGeminiConfig.tokens_per_second = args.tokens_per_second
+    FakeGeminiConfig.output_tokens = args.output_tokens
+    FakeGeminiConfig.chunk_tokens = args.chunk_tokens
+    FakeGeminiConfig.error_rate = args.error_rate
+
+    install_fake_genai()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+
+    probe = LoopLagProbe()
+    server, thread = start_server(main.app, args.port, probe)
+    material = make_material_docx()
+    results = []
+    try:
+        for endpoint in [e.strip() for e in args.endpoints.split(",") if e.strip()]:
+            probe.samples.clear()
+            with RssSampler() as rss:
+                result = asyncio.run(run_endpoint(
+                    f"http://127.0.0.1:{args.port}", endpoint, args.requests, args.concurrency, material, args.timeout
+                ))
+            lags = list(probe.samples)
+            result["loop_lag_p99_ms"] = round(percentile(lags, 99) * 1000, 1)
+            result["loop_lag_max_ms"] = round(max(lags, default=0.0) * 1000, 1)
+            result["loop_lag_mean_ms"] = round(statistics.fmean(lags) * 1000, 2) if lags else 0.0
+            # 本端点压测期间采样到的进程 RSS (含压测客户端本身)；非 Linux 平台为 None
+            result["rss_start_mb"] = round(rss.start_mb, 1) if rss.start_mb is not None else None
+            result["peak_rss_mb"] = round(rss.peak_mb, 1) if rss.peak_mb is not None else None
+            results.append(result)
+            print(
+                f"{endpoint:<20} n={result['requests']:<4} err={result['errors']:<3} rps={result['rps']:<7} "
+                f"p50={result['p50']:<7} p95={result['p95']:<7} p99={result['p99']:<7} ttfb50={result['ttfb_p50']:<7} "
+                f"lag_p99={result['loop_lag_p99_ms']}ms lag_max={result['loop_lag_max_ms']}ms rss={result['rss_start_mb']}->{result['peak_rss_mb']}MB",
+                flush=True
+            )
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,20 +1,34 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import time
+_MODULE_LOAD_STARTED = time.perf_counter()  # 冷启动计时起点 (见 /api/debug/startup)
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
-import google.generativeai as genai
-from PIL import Image
-import docx
-from docx.shared import Pt, RGBColor
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
-import pypdf
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from starlette.datastructures import Headers, UploadFile as StarletteUploadFile
 import io
 import os
-import time
+import sys
 import random
 import re
+import asyncio
+import functools
+import logging
+import threading
+import sqlite3
+import hashlib
+import tempfile
+import itertools
+import multiprocessing
+import uuid
+import difflib
+import bisect
+import importlib
+import contextvars
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Awaitable
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import closing, contextmanager
 import json
 from pydantic import BaseModel, ConfigDict, Field
 import base64
@@ -23,10 +37,150 @@ warnings.filterwarnings("ignore", message=".*protected_namespaces.*")
 warnings.filterwarnings("ignore", message=".*Field.*has conflict with protected namespace.*")
 warnings.filterwarnings("ignore", category=UserWarning, module="pydantic")
 
+class LazyModule:
+    """首次访问属性时才导入的模块代理
+
+    Gemini SDK / PIL / docx / pypdf 导入较慢，推迟到第一次使用 (或启动后的后台预热) 时再导入，
+    冷启动时 / 健康检查不必等待它们；导入耗时记录在 lazy_import_stats 中。
+    """
+
+    def __init__(self, name: str, subsystem: str):
+        self._name = name
+        self._subsystem = subsystem
+        self._module = None
+
+    def _load(self, trigger: str = "first_use"):
+        if self._module is None:
+            started = time.perf_counter()
+            module = importlib.import_module(self._name)
+            if self._module is None:
+                lazy_import_stats[self._name] = {
+                    "subsystem": self._subsystem,
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "trigger": trigger,
+                }
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+lazy_import_stats: Dict[str, Dict[str, Any]] = {}
+
+genai = LazyModule("google.generativeai", "gemini")
+genai_client = LazyModule("google.generativeai.client", "gemini")
+google_exceptions = LazyModule("google.api_core.exceptions", "gemini")
+Image = LazyModule("PIL.Image", "image")
+docx = LazyModule("docx", "word")
+docx_shared = LazyModule("docx.shared", "word")
+docx_ns = LazyModule("docx.oxml.ns", "word")
+docx_oxml = LazyModule("docx.oxml", "word")
+pypdf = LazyModule("pypdf", "pdf")
+LAZY_MODULES = [genai, genai_client, google_exceptions, Image, docx, docx_shared, docx_ns, docx_oxml, pypdf]
+
+# 冷启动各阶段耗时 (毫秒，从 main.py 开始导入算起)
+startup_timings: Dict[str, float] = {}
+
+def warm_up_imports():
+    """导入所有延迟加载的依赖 (在后台线程中执行)"""
+    for module in LAZY_MODULES:
+        try:
+            module._load(trigger="warmup")
+        except Exception as e:
+            logger.warning("Warm-up import of %s failed: %s", module._name, e)
+
 app = FastAPI(title="Personal Statement Writing API", version="1.0.0")
 
+logger = logging.getLogger("personal_statement")
+
 # Environment variables
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
+# 单次 /api/generate 请求内并发生成的模块数上限 (1 = 逐个生成)
+GENERATION_CONCURRENCY = int(os.environ.get('GENERATION_CONCURRENCY', '5'))
+# 单个模块的生成超时 (秒)，超时只影响该模块
+MODULE_TIMEOUT_SECONDS = float(os.environ.get('MODULE_TIMEOUT_SECONDS', '300'))
+# 每个 worker 进程内同时进行的 Gemini 调用上限 (线程池大小)
+LLM_THREAD_POOL_SIZE = int(os.environ.get('LLM_THREAD_POOL_SIZE', '32'))
+# Gemini 客户端/模型句柄闲置多久后被回收 (秒)
+GEMINI_CLIENT_IDLE_SECONDS = float(os.environ.get('GEMINI_CLIENT_IDLE_SECONDS', '1800'))
+# Gemini 调用容错：单次调用超时、重试次数与退避、按模型的熔断阈值
+LLM_CALL_TIMEOUT_SECONDS = float(os.environ.get('LLM_CALL_TIMEOUT_SECONDS', '180'))
+LLM_STREAM_TIMEOUT_SECONDS = float(os.environ.get('LLM_STREAM_TIMEOUT_SECONDS', '600'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE_SECONDS = float(os.environ.get('LLM_BACKOFF_BASE_SECONDS', '1.0'))
+LLM_BACKOFF_MAX_SECONDS = float(os.environ.get('LLM_BACKOFF_MAX_SECONDS', '20'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.environ.get('CIRCUIT_RESET_SECONDS', '30'))
+# SSE 输出：连续文本块合并为一个事件的时间窗口 (毫秒) 与字节上限 (0 = 不合并)；空闲时发送心跳注释的间隔
+STREAM_COALESCE_MS = float(os.environ.get('STREAM_COALESCE_MS', '100'))
+STREAM_COALESCE_BYTES = int(os.environ.get('STREAM_COALESCE_BYTES', '1024'))
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get('STREAM_HEARTBEAT_SECONDS', '15'))
+# SSE 续传：每个流保留的最近事件数；最后一个连接断开后继续生成、等待重连的时间 (超时则中止生成)
+STREAM_REPLAY_MAX_EVENTS = int(os.environ.get('STREAM_REPLAY_MAX_EVENTS', '512'))
+STREAM_RESUME_GRACE_SECONDS = float(os.environ.get('STREAM_RESUME_GRACE_SECONDS', '30'))
+# 事件同步到共享 SQLite (同一台机器上的 worker 共享) 的间隔、其他 worker 上的重连轮询间隔与保留时间
+STREAM_REPLAY_STORE_PATH = os.environ.get('STREAM_REPLAY_STORE_PATH', os.path.join(tempfile.gettempdir(), 'ps_streams.sqlite3'))
+STREAM_REPLAY_SYNC_SECONDS = float(os.environ.get('STREAM_REPLAY_SYNC_SECONDS', '0.5'))
+STREAM_REPLAY_POLL_SECONDS = float(os.environ.get('STREAM_REPLAY_POLL_SECONDS', '0.5'))
+STREAM_REPLAY_TTL_SECONDS = float(os.environ.get('STREAM_REPLAY_TTL_SECONDS', '600'))
+# 客户端断开时用于估算节省 token 的单模块平均输出 token 数 (尚无已完成模块时使用)
+STREAM_MODULE_TOKEN_ESTIMATE = int(os.environ.get('STREAM_MODULE_TOKEN_ESTIMATE', '900'))
+# Gemini 响应缓存 (SQLite 文件，同一台机器上的所有 worker 共享)
+LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'ps_llm_cache.sqlite3'))
+LLM_CACHE_TTL_SECONDS = float(os.environ.get('LLM_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '5000'))
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+# 文档解析进程池大小 (0 = 在线程池中解析)，以及单个文件的大小/页数上限
+DOC_PARSE_WORKERS = int(os.environ.get('DOC_PARSE_WORKERS', '2'))
+DOC_MAX_BYTES = int(os.environ.get('DOC_MAX_BYTES', str(20 * 1024 * 1024)))
+DOC_MAX_PAGES = int(os.environ.get('DOC_MAX_PAGES', '60'))
+# 成绩单 PDF：有可用文字层时只发送提取出的紧凑文本，扫描件 (某页文字过少或乱码过多) 仍发送原 PDF
+TRANSCRIPT_TEXT_LAYER_ENABLED = os.environ.get('TRANSCRIPT_TEXT_LAYER_ENABLED', 'true').lower() == 'true'
+TRANSCRIPT_MIN_PAGE_CHARS = int(os.environ.get('TRANSCRIPT_MIN_PAGE_CHARS', '40'))
+TRANSCRIPT_MAX_GARBLED_RATIO = float(os.environ.get('TRANSCRIPT_MAX_GARBLED_RATIO', '0.05'))
+# 成绩单/课程截图预处理：最长边、输出格式与质量、是否对近似黑白的图片转灰度
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', '2048'))
+IMAGE_FORMAT = os.environ.get('IMAGE_FORMAT', 'JPEG').upper()  # "JPEG" or "WEBP"
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+IMAGE_GRAYSCALE = os.environ.get('IMAGE_GRAYSCALE', 'true').lower() == 'true'
+# 多校批量生成：整个批次内同时进行的 学校×模块 调用上限，以及单次批量的学校数上限
+BATCH_GENERATION_CONCURRENCY = int(os.environ.get('BATCH_GENERATION_CONCURRENCY', '8'))
+BATCH_MAX_SCHOOLS = int(os.environ.get('BATCH_MAX_SCHOOLS', '20'))
+# 异步任务 (Job)：SQLite 任务库路径 (同一台机器上的 worker 共享)、结果保留时间、每个 worker 同时运行的任务数
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'ps_jobs.sqlite3'))
+JOB_RETENTION_SECONDS = float(os.environ.get('JOB_RETENTION_SECONDS', str(24 * 3600)))
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', '4'))
+# 任务心跳间隔；超过 JOB_STALE_SECONDS 没有心跳的未完成任务视为已中断 (worker 重启等)
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '15'))
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '120'))
+# 订阅任务进度 (SSE) 时轮询任务库的间隔
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1.0'))
+# 素材画像：生成前先把学生素材压缩为结构化画像，各模块用画像代替原文 (可按请求用 material_profile 覆盖)；
+# 素材短于 MATERIAL_PROFILE_MIN_CHARS 时直接使用原文；MATERIAL_PROFILE_MODEL 为空时使用请求的模型
+MATERIAL_PROFILE_ENABLED = os.environ.get('MATERIAL_PROFILE_ENABLED', 'false').lower() == 'true'
+MATERIAL_PROFILE_MIN_CHARS = int(os.environ.get('MATERIAL_PROFILE_MIN_CHARS', '4000'))
+MATERIAL_PROFILE_MODEL = os.environ.get('MATERIAL_PROFILE_MODEL', '')
+# 批注编辑：每个带批注的段落前后各附带多少段只读上下文
+EDIT_CONTEXT_PARAGRAPHS = int(os.environ.get('EDIT_CONTEXT_PARAGRAPHS', '1'))
+# 幂等键与重复请求合并：SQLite 幂等表 (worker 间共享)、Idempotency-Key 结果保留时间、
+# 等待其他 worker 上相同请求完成的最长时间与轮询间隔
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+IDEMPOTENCY_STORE_PATH = os.environ.get('IDEMPOTENCY_STORE_PATH', os.path.join(tempfile.gettempdir(), 'ps_idempotency.sqlite3'))
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '600'))
+IDEMPOTENCY_POLL_SECONDS = float(os.environ.get('IDEMPOTENCY_POLL_SECONDS', '0.5'))
+# 启动后在后台预先导入 Gemini SDK / PIL / docx / pypdf；延迟几秒开始，先让健康检查尽快通过
+IMPORT_WARMUP_ENABLED = os.environ.get('IMPORT_WARMUP_ENABLED', 'true').lower() == 'true'
+IMPORT_WARMUP_DELAY_SECONDS = float(os.environ.get('IMPORT_WARMUP_DELAY_SECONDS', '1.0'))
+# /metrics 指标：各 worker 的累计值写入共享 SQLite 文件 (同一台机器上的 worker 共享) 的间隔
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_STORE_PATH = os.environ.get('METRICS_STORE_PATH', os.path.join(tempfile.gettempdir(), 'ps_metrics.sqlite3'))
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+# worker 超过该时长没有写入心跳即视为已退出，启动和抓取时清理它留下的行
+METRICS_WORKER_STALE_SECONDS = float(os.environ.get('METRICS_WORKER_STALE_SECONDS', '300'))
+# 每个 worker 缓存的已生成 Word 文档数量 (反复导出同一内容时直接返回)
+WORD_CACHE_MAX_ENTRIES = int(os.environ.get('WORD_CACHE_MAX_ENTRIES', '64'))
 
 # CORS configuration
 app.add_middleware(
@@ -45,6 +199,7 @@ class GenerationRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     target_school_name: str
     counselor_strategy: str = ""
     selected_modules: List[str]
@@ -57,6 +212,7 @@ class FileUploadRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     target_school_name: str
     counselor_strategy: str = ""
     selected_modules: List[str]
@@ -71,15 +227,41 @@ class TranslationRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     chinese_text: str
     spelling_preference: str = "British"
     module_type: str  # "Motivation", "Academic", etc.
 
+class TranslationSection(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    module_type: str  # "Motivation", "Academic", etc.
+    chinese_text: str
+
+class BatchTranslationRequest(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    api_key: str = ""
+    model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
+    sections: List[TranslationSection]
+    spelling_preference: str = "British"
+    stream: bool = False  # True 时以 SSE 逐个返回完成的模块译文
+    max_concurrency: int = GENERATION_CONCURRENCY
+
+class SchoolEntry(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    target_school_name: str
+    counselor_strategy: str = ""
+    curriculum_text: str = ""
+
 class EditRequest(BaseModel):
     model_config = ConfigDict(protected_namespaces=())
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     text: str
     is_chinese: bool = True
 
@@ -96,6 +278,7 @@ class ExperienceAnalysisRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     target_school_name: str
     curriculum_text: Optional[str] = None
     # Files will be handled separately as multipart form data
@@ -110,6 +293,7 @@ class RefineAnalysisRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     old_ps: str
     target_school: str
     target_major: str
@@ -129,6 +313,7 @@ class RefineEditRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     text: str
     has_chinese: bool = True
 
@@ -137,6 +322,7 @@ class HybridTranslateRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     hybrid_text: str
     style: str = "US"  # "US" or "UK"
 
@@ -145,8 +331,259 @@ class RemoveAIVocabRequest(BaseModel):
 
     api_key: str = ""
     model_name: str = "gemini-2.5-pro"
+    bypass_cache: bool = False  # True 时跳过响应缓存，强制重新生成
     text: str
 
+class LintRequest(BaseModel):
+    text: str
+
+# ==========================================
+# 指标 (Prometheus 文本格式)：各 worker 在内存中累计，定期写入共享 SQLite，/metrics 汇总所有 worker
+# ==========================================
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# name -> (type, help)
+METRIC_DEFINITIONS = {
+    "ps_http_request_duration_seconds": ("histogram", "HTTP request duration by route, including streamed bodies"),
+    "ps_stage_duration_seconds": ("histogram", "Duration of local processing stages (file_read, extraction, image_decode, word_generation)"),
+    "ps_gemini_call_duration_seconds": ("histogram", "Duration of one Gemini API attempt, by module and model"),
+    "ps_gemini_ttft_seconds": ("histogram", "Time to first streamed chunk from Gemini, by module and model"),
+    "ps_gemini_tokens_total": ("counter", "Gemini tokens by module, model and direction (source=estimate when the SDK reports no usage metadata)"),
+    "ps_gemini_errors_total": ("counter", "Failed Gemini attempts by model and error kind"),
+    "ps_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+}
+
+# 显式指定的 Gemini 调用模块名 (Motivation / extract 等)；未指定时使用请求的路由
+gemini_module_label: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("gemini_module_label", default=None)
+_request_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("request_scope", default=None)
+
+def current_module_label() -> str:
+    module = gemini_module_label.get()
+    if module:
+        return module
+    scope = _request_scope.get()
+    route = scope.get("route") if scope else None
+    return route.path if route is not None else "unknown"
+
+@contextmanager
+def gemini_module(name: str):
+    """在 with 块内发起的 Gemini 调用使用 name 作为指标的 module 标签"""
+    token = gemini_module_label.set(name)
+    try:
+        yield
+    finally:
+        gemini_module_label.reset(token)
+
+class MetricsRegistry:
+    """当前 worker 的计数器与直方图 (线程安全，线程池中的调用也可以记录)"""
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, Any] = {}  # (name, labels) -> float 或 [bucket_counts, sum, count]
+        self._dirty = set()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> tuple:
+        if name not in METRIC_DEFINITIONS:
+            raise KeyError(f"Unknown metric: {name}")
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            self._dirty.add(key)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += 1
+            self._dirty.add(key)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def take_dirty(self) -> List[tuple]:
+        """返回自上次调用以来有变化的 [(name, labels, value)]，value 为当前累计值的拷贝"""
+        with self._lock:
+            changed = []
+            for name, labels in self._dirty:
+                value = self._values[(name, labels)]
+                changed.append((name, labels, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value))
+            self._dirty.clear()
+        return changed
+
+class MetricsStore:
+    """各 worker 累计值的共享存储：每个 worker 一行一个序列，抓取时按序列求和
+
+    worker 以 pid + 随机后缀标识，重启后的新 worker 不会覆盖旧 worker 的计数。
+    每次写入同时更新 worker 的心跳，长时间没有心跳的 worker 的行会被清理。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS metric_values ("
+                        "worker TEXT, name TEXT, labels TEXT, value TEXT, updated_at REAL, "
+                        "PRIMARY KEY (worker, name, labels))"
+                    )
+                    conn.execute("CREATE TABLE IF NOT EXISTS metric_workers (worker TEXT PRIMARY KEY, last_seen REAL)")
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def write(self, changed: List[tuple]):
+        """写入有变化的序列并更新心跳 (没有变化时也要更新，避免被当作已退出)"""
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO metric_workers (worker, last_seen) VALUES (?, ?)", (self.worker_id, now)
+                )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO metric_values (worker, name, labels, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(self.worker_id, name, json.dumps(labels), json.dumps(value), now) for name, labels, value in changed]
+                )
+        except sqlite3.Error as e:
+            logger.warning("Metrics flush failed: %s", e)
+
+    def prune(self, stale_seconds: Optional[float] = None) -> int:
+        """删除心跳超时的 worker 及其序列 (包括没有心跳记录的旧行)，返回删除的序列数"""
+        cutoff = time.time() - (METRICS_WORKER_STALE_SECONDS if stale_seconds is None else stale_seconds)
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM metric_workers WHERE last_seen < ?", (cutoff,))
+                deleted = conn.execute(
+                    "DELETE FROM metric_values WHERE worker NOT IN (SELECT worker FROM metric_workers)"
+                ).rowcount
+        except sqlite3.Error as e:
+            logger.warning("Metrics prune failed: %s", e)
+            return 0
+        if deleted:
+            logger.info("Pruned %d metric series from stale workers", deleted)
+        return deleted
+
+    def collect(self) -> Dict[tuple, Any]:
+        """读取所有 worker 的累计值并按 (name, labels) 求和"""
+        totals: Dict[tuple, Any] = {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT name, labels, value FROM metric_values").fetchall()
+        for name, labels, value in rows:
+            key = (name, tuple(tuple(pair) for pair in json.loads(labels)))
+            value = json.loads(value)
+            current = totals.get(key)
+            if current is None:
+                totals[key] = value
+            elif isinstance(value, list):
+                current[0] = [a + b for a, b in zip(current[0], value[0])]
+                current[1] += value[1]
+                current[2] += value[2]
+            else:
+                totals[key] = current + value
+        return totals
+
+def _format_labels(labels, extra: Optional[tuple] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render_prometheus(totals: Dict[tuple, Any], buckets=METRIC_BUCKETS) -> str:
+    """按 Prometheus 文本格式 (0.0.4) 输出汇总后的指标"""
+    lines = []
+    for name, (kind, help_text) in METRIC_DEFINITIONS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (series, labels), value in sorted(totals.items()):
+            if series != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+                continue
+            bucket_counts, total, count = value
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', f'{bound:g}'))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics_store = MetricsStore(METRICS_STORE_PATH)
+
+def flush_metrics():
+    metrics_store.write(metrics.take_dirty())
+
+def record_gemini_usage(response, module: str, model_name: str, prompt: str, media_content, text_context, output_text: str):
+    """按响应的 usage_metadata 记录输入/输出 token；SDK 未提供时按文本长度估算"""
+    usage = getattr(response, "usage_metadata", None)
+    input_tokens = getattr(usage, "prompt_token_count", None) if usage is not None else None
+    output_tokens = getattr(usage, "candidates_token_count", None) if usage is not None else None
+    source = "usage"
+    if not input_tokens and not output_tokens:
+        source = "estimate"
+        input_tokens = estimate_tokens(prompt) + estimate_context_tokens(text_context, media_content)
+        output_tokens = estimate_tokens(output_text)
+    metrics.inc("ps_gemini_tokens_total", input_tokens or 0, module=module, model=model_name, direction="input", source=source)
+    metrics.inc("ps_gemini_tokens_total", output_tokens or 0, module=module, model=model_name, direction="output", source=source)
+
+class MetricsMiddleware:
+    """记录每个请求的耗时 (按路由模板、方法与状态码)，流式响应计到响应体结束为止"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+        token = _request_scope.set(scope)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_scope.reset(token)
+            route = scope.get("route")
+            metrics.observe(
+                "ps_http_request_duration_seconds", time.perf_counter() - started,
+                endpoint=route.path if route is not None else "unmatched", method=scope["method"], status=status["code"]
+            )
+
+app.add_middleware(MetricsMiddleware)
+
 # ==========================================
 # 2. 核心辅助函数 (从原 psw.py 移植)
 # ==========================================
@@ -154,48 +591,105 @@ def set_bottom_border(paragraph):
     """为段落添加下框线 (用于页眉)"""
     p = paragraph._p
     pPr = p.get_or_add_pPr()
-    pBdr = OxmlElement('w:pBdr')
-    bottom = OxmlElement('w:bottom')
-    bottom.set(qn('w:val'), 'single')
-    bottom.set(qn('w:sz'), '6') # 1/8 pt, 6 = 0.75pt
-    bottom.set(qn('w:space'), '1')
-    bottom.set(qn('w:color'), '000000') # 黑色
+    pBdr = docx_oxml.OxmlElement('w:pBdr')
+    bottom = docx_oxml.OxmlElement('w:bottom')
+    bottom.set(docx_ns.qn('w:val'), 'single')
+    bottom.set(docx_ns.qn('w:sz'), '6') # 1/8 pt, 6 = 0.75pt
+    bottom.set(docx_ns.qn('w:space'), '1')
+    bottom.set(docx_ns.qn('w:color'), '000000') # 黑色
     pBdr.append(bottom)
     pPr.append(pBdr)
 
+class WordTemplate:
+    """预先设置好样式的 Word 模板 (每种 字体 + 中英文 组合一个)
+
+    页眉下框线、正文/页眉字体 (含 eastAsia) 都设置在样式上，模板只保存一次序列化后的字节；
+    每次导出从这些字节加载新文档并写入文字，模板本身不被修改，可被多个线程同时使用。
+    """
+
+    def __init__(self, font_name: str, is_chinese: bool):
+        doc = docx.Document()
+        for style_name, size, italic in (("Normal", 11, False), ("Header", 12, True)):
+            font = doc.styles[style_name].font
+            font.name = font_name
+            font.size = docx_shared.Pt(size)
+            if italic:
+                font.italic = True
+            # 处理中文字体显示
+            if is_chinese:
+                doc.styles[style_name].element.rPr.rFonts.set(docx_ns.qn('w:eastAsia'), font_name)
+
+        header_para = doc.sections[0].header.paragraphs[0]
+        header_para.alignment = docx.enum.text.WD_ALIGN_PARAGRAPH.LEFT
+        # 设置页眉下框线
+        set_bottom_border(header_para)
+
+        bio = io.BytesIO()
+        doc.save(bio)
+        self.template_bytes = bio.getvalue()
+
+    def render(self, header_text: str, lines: List[str]) -> bytes:
+        doc = docx.Document(io.BytesIO(self.template_bytes))
+        doc.sections[0].header.paragraphs[0].text = header_text
+        for line in lines:
+            doc.add_paragraph(line)
+
+        bio = io.BytesIO()
+        doc.save(bio)
+        return bio.getvalue()
+
+@functools.lru_cache(maxsize=16)
+def get_word_template(font_name: str, is_chinese: bool) -> WordTemplate:
+    return WordTemplate(font_name, is_chinese)
+
+class WordDocumentCache:
+    """已生成 Word 文档的进程内 LRU 缓存，按 (正文, 页眉, 字体, 是否中文) 的哈希索引"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    @staticmethod
+    def make_key(content: str, header_text: str, font_name: str, is_chinese: bool) -> str:
+        payload = json.dumps([content, header_text, font_name, bool(is_chinese)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+word_document_cache = WordDocumentCache(WORD_CACHE_MAX_ENTRIES)
+
 def create_word_docx(content, header_text, font_name, is_chinese=False):
-    """生成 Word 文档 (包含清洗逻辑)"""
-    doc = docx.Document()
-
-    # --- 1. 设置页眉 ---
-    section = doc.sections[0]
-    header = section.header
-
-    # 获取页眉的第一个段落（默认存在）
-    header_para = header.paragraphs[0]
-    header_para.text = header_text
-    header_para.alignment = docx.enum.text.WD_ALIGN_PARAGRAPH.LEFT
-
-    # 设置页眉下框线
-    set_bottom_border(header_para)
-
-    # 设置页眉字体样式 (12pt, 斜体)
-    for run in header_para.runs:
-        run.font.name = font_name
-        run.font.size = Pt(12)
-        run.font.italic = True
-        # 处理中文字体显示
-        if is_chinese:
-            run._element.rPr.rFonts.set(qn('w:eastAsia'), font_name)
-
-    # --- 2. 设置正文 (清洗逻辑优化) ---
+    """生成 Word 文档 (包含清洗逻辑)，相同输入直接返回缓存的文档"""
+    cache_key = word_document_cache.make_key(content, header_text, font_name, is_chinese)
+    cached = word_document_cache.get(cache_key)
+    metrics.inc("ps_cache_requests_total", cache="word", result="miss" if cached is None else "hit")
+    if cached is not None:
+        return cached
+
+    # --- 设置正文 (清洗逻辑优化) ---
     # 1. 去除 Markdown 加粗符号
-    content = content.replace("**", "")
+    text = content.replace("**", "")
     # 2. 去除 Markdown 单星号 (列表或斜体)
-    content = content.replace("*", "")
+    text = text.replace("*", "")
 
+    lines = []
     # 按行处理
-    for line in content.split('\n'):
+    for line in text.split('\n'):
         line = line.strip()
 
         # 3. 跳过空行
@@ -207,19 +701,12 @@ def create_word_docx(content, header_text, font_name, is_chinese=False):
         if line.startswith("---") and line.endswith("---"):
             continue
 
-        p = doc.add_paragraph(line)
-        # 设置正文样式 (11pt)
-        for run in p.runs:
-            run.font.name = font_name
-            run.font.size = Pt(11)
-            # 处理中文字体显示
-            if is_chinese:
-                run._element.rPr.rFonts.set(qn('w:eastAsia'), font_name)
+        lines.append(line)
 
-    # 保存到内存
-    bio = io.BytesIO()
-    doc.save(bio)
-    return bio.getvalue()
+    # 页眉 (12pt, 斜体) 与正文 (11pt) 的字体都来自模板样式
+    docx_bytes = get_word_template(font_name, bool(is_chinese)).render(header_text, lines)
+    word_document_cache.set(cache_key, docx_bytes)
+    return docx_bytes
 
 def read_word_file(file_bytes):
     """读取 Word 文件内容"""
@@ -232,77 +719,934 @@ def read_word_file(file_bytes):
     except Exception as e:
         return f"Error reading Word file: {e}"
 
-def read_pdf_text(file_bytes):
-    """读取 PDF 文件内容"""
+def read_pdf_text(file_bytes, max_pages: Optional[int] = None, stats: Optional[Dict[str, Any]] = None):
+    """读取 PDF 文件内容 (最多 max_pages 页，页数信息写入 stats)"""
     try:
         pdf_reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        total_pages = len(pdf_reader.pages)
+        # 先收集各页文本再一次性拼接，避免循环中 += 的二次复制
+        parts = [page.extract_text() + "\n" for page in itertools.islice(pdf_reader.pages, max_pages)]
+        if stats is not None:
+            stats["pages"] = len(parts)
+            stats["truncated"] = len(parts) < total_pages
+        return "".join(parts)
     except Exception as e:
         return f"Error reading PDF file: {e}"
 
-def get_gemini_response(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None):
-    """调用 Gemini API"""
-    # 优先使用环境变量中的API Key
-    effective_api_key = GOOGLE_API_KEY if GOOGLE_API_KEY else api_key
-    if not effective_api_key:
-        return "Error: API Key is required. Please set GOOGLE_API_KEY environment variable or provide via request."
-
-    genai.configure(api_key=effective_api_key)
-    model = genai.GenerativeModel(model_name)
+def is_effectively_grayscale(img, tolerance: float = 12.0) -> bool:
+    """判断图片是否近似黑白 (各通道差异很小)，此时转灰度不会丢失文字信息"""
+    sample = img.convert("RGB")
+    sample.thumbnail((64, 64))
+    pixels = list(sample.getdata())
+    spread = sum(max(p) - min(p) for p in pixels) / max(len(pixels), 1)
+    return spread <= tolerance
 
-    content = []
-    content.append(prompt)
+def preprocess_image_bytes(file_bytes: bytes, content_type: str = "") -> Dict[str, Any]:
+    """缩放、必要时转灰度并重新编码一张上传图片 (在进程池中执行)
 
+    返回 {"media": {mime_type, data}, "stats": {...}}；无法解析时原样返回。
+    """
+    started = time.perf_counter()
+    stats = {"bytes_before": len(file_bytes)}
+    try:
+        img = Image.open(io.BytesIO(file_bytes))
+        img.load()
+        original_mime = Image.MIME.get(img.format, content_type)
+        stats["size_before"] = list(img.size)
+
+        if max(img.size) > IMAGE_MAX_DIMENSION:
+            img.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+        if img.mode in ("RGBA", "LA", "P"):
+            # 透明背景铺白，避免 JPEG 编码后变黑
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+
+        grayscale = IMAGE_GRAYSCALE and (img.mode == "L" or is_effectively_grayscale(img))
+        img = img.convert("L" if grayscale else "RGB")
+
+        # 有损格式与 PNG 各编码一次取较小者 (文字截图用 PNG 往往更小)
+        candidates = []
+        img_format = "WEBP" if IMAGE_FORMAT == "WEBP" else "JPEG"
+        for fmt, options in ((img_format, {"quality": IMAGE_QUALITY}), ("PNG", {})):
+            out = io.BytesIO()
+            img.save(out, format=fmt, optimize=True, **options)
+            candidates.append((len(out.getvalue()), out.getvalue(), f"image/{fmt.lower()}"))
+        _, data, mime_type = min(candidates, key=lambda c: c[0])
+
+        # 未缩放且重新编码反而更大时保留原图
+        if len(data) >= len(file_bytes) and max(stats["size_before"]) <= IMAGE_MAX_DIMENSION:
+            data = file_bytes
+            mime_type = original_mime or mime_type
+        stats.update({"size_after": list(img.size), "grayscale": grayscale})
+    except Exception as e:
+        data = file_bytes
+        mime_type = content_type or "application/octet-stream"
+        stats["error"] = str(e)
+
+    stats["bytes_after"] = len(data)
+    stats["mime_type"] = mime_type
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {"media": {"mime_type": mime_type, "data": data}, "stats": stats}
+
+def extract_document_text(filename: str, file_bytes: bytes, max_pages: Optional[int] = None) -> Dict[str, Any]:
+    """提取 .docx / .pdf 文本 (在文档解析进程池中执行)，不支持的格式返回 text=None"""
+    started = time.perf_counter()
+    stats = {"filename": filename, "bytes": len(file_bytes), "pages": None, "truncated": False}
+    if filename.endswith('.docx'):
+        text = read_word_file(file_bytes)
+    elif filename.endswith('.pdf'):
+        text = read_pdf_text(file_bytes, max_pages, stats)
+    else:
+        text = None
+    stats["text"] = text
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
+
+def is_garbled_char(char: str) -> bool:
+    """字体编码缺失时 pypdf 常输出替换符、私用区字符或控制字符"""
+    return char == "\ufffd" or "\ue000" <= char <= "\uf8ff" or (char < " " and char not in "\n\r\t")
+
+def transcript_text_layer_issue(pages: List[str]) -> Optional[str]:
+    """判断成绩单各页文字层是否可用，可用返回 None，否则返回原因"""
+    if not pages:
+        return "no_pages"
+    if any(len("".join(page.split())) < TRANSCRIPT_MIN_PAGE_CHARS for page in pages):
+        return "sparse_text_layer"  # 至少有一页是扫描图片，只发文本会丢掉这一页
+    text = "".join(pages)
+    garbled = sum(1 for char in text if is_garbled_char(char))
+    if garbled / max(len(text), 1) > TRANSCRIPT_MAX_GARBLED_RATIO:
+        return "garbled_text_layer"
+    return None
+
+def compact_transcript_text(pages: List[str]) -> str:
+    """压缩成绩单文本：合并行内空白、去掉空行，多页时每页重复的页眉页脚只保留一次"""
+    page_lines = [[" ".join(line.split()) for line in page.splitlines() if line.strip()] for page in pages]
+    repeated = set.intersection(*(set(lines) for lines in page_lines)) if len(page_lines) > 1 else set()
+    seen = set()
+    compact = []
+    for lines in page_lines:
+        for line in lines:
+            if line in repeated:
+                if line in seen:
+                    continue
+                seen.add(line)
+            compact.append(line)
+    return "\n".join(compact)
+
+def extract_transcript_pdf(file_bytes: bytes, max_pages: Optional[int] = None) -> Dict[str, Any]:
+    """检测成绩单 PDF 的文字层 (在文档解析进程池中执行)，可用时 text 为紧凑文本，否则为 None"""
+    started = time.perf_counter()
+    stats = {"pages": None, "truncated": False}
+    pages = []
+    try:
+        pdf_reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+        pages = [page.extract_text() or "" for page in itertools.islice(pdf_reader.pages, max_pages)]
+        stats["pages"] = len(pages)
+        stats["truncated"] = len(pages) < len(pdf_reader.pages)
+    except Exception as e:
+        stats["error"] = str(e)
+
+    reason = "truncated" if stats["truncated"] else transcript_text_layer_issue(pages)
+    stats["reason"] = reason
+    stats["text"] = compact_transcript_text(pages) if reason is None else None
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return stats
+
+def http_status_for(e: Exception) -> int:
+    """Gemini 错误映射为对应状态码，其余异常仍为 500"""
+    return e.http_status if isinstance(e, GeminiError) else 500
+
+def resolve_api_key(api_key: str) -> str:
+    """优先使用环境变量中的API Key"""
+    return GOOGLE_API_KEY if GOOGLE_API_KEY else api_key
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中文约 1 字 1 token，其余约 4 字符 1 token"""
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
+    return cjk + (len(text) - cjk + 3) // 4
+
+MEDIA_TOKEN_ESTIMATE = 258  # 单张图片/单页文档的大致输入 token 数
+
+def estimate_context_tokens(text_context=None, media_content=None) -> int:
+    """估算素材文本 + 媒体的输入 token 数；媒体中的文本部分 (如成绩单文字层) 按文本估算"""
+    media_tokens = sum(
+        estimate_tokens(item) if isinstance(item, str) else MEDIA_TOKEN_ESTIMATE
+        for item in as_media_list(media_content)
+    )
+    return estimate_tokens(text_context or "") + media_tokens
+
+def as_media_list(media_content) -> list:
+    """把 None / 单个媒体 / 媒体列表统一为列表"""
+    if media_content is None:
+        return []
+    if isinstance(media_content, list):
+        return media_content
+    return [media_content]
+
+def build_context_parts(media_content=None, text_context=None) -> list:
+    """组装提示词之外的上下文部分 (素材文本 + 媒体)"""
+    parts = []
     if text_context:
-        content.append(f"\n【参考文档/背景信息 (简历或素材表)】:\n{text_context}")
-
+        parts.append(f"\n【参考文档/背景信息 (简历或素材表)】:\n{text_context}")
     if media_content:
-        if isinstance(media_content, list):
-            content.extend(media_content)
-        else:
-            content.append(media_content)
+        parts.extend(as_media_list(media_content))
+    return parts
 
-    try:
-        response = model.generate_content(content)
-        return response.text
-    except Exception as e:
-        return f"Error: {str(e)}"
+def build_gemini_content(prompt: str, media_content=None, text_context=None) -> list:
+    """组装发送给 Gemini 的 content 列表"""
+    return [prompt] + build_context_parts(media_content, text_context)
+
+# ==========================================
+# Gemini 容错层 (错误分类 / 重试退避 / 熔断)
+# ==========================================
+class GeminiError(Exception):
+    """分类后的 Gemini 调用错误"""
+
+    def __init__(self, message: str, kind: str = "unknown", status: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+        self.retryable = retryable
+
+    @property
+    def http_status(self) -> int:
+        """映射为返回给前端的 HTTP 状态码"""
+        if self.kind == "circuit_open" or self.status in (429, 503):
+            return 503
+        if self.kind == "timeout":
+            return 504
+        if self.status in (400, 401, 403, 404):
+            return self.status
+        return 502
+
+class GeminiCircuitOpenError(GeminiError):
+    """模型熔断中，直接快速失败"""
+
+    def __init__(self, model_name: str, retry_after: float):
+        super().__init__(
+            f"Gemini model {model_name} is temporarily unavailable (circuit open), retry in {retry_after:.0f}s",
+            kind="circuit_open", status=503, retryable=False
+        )
+        self.retry_after = retry_after
+
+def _retryable_google_errors() -> tuple:
+    return (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.Aborted,
+    )
+
+def classify_gemini_error(exc: BaseException) -> GeminiError:
+    """把 SDK/网络异常归类为 GeminiError，并判断是否值得重试"""
+    if isinstance(exc, GeminiError):
+        return exc
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return GeminiError("Gemini call exceeded its deadline", kind="timeout", status=504, retryable=True)
+    if isinstance(exc, google_exceptions.GoogleAPICallError):
+        status = int(exc.code) if isinstance(exc.code, int) else None
+        if isinstance(exc, _retryable_google_errors()):
+            kind = "rate_limited" if isinstance(exc, (google_exceptions.TooManyRequests, google_exceptions.ResourceExhausted)) else "unavailable"
+            return GeminiError(str(exc), kind=kind, status=status, retryable=True)
+        if isinstance(exc, (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied)):
+            return GeminiError(str(exc), kind="auth", status=status, retryable=False)
+        return GeminiError(str(exc), kind="bad_request", status=status, retryable=False)
+    if isinstance(exc, (ConnectionError, google_exceptions.RetryError)):
+        return GeminiError(str(exc), kind="unavailable", status=503, retryable=True)
+    return GeminiError(str(exc), kind="unknown", retryable=False)
+
+def backoff_delay(attempt: int) -> float:
+    """带 full jitter 的指数退避时间 (attempt 从 0 开始)"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+# 进程内的 LLM 调用计数 (calls / retries / failures / 熔断等)
+llm_stats: Counter = Counter()
+
+class CircuitBreaker:
+    """单个模型的熔断器：连续 failure_threshold 次可重试类失败后熔断 reset_seconds 秒，
+    之后放行一次探测调用 (half-open)，成功则恢复。"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half_open"
+            return "open"
+
+    def before_call(self) -> bool:
+        """熔断中直接抛出 GeminiCircuitOpenError；返回本次调用是否为 half-open 探测"""
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_seconds or self._probe_in_flight:
+                llm_stats["circuit_rejections"] += 1
+                raise GeminiCircuitOpenError(self.name, max(self.reset_seconds - elapsed, 1))
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """探测调用被取消 (既非成功也非失败) 时释放探测名额，下一次调用重新探测"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error: GeminiError):
+        with self._lock:
+            self._probe_in_flight = False
+            if not error.retryable:
+                return
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Circuit opened for %s after %d failures", self.name, self._failures)
+                    llm_stats["circuit_opened"] += 1
+                self._opened_at = time.monotonic()
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(model_name: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(model_name)
+        if breaker is None:
+            breaker = CircuitBreaker(model_name, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS)
+            _circuit_breakers[model_name] = breaker
+        return breaker
+
+class GeminiClientPool:
+    """按 (api_key, model_name) 复用长期存活的 Gemini 客户端与模型句柄
+
+    每个 API Key 拥有独立的底层客户端，不再调用进程全局的 genai.configure，
+    并发请求之间不会串用 Key；闲置超过 idle_seconds 的句柄会被回收。
+    """
+
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._clients: Dict[str, list] = {}  # api_key -> [client, last_used]
+        self._models: Dict[tuple, list] = {}  # (api_key, model_name) -> [model, last_used]
+
+    def _new_client(self, api_key: str):
+        # 依赖 SDK 私有实现 (_ClientManager / GenerativeModel._client)，requirements 中精确固定了版本，
+        # 升级前先运行 tests/test_gemini_client_pool.py
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        client = manager.get_default_client("generative")
+        # 为底层 RPC 设置截止时间，超时后工作线程也能及时释放
+        client.generate_content = functools.partial(client.generate_content, timeout=LLM_CALL_TIMEOUT_SECONDS)
+        client.stream_generate_content = functools.partial(client.stream_generate_content, timeout=LLM_STREAM_TIMEOUT_SECONDS)
+        return client
+
+    def get_model(self, api_key: str, model_name: str):
+        now = time.monotonic()
+        key = (api_key, model_name)
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._models.get(key)
+            if entry is None:
+                client_entry = self._clients.get(api_key)
+                if client_entry is None:
+                    client_entry = [self._new_client(api_key), now]
+                    self._clients[api_key] = client_entry
+                client_entry[1] = now
+                model = genai.GenerativeModel(model_name)
+                model._client = client_entry[0]
+                entry = [model, now]
+                self._models[key] = entry
+            else:
+                entry[1] = now
+                self._clients[api_key][1] = now
+            return entry[0]
+
+    def _evict_idle(self, now: float):
+        for key in [k for k, (_, last_used) in self._models.items() if now - last_used > self.idle_seconds]:
+            del self._models[key]
+        for api_key in [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_seconds]:
+            client, _ = self._clients.pop(api_key)
+            try:
+                client.transport.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"clients": len(self._clients), "models": len(self._models)}
+
+gemini_client_pool = GeminiClientPool(GEMINI_CLIENT_IDLE_SECONDS)
+
+# ==========================================
+# Gemini 响应缓存
+# ==========================================
+def hash_media_item(item) -> str:
+    """计算单个媒体内容 (PIL 图片或 {mime_type, data} 字典) 的摘要"""
+    digest = hashlib.sha256()
+    if isinstance(item, dict):
+        digest.update(str(item.get("mime_type", "")).encode())
+        data = item.get("data", b"")
+        digest.update(data if isinstance(data, bytes) else str(data).encode())
+    elif "PIL.Image" in sys.modules and isinstance(item, Image.Image):  # 未导入 PIL 时不可能有图片对象
+        digest.update(f"{item.mode}:{item.size}".encode())
+        digest.update(item.tobytes())
+    else:
+        digest.update(repr(item).encode())
+    return digest.hexdigest()
+
+def make_llm_cache_key(model_name: str, prompt: str, media_content=None, text_context=None) -> str:
+    """按 模型 + 提示词 + 文本上下文 + 媒体摘要 计算内容寻址的缓存键"""
+    media_items = as_media_list(media_content)
+    payload = json.dumps({
+        "v": 1,
+        "model": model_name,
+        "prompt": prompt,
+        "text_context": text_context or "",
+        "media": [hash_media_item(item) for item in media_items],
+    }, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """基于 SQLite 的 Gemini 响应缓存，支持 TTL 与按条数/字节数淘汰
+
+    数据库文件可被同一台机器上的多个 uvicorn worker 共享，命中/未命中计数也存于其中。
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int, max_bytes: int):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS llm_cache ("
+                        "key TEXT PRIMARY KEY, model TEXT, value TEXT, size INTEGER, "
+                        "created_at REAL, accessed_at REAL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache(accessed_at)")
+                    conn.execute("CREATE TABLE IF NOT EXISTS llm_cache_stats (name TEXT PRIMARY KEY, value INTEGER)")
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def _bump(self, conn, name: str):
+        conn.execute(
+            "INSERT INTO llm_cache_stats (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None or now - row[1] > self.ttl_seconds:
+                    self._bump(conn, "misses")
+                    return None
+                conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self._bump(conn, "hits")
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning("LLM cache read failed: %s", e)
+            return None
+
+    def set(self, key: str, model_name: str, value: str):
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, value, size, created_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model_name, value, len(value.encode("utf-8")), now, now)
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logger.warning("LLM cache write failed: %s", e)
+
+    def _evict(self, conn, now: float):
+        expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        evicted = 0
+        count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        while count > self.max_entries or total_bytes > self.max_bytes:
+            row = conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (row[0],))
+            count -= 1
+            total_bytes -= row[1]
+            evicted += 1
+        if expired or evicted:
+            conn.execute(
+                "INSERT INTO llm_cache_stats (name, value) VALUES ('evictions', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (expired + evicted,)
+            )
 
-def get_gemini_response_stream(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None):
-    """调用 Gemini API 流式生成"""
-    # 优先使用环境变量中的API Key
-    effective_api_key = GOOGLE_API_KEY if GOOGLE_API_KEY else api_key
+    def stats(self) -> Dict[str, Any]:
+        with closing(self._connect()) as conn:
+            counters = dict(conn.execute("SELECT name, value FROM llm_cache_stats").fetchall())
+            count, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        return {
+            "enabled": LLM_CACHE_ENABLED,
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "entries": count,
+            "bytes": total_bytes,
+        }
+
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_MAX_BYTES)
+
+def require_api_key(api_key: str) -> str:
+    """返回实际使用的 API Key，缺失时抛出 GeminiError"""
+    effective_api_key = resolve_api_key(api_key)
     if not effective_api_key:
-        yield "data: Error: API Key is required. Please set GOOGLE_API_KEY environment variable or provide via request.\n\n"
-        return
+        raise GeminiError(
+            "API Key is required. Please set GOOGLE_API_KEY environment variable or provide via request.",
+            kind="auth", status=401, retryable=False
+        )
+    return effective_api_key
 
-    genai.configure(api_key=effective_api_key)
-    model = genai.GenerativeModel(model_name)
+def get_gemini_response(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None, use_cache: bool = True):
+    """调用 Gemini API (单次尝试，出错时抛出异常，重试由异步调用层负责)"""
+    effective_api_key = require_api_key(api_key)
 
-    content = []
-    content.append(prompt)
+    cache_key = None
+    if LLM_CACHE_ENABLED:
+        cache_key = make_llm_cache_key(model_name, prompt, media_content, text_context)
+        # use_cache=False 时跳过读取，但仍写回最新结果
+        if use_cache:
+            cached = llm_cache.get(cache_key)
+            metrics.inc("ps_cache_requests_total", cache="llm", result="miss" if cached is None else "hit")
+            if cached is not None:
+                return cached
 
-    if text_context:
-        content.append(f"\n【参考文档/背景信息 (简历或素材表)】:\n{text_context}")
+    model = gemini_client_pool.get_model(effective_api_key, model_name)
 
-    if media_content:
-        if isinstance(media_content, list):
-            content.extend(media_content)
-        else:
-            content.append(media_content)
+    content = build_gemini_content(prompt, media_content, text_context)
 
-    try:
+    module = current_module_label()
+    with metrics.timer("ps_gemini_call_duration_seconds", module=module, model=model_name, mode="generate"):
+        response = model.generate_content(content)
+        text = response.text
+    record_gemini_usage(response, module, model_name, prompt, media_content, text_context, text)
+
+    if cache_key:
+        llm_cache.set(cache_key, model_name, text)
+    return text
+
+class StreamCancellation:
+    """跨线程取消一次进行中的 Gemini 流式调用"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._response = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def attach(self, response):
+        self._response = response
+        if self.cancelled:
+            self._abort()
+
+    def cancel(self):
+        self._event.set()
+        self._abort()
+
+    def _abort(self):
+        # 关闭底层 gRPC/REST 流，停止继续接收 (并计费) 后续 token
+        iterator = getattr(self._response, "_iterator", None)
+        cancel = getattr(iterator, "cancel", None)
+        if callable(cancel):
+            try:
+                cancel()
+            except Exception:
+                pass
+
+def iter_gemini_chunks(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None, use_cache: bool = True, cancellation: Optional[StreamCancellation] = None):
+    """同步迭代 Gemini 流式输出的文本块 (出错时抛出异常)"""
+    effective_api_key = require_api_key(api_key)
+
+    cache_key = None
+    if LLM_CACHE_ENABLED:
+        cache_key = make_llm_cache_key(model_name, prompt, media_content, text_context)
+        if use_cache:
+            cached = llm_cache.get(cache_key)
+            metrics.inc("ps_cache_requests_total", cache="llm", result="miss" if cached is None else "hit")
+            if cached is not None:
+                yield cached
+                return
+
+    model = gemini_client_pool.get_model(effective_api_key, model_name)
+
+    content = build_gemini_content(prompt, media_content, text_context)
+
+    module = current_module_label()
+    with metrics.timer("ps_gemini_call_duration_seconds", module=module, model=model_name, mode="stream"):
+        started = time.perf_counter()
         response_stream = model.generate_content(content, stream=True)
-
+        if cancellation is not None:
+            cancellation.attach(response_stream)
+        parts = []
         for chunk in response_stream:
+            if cancellation is not None and cancellation.cancelled:
+                return
             if chunk.text:
-                # 发送SSE格式数据
-                yield f"data: {chunk.text}\n\n"
-    except Exception as e:
-        yield f"data: Error: {str(e)}\n\n"
+                if not parts:
+                    metrics.observe("ps_gemini_ttft_seconds", time.perf_counter() - started, module=module, model=model_name)
+                parts.append(chunk.text)
+                yield chunk.text
+    record_gemini_usage(response_stream, module, model_name, prompt, media_content, text_context, "".join(parts))
+
+    # 只有完整结束的流才写入缓存
+    if cache_key:
+        llm_cache.set(cache_key, model_name, "".join(parts))
+
+# ==========================================
+# Gemini 异步调用层
+# ==========================================
+# SDK 调用是阻塞的，统一放进有界线程池执行，避免阻塞 uvicorn 的事件循环
+_llm_executor = ThreadPoolExecutor(max_workers=LLM_THREAD_POOL_SIZE, thread_name_prefix="gemini")
+_STREAM_DONE = object()
+
+async def gemini_generate(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None, use_cache: bool = True) -> str:
+    """异步调用 Gemini API (在线程池中执行，不阻塞事件循环)
+
+    可重试的错误 (429/5xx/超时) 按指数退避重试，最终失败时抛出 GeminiError。
+    """
+    loop = asyncio.get_running_loop()
+    breaker = get_circuit_breaker(model_name)
+    call = functools.partial(
+        get_gemini_response,
+        api_key=api_key,
+        model_name=model_name,
+        prompt=prompt,
+        media_content=media_content,
+        text_context=text_context,
+        use_cache=use_cache
+    )
+
+    attempt = 0
+    while True:
+        probe = breaker.before_call()
+        llm_stats["calls"] += 1
+        try:
+            # 比 RPC 截止时间稍长，作为兜底
+            # 复制上下文，线程中记录的指标才能拿到 module 标签
+            text = await asyncio.wait_for(
+                loop.run_in_executor(_llm_executor, contextvars.copy_context().run, call),
+                timeout=LLM_CALL_TIMEOUT_SECONDS + 5
+            )
+        except Exception as e:
+            error = classify_gemini_error(e)
+            breaker.record_failure(error)
+            metrics.inc("ps_gemini_errors_total", model=model_name, kind=error.kind)
+            if not error.retryable or attempt >= LLM_MAX_RETRIES:
+                llm_stats["failures"] += 1
+                llm_stats[f"failures_{error.kind}"] += 1
+                raise error from e
+            delay = backoff_delay(attempt)
+            attempt += 1
+            llm_stats["retries"] += 1
+            logger.warning("Gemini %s call failed (%s), retry %d/%d in %.1fs", model_name, error.kind, attempt, LLM_MAX_RETRIES, delay)
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            # 取消 (CancelledError 等) 不计入成功或失败，只释放探测名额
+            if probe:
+                breaker.release_probe()
+            raise
+        breaker.record_success()
+        return text
+
+async def gemini_stream(api_key: str, model_name: str, prompt: str, media_content=None, text_context=None, use_cache: bool = True):
+    """异步迭代 Gemini 流式输出的文本块
+
+    后台线程消费同步的流式响应，通过队列把文本块交回事件循环。
+    调用方提前关闭本生成器 (或任务被取消) 时，会中止上游的 Gemini 流。
+    在收到第一个文本块之前出现可重试错误时，会退避后重新发起流式调用。
+    """
+    loop = asyncio.get_running_loop()
+    breaker = get_circuit_breaker(model_name)
+    attempt = 0
+
+    while True:
+        probe = breaker.before_call()
+        llm_stats["calls"] += 1
+        queue: asyncio.Queue = asyncio.Queue()
+        cancellation = StreamCancellation()
+
+        def produce(queue=queue, cancellation=cancellation):
+            try:
+                for text in iter_gemini_chunks(api_key, model_name, prompt, media_content, text_context, use_cache, cancellation):
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+            except Exception as e:
+                if not cancellation.cancelled:
+                    loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _STREAM_DONE)
+
+        loop.run_in_executor(_llm_executor, contextvars.copy_context().run, produce)
+        finished = False
+        received = False
+        error = None
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_DONE:
+                    finished = True
+                    break
+                if isinstance(item, Exception):
+                    finished = True
+                    error = classify_gemini_error(item)
+                    breaker.record_failure(error)
+                    metrics.inc("ps_gemini_errors_total", model=model_name, kind=error.kind)
+                    if received or not error.retryable or attempt >= LLM_MAX_RETRIES:
+                        llm_stats["failures"] += 1
+                        llm_stats[f"failures_{error.kind}"] += 1
+                        raise error from item
+                    break
+                received = True
+                yield item
+        finally:
+            if not finished:
+                # 调用方提前关闭 (客户端断开) 或被取消：中止上游，不计入熔断器的成功或失败
+                cancellation.cancel()
+                if probe:
+                    breaker.release_probe()
+
+        if error is None:
+            breaker.record_success()
+            return
+        delay = backoff_delay(attempt)
+        attempt += 1
+        llm_stats["retries"] += 1
+        logger.warning("Gemini %s stream failed (%s), retry %d/%d in %.1fs", model_name, error.kind, attempt, LLM_MAX_RETRIES, delay)
+        await asyncio.sleep(delay)
+
+async def generate_text(api_key: str, model_name: str, prompt: str, use_cache: bool = True, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    """返回完整的生成文本；on_chunk 不为空时改用流式调用，每收到一个文本块回调一次"""
+    if on_chunk is None:
+        return await gemini_generate(api_key=api_key, model_name=model_name, prompt=prompt, use_cache=use_cache)
+    parts = []
+    response_stream = gemini_stream(api_key=api_key, model_name=model_name, prompt=prompt, use_cache=use_cache)
+    try:
+        async for text in response_stream:
+            parts.append(text)
+            on_chunk(text)
+    finally:
+        # 提前退出 (任务被取消) 时关闭生成器，从而中止上游 Gemini 流
+        await response_stream.aclose()
+    return "".join(parts)
+
+# ==========================================
+# 文档解析与图片预处理 (进程池)
+# ==========================================
+_doc_executor: Optional[ProcessPoolExecutor] = None
+_doc_executor_lock = threading.Lock()
+
+def get_doc_executor() -> Optional[ProcessPoolExecutor]:
+    """按需创建文档/图片处理进程池 (spawn 方式，避免 fork 带走 gRPC 线程)"""
+    global _doc_executor
+    if DOC_PARSE_WORKERS <= 0:
+        return None
+    with _doc_executor_lock:
+        if _doc_executor is None:
+            _doc_executor = ProcessPoolExecutor(
+                max_workers=DOC_PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _doc_executor
+
+async def read_upload_bytes(upload: UploadFile) -> bytes:
+    """读取上传文件的原始字节，超过 DOC_MAX_BYTES 时返回 413"""
+    with metrics.timer("ps_stage_duration_seconds", stage="file_read"):
+        file_bytes = await upload.read()
+    if len(file_bytes) > DOC_MAX_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件过大: {upload.filename} ({len(file_bytes) // 1024} KB)，上限 {DOC_MAX_BYTES // 1024} KB"
+        )
+    return file_bytes
+
+async def extract_material_bytes(filename: str, file_bytes: bytes) -> Dict[str, Any]:
+    """在进程池中提取素材文本，返回 extract_document_text 的结果"""
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        get_doc_executor(),
+        functools.partial(extract_document_text, filename, file_bytes, DOC_MAX_PAGES)
+    )
+    logger.info(
+        "Extracted %s (%d bytes, pages=%s, truncated=%s) in %.1f ms",
+        result["filename"], result["bytes"], result["pages"], result["truncated"], result["elapsed_ms"]
+    )
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".") or "unknown"
+    metrics.observe("ps_stage_duration_seconds", result["elapsed_ms"] / 1000, stage=f"{extension}_extraction")
+    return result
+
+async def read_material_upload(material_file: UploadFile) -> Dict[str, Any]:
+    """读取上传的素材文件并在进程池中提取文本"""
+    file_bytes = await read_upload_bytes(material_file)
+    return await extract_material_bytes(material_file.filename, file_bytes)
+
+async def preprocess_image_uploads(uploads: List[UploadFile]):
+    """预处理上传的图片：去掉字节完全相同的重复图片，其余并行缩放/重新编码
+
+    返回 (media_list, stats)，media_list 可直接作为 Gemini 的 media_content。
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_doc_executor()
+    seen = set()
+    jobs = []
+    duplicates = 0
+    for upload in uploads:
+        file_bytes = await read_upload_bytes(upload)
+        digest = hashlib.sha256(file_bytes).hexdigest()
+        if digest in seen:
+            duplicates += 1
+            continue
+        seen.add(digest)
+        jobs.append(loop.run_in_executor(
+            executor,
+            functools.partial(preprocess_image_bytes, file_bytes, upload.content_type or "")
+        ))
+
+    results = await asyncio.gather(*jobs)
+    for result in results:
+        metrics.observe("ps_stage_duration_seconds", result["stats"]["elapsed_ms"] / 1000, stage="image_decode")
+    stats = {
+        "images_in": len(uploads),
+        "images_out": len(results),
+        "duplicates_dropped": duplicates,
+        "bytes_before": sum(r["stats"]["bytes_before"] for r in results),
+        "bytes_after": sum(r["stats"]["bytes_after"] for r in results),
+        "images": [r["stats"] for r in results],
+    }
+    if uploads:
+        logger.info(
+            "Preprocessed %d images (%d duplicates dropped): %d -> %d bytes",
+            stats["images_out"], duplicates, stats["bytes_before"], stats["bytes_after"]
+        )
+    return [r["media"] for r in results], stats
+
+TRANSCRIPT_TEXT_HEADER = "【成绩单 (从 PDF 文字层提取的文本)】:\n"
+
+async def prepare_transcript_pdf(file_bytes: bytes):
+    """成绩单 PDF 优先走文字层：可用时发送紧凑文本，扫描件才发送原 PDF
+
+    返回 (media_list, stats)，stats 记录选择的路径与发送给 Gemini 的内容大小。
+    """
+    result = {"pages": None, "truncated": False, "reason": "disabled", "text": None, "elapsed_ms": 0.0}
+    if TRANSCRIPT_TEXT_LAYER_ENABLED:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            get_doc_executor(),
+            functools.partial(extract_transcript_pdf, file_bytes, DOC_MAX_PAGES)
+        )
+        metrics.observe("ps_stage_duration_seconds", result["elapsed_ms"] / 1000, stage="transcript_extraction")
+
+    text = result.pop("text")
+    if text is not None:
+        media = [TRANSCRIPT_TEXT_HEADER + text]
+        stats = {"path": "text_layer", "payload_bytes": len(media[0].encode("utf-8")), "payload_tokens_estimate": estimate_tokens(media[0])}
+    else:
+        media = [{"mime_type": "application/pdf", "data": file_bytes}]
+        stats = {"path": "pdf", "payload_bytes": len(file_bytes), "payload_tokens_estimate": MEDIA_TOKEN_ESTIMATE * (result["pages"] or 1)}
+    stats.update({"bytes": len(file_bytes), **result})
+    logger.info(
+        "Transcript PDF (%d bytes, pages=%s) sent as %s: %d bytes payload (reason=%s, %.1f ms)",
+        stats["bytes"], stats["pages"], stats["path"], stats["payload_bytes"], stats["reason"], stats["elapsed_ms"]
+    )
+    return media, stats
+
+def extraction_summary(result: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """去掉文本本身，只保留可以返回给前端的解析指标"""
+    if result is None:
+        return None
+    return {k: v for k, v in result.items() if k != "text"}
+
+async def prepare_student_inputs(material_file: Optional[UploadFile], transcript_file: Optional[UploadFile], curriculum_files: Optional[List[UploadFile]]) -> Dict[str, Any]:
+    """解析一名学生的共享输入 (素材、成绩单、课程截图)，供多个模块/学校复用"""
+    inputs = {
+        "student_background_text": "",
+        "material_extraction": None,
+        "transcript_content": [],
+        "curriculum_imgs": [],
+        "image_preprocessing": {},
+        "transcript_extraction": None,
+    }
+
+    # Read material file
+    if material_file:
+        inputs["material_extraction"] = await read_material_upload(material_file)
+        inputs["student_background_text"] = inputs["material_extraction"]["text"] or ""
+
+    # Prepare media content
+    if transcript_file:
+        if transcript_file.content_type == "application/pdf":
+            file_bytes = await read_upload_bytes(transcript_file)
+            inputs["transcript_content"], inputs["transcript_extraction"] = await prepare_transcript_pdf(file_bytes)
+        else:
+            # For image files
+            inputs["transcript_content"], inputs["image_preprocessing"]["transcript"] = await preprocess_image_uploads([transcript_file])
+            image_stats = inputs["image_preprocessing"]["transcript"]
+            inputs["transcript_extraction"] = {
+                "path": "image",
+                "bytes": image_stats["bytes_before"],
+                "payload_bytes": image_stats["bytes_after"],
+                "payload_tokens_estimate": MEDIA_TOKEN_ESTIMATE * image_stats["images_out"],
+            }
+
+    if curriculum_files:
+        inputs["curriculum_imgs"], inputs["image_preprocessing"]["curriculum"] = await preprocess_image_uploads(curriculum_files)
+
+    return inputs
+
+@app.on_event("shutdown")
+def shutdown_doc_executor():
+    global _doc_executor
+    with _doc_executor_lock:
+        if _doc_executor is not None:
+            _doc_executor.shutdown(wait=False, cancel_futures=True)
+            _doc_executor = None
 
 # ==========================================
 # 3. 提示词模板 (从原 psw.py 移植)
@@ -316,6 +1660,38 @@ CLEAN_OUTPUT_RULES = """
 5. 必须写成一个完整的、连贯的中文自然段。
 """
 
+# 翻译提示词的禁用词表，TRANSLATION_RULES_BASE 与本地AI词汇扫描共用
+TRANSLATION_BANNED_WORDS = {
+    "Verbs": [
+        "delve into", "uncover", "reveal", "recognize", "master", "refine", "cultivate", "address", "bridge",
+        "spearhead", "pioneer", "align with", "stems from", "underscore", "highlight",
+    ],
+    "Adjectives/Adverbs": [
+        "instrumental", "pivotal", "seamless", "systematically", "rigorously", "profoundly", "deeply", "acutely",
+        "keenly", "comprehensively", "perfectly", "meticulously", "proficiency", "Additionally",
+    ],
+    "Nouns": [
+        "paradigm", "trajectory", "aspirations", "vision", "landscape", "tapestry", "realm", "foundation",
+        "tenure", "testament", "commitment",
+    ],
+    "Connectors": ["thereby", "thus (when used with -ing)", "in turn"],
+    "Phrases": [
+        "not only... but also", "Building on this", "rich tapestry", "testament to", "a wide array of",
+        "my goal is to", "focus will be",
+    ],
+}
+# 精修提示词要求避免的副词 (同样用于本地扫描)
+REFINE_AVOID_ADVERBS = ["significantly", "successfully", "truly", "very"]
+
+def format_banned_words(banned_words: Dict[str, List[str]]) -> str:
+    """把禁用词表渲染成提示词中的 [类别]: 词, 词 列表"""
+    lines = []
+    for category, words in banned_words.items():
+        if category == "Phrases":
+            words = [f'"{word}"' for word in words]
+        lines.append(f"[{category}]: {', '.join(words)}")
+    return "\n".join(lines)
+
 TRANSLATION_RULES_BASE = """
 【Translation Task】
 Translate the provided Chinese text into a professional, human-sounding Personal Statement paragraph that balances academic rigor with narrative flow.
@@ -359,11 +1735,7 @@ Translate the provided Chinese text into a professional, human-sounding Personal
    - **GOAL**: Ensure the text flows smoothly as a unified narrative, not a disjointed list of sentences. The priority is reading fluency and the overall integrity of the article.
 
 【BANNED WORDS LIST (Strictly Prohibited)】
-[Verbs]: delve into, uncover, reveal, recognize, master, refine, cultivate, address, bridge, spearhead, pioneer, align with, stems from, underscore, highlight
-[Adjectives/Adverbs]: instrumental, pivotal, seamless, systematically, rigorously, profoundly, deeply, acutely, keenly, comprehensively, perfectly, meticulously, proficiency, Additionally
-[Nouns]: paradigm, trajectory, aspirations, vision, landscape, tapestry, realm, foundation, tenure, testament, commitment
-[Connectors]: thereby, thus (when used with -ing), in turn
-[Phrases]: "not only... but also", "Building on this", "rich tapestry", "testament to", "a wide array of", "my goal is to"， "focus will be"
+""" + format_banned_words(TRANSLATION_BANNED_WORDS) + """
 
 【OUTPUT REQUIREMENTS】
 1. Provide ONLY the translated English text without explanations, comments, or any Markdown formatting symbols.
@@ -418,7 +1790,7 @@ def get_prompt_academic(target_school_name: str) -> str:
     【任务】撰写 "本科学习经历" (Academic Background) 部分。
     【输入背景】
     - 目标专业: {target_school_name}
-    - 核心依据 (成绩单): 见附带文件 (PDF或图片)
+    - 核心依据 (成绩单): 见附带的成绩单 (提取文本、PDF或图片)
     - 辅助参考 (学生素材/简历): 见附带文本
     【核心原则：深度 > 数量】
     不要罗列课程名。只精选与目标专业最强相关的核心课程进行深度描写。
@@ -460,6 +1832,27 @@ def get_prompt_internship(target_school_name: str) -> str:
     {CLEAN_OUTPUT_RULES}
     """
 
+def get_prompt_material_profile() -> str:
+    """把学生素材压缩为结构化画像，供各模块代替原文使用"""
+    return """
+    【任务】把提供的简历或文书素材整理为一份紧凑的结构化学生画像。后续撰写个人陈述的各个部分时只会看到这份画像，看不到原文。
+
+    【要求】
+    1. 保留所有具体事实：学校、专业、公司/组织/实验室名称、职位、项目名称、课程名称、时间、数字与量化成果、工具与方法。
+    2. 保留学生本人的动机线索、感悟与职业意向 (用一两句话概括，不要丢弃)。
+    3. 删除重复内容、格式噪声、套话和与申请无关的信息；不要编造或推测原文没有的内容。
+    4. 用简短的条目书写，不要写成段落。
+
+    【输出格式】严格按照以下结构输出 (没有的部分写"无")：
+    [基本信息] 姓名/本科学校/专业/GPA/排名/毕业时间
+    [课程] 相关核心课程与成绩 (逗号分隔)
+    [经历] 每段经历一行：时间 | 组织 | 角色 | 做了什么 | 量化成果 | 用到的技能/工具
+    [科研与项目] 每个一行：时间 | 名称 | 角色 | 方法 | 成果
+    [技能] 技术/语言/证书
+    [获奖] 每项一行：时间 | 名称 | 级别
+    [动机与规划] 学生提到的兴趣来源、感悟与职业意向
+    """
+
 def get_prompt_extract_experiences() -> str:
     """提取简历/素材中的课外经历"""
     return """
@@ -591,6 +1984,56 @@ def get_prompt_research_insights(target_school_name: str, matched_intersections:
     3. 洞察应具有前瞻性、具体性和可行性。
     """
 
+def build_inline_edit_prompt(text: str, is_chinese: bool) -> str:
+    """/api/edit 的批注修改提示词 (修改处由后端对比原文后用 ** 标出)"""
+    if is_chinese:
+        return f"""
+        【任务】作为专业留学文书编辑，根据文中的嵌入式批注（中文方括号【】内的文字）修改文章。
+        【输入文本】\n{text}
+        【执行步骤】
+        1. 扫描文中所有的中文方括号 `【】`。括号内的文字即为用户的修改指令。
+        2. 根据指令，修改括号紧邻的前文句子或段落。
+        3. **必须删除**原文中的括号及括号内的修改指令。
+        4. 保持未被批注的部分原封不动。
+        {CLEAN_OUTPUT_RULES}
+        """
+    return f"""
+        【任务】你是一位顶尖的留学文书编辑。请根据用户在英文文本中嵌入的中文，对文章进行修改和润色。
+
+        【输入文本及批注】
+        {text}
+
+        【批注规则说明】
+        1.  **修改指令 `【中文内容】`**: 如果发现中文被中文方括号 `【】` 包围，这代表一条修改指令。请根据指令内容，修改它前面的英文句子。
+        2.  **翻译并插入**: 如果发现一段中文**没有被任何括号包围**，请将这段中文翻译成地道的英文，并无缝地插入到文本的那个位置。
+
+        【核心风格指令】
+        所有的修改和翻译都必须严格遵守以下【ANTI-AI STYLE GUIDE】。
+        {TRANSLATION_RULES_BASE}
+
+        【输出要求】
+        1.  完成所有修改和翻译。
+        2.  **必须删除**原文中所有的中文内容和 `【】` 括号。
+        3.  输出修改后的完整英文文本。
+        """
+
+def with_edit_context(prompt: str, before: str, after: str) -> str:
+    """在批注修改提示词后附上只读的前后文，并限定只输出被修改的段落"""
+    context = ""
+    if before or after:
+        context = f"""
+    【上下文 (只读)】以下是待修改文本前后的段落，仅用于理解语境，不要修改，也不要输出：
+    <before>
+    {before}
+    </before>
+    <after>
+    {after}
+    </after>"""
+    return f"""{prompt}
+    {context}
+    【输出范围】只输出修改后的输入文本本身，不要输出上下文或任何解释，不要用 ** 标记修改处。
+    """
+
 # ==========================================
 # 润色功能提示词模板 (从 psr.py 移植)
 # ==========================================
@@ -760,7 +2203,7 @@ def build_english_refine_prompt(text_with_instructions: str) -> str:
     - Highlight all modified parts with double asterisks (e.g., **this text was modified**).
     - Follow academic writing best practices.
     - Avoid banned vocabulary: master/mastery, my goal is to, permit, deep comprehension, focus, look forward to, address, command, drawn to/draw, demonstrate (use sparingly), privilege, testament, commitment.
-    - Avoid adverbs (e.g., significantly, truly, very).
+    - Avoid adverbs (e.g., {', '.join(REFINE_AVOID_ADVERBS)}).
 
     **Input Text:**
     {text_with_instructions}
@@ -769,8 +2212,11 @@ def build_english_refine_prompt(text_with_instructions: str) -> str:
     Output ONLY the refined English text with modified parts highlighted (no explanations).
     """
 
-def build_remove_ai_vocab_prompt(text: str) -> str:
-    """构建用于去除AI写作高频词汇和句式的提示词"""
+def build_remove_ai_vocab_prompt(text: str, flagged_terms: Optional[List[str]] = None) -> str:
+    """构建用于去除AI写作高频词汇和句式的提示词 (flagged_terms 为本地扫描命中的词句)"""
+    flagged = ""
+    if flagged_terms:
+        flagged = "\n**本地扫描命中（优先处理）：** " + "; ".join(dict.fromkeys(flagged_terms)) + "\n"
     return f"""
 你是一位专业的英文写作编辑，任务是去除个人陈述中的AI写作高频词汇和句式，使文本更加自然、个性化。
 
@@ -827,7 +2273,7 @@ C. **Sentence Structure Variety (Balanced Rule)**: AI models often overuse the "
 
 **输入文本：**
 {text}
-
+{flagged}
 **输出：**
 只输出修改后的文本，不要有任何前言或说明。
 """
@@ -851,6 +2297,1660 @@ english_modules = {
 
 display_order = ["Motivation", "Academic", "Internship", "Why_School", "Career_Goal"]
 
+def log_abandoned_stream(remaining_modules: List[str], current_output: str, completed_tokens: List[int]):
+    """记录客户端断开后被中止的生成，以及估算节省的输出 token 数"""
+    per_module = (sum(completed_tokens) // len(completed_tokens)) if completed_tokens else STREAM_MODULE_TOKEN_ESTIMATE
+    saved_tokens = max(per_module * len(remaining_modules) - estimate_tokens(current_output), 0)
+    logger.info(
+        "SSE client disconnected; aborted stream and skipped modules %s (~%d output tokens saved)",
+        remaining_modules, saved_tokens
+    )
+
+def sse_event(event: Optional[str], data) -> str:
+    """格式化一个 SSE 事件；event 为 None 时是默认的 message 事件 (文本块)"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def chunk_emitter(emit: Optional[Callable[..., None]], **tags) -> Optional[Callable[[str], None]]:
+    """把文本块包装成 {"chunk": ...} 事件 (附带 tags)；emit 为空时返回 None (非流式)"""
+    if emit is None:
+        return None
+    return lambda text: emit(None, {**tags, "chunk": text})
+
+def build_module_request(module: str, target_school_name: str, counselor_strategy: str, curriculum_text: str, transcript_content, curriculum_imgs):
+    """根据模块类型返回 (prompt, media)，未知模块返回 None"""
+    if module == "Motivation":
+        return get_prompt_motivation(target_school_name), None
+    elif module == "Career_Goal":
+        return get_prompt_career(target_school_name, counselor_strategy), None
+    elif module == "Academic":
+        return get_prompt_academic(target_school_name), transcript_content
+    elif module == "Why_School":
+        return get_prompt_whyschool(target_school_name, counselor_strategy, curriculum_text or ""), curriculum_imgs
+    elif module == "Internship":
+        return get_prompt_internship(target_school_name), None
+    return None
+
+MATERIAL_PROFILE_HEADER = "(以下为学生素材的结构化摘要，保留了原文中的具体事实、数字与时间)\n"
+
+def make_material_profile_cache_key(material_digest: str, model_name: str) -> str:
+    """素材画像的缓存键：素材文本哈希 + 模型 + 画像提示词"""
+    payload = json.dumps({
+        "v": 1,
+        "stage": "material_profile",
+        "model": model_name,
+        "prompt": hashlib.sha256(get_prompt_material_profile().encode("utf-8")).hexdigest(),
+        "material": material_digest,
+    })
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def distill_material_profile(inputs: Dict[str, Any], api_key: str, model_name: str, use_cache: bool = True, enabled: Optional[bool] = None):
+    """把素材压缩为结构化画像并替换 inputs["student_background_text"]，统计写入 inputs["material_profile"]
+
+    画像按素材文本哈希缓存：同一份素材换学校或重新生成时不再调用模型。
+    未启用、素材过短或画像不比原文短时保留原文。
+    """
+    enabled = MATERIAL_PROFILE_ENABLED if enabled is None else enabled
+    source_text = inputs["student_background_text"]
+    if not enabled or not source_text:
+        return
+    stats = {"used": False, "cached": False, "source_chars": len(source_text), "source_tokens": estimate_tokens(source_text)}
+    inputs["material_profile"] = stats
+    if len(source_text) < MATERIAL_PROFILE_MIN_CHARS:
+        stats["reason"] = "material_too_short"
+        return
+
+    loop = asyncio.get_running_loop()
+    profile_model = MATERIAL_PROFILE_MODEL or model_name
+    started = time.perf_counter()
+    cache_key = make_material_profile_cache_key(hashlib.sha256(source_text.encode("utf-8")).hexdigest(), profile_model)
+    profile = None
+    if use_cache and LLM_CACHE_ENABLED:
+        profile = await loop.run_in_executor(_llm_executor, llm_cache.get, cache_key)
+        metrics.inc("ps_cache_requests_total", cache="material_profile", result="miss" if profile is None else "hit")
+    if profile is not None:
+        stats["cached"] = True
+    else:
+        with gemini_module("material_profile"):
+            profile = await gemini_generate(
+                api_key=api_key,
+                model_name=profile_model,
+                use_cache=use_cache,
+                prompt=get_prompt_material_profile(),
+                text_context=source_text
+            )
+        profile = profile.strip()
+        if LLM_CACHE_ENABLED and profile:
+            await loop.run_in_executor(_llm_executor, llm_cache.set, cache_key, profile_model, profile)
+    stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+    profile_text = MATERIAL_PROFILE_HEADER + profile
+    if not profile or len(profile_text) >= len(source_text):
+        stats["reason"] = "profile_not_shorter"
+        return
+    inputs["student_background_text"] = profile_text
+    stats.update(used=True, profile_chars=len(profile_text), profile_tokens=estimate_tokens(profile_text))
+    logger.info(
+        "Material profile (%s): %d -> %d chars, ~%d input tokens saved per module call",
+        "cached" if stats["cached"] else profile_model, stats["source_chars"], stats["profile_chars"],
+        stats["source_tokens"] - stats["profile_tokens"]
+    )
+
+def material_profile_report(inputs: Dict[str, Any], modules_list: List[str]) -> Optional[Dict[str, Any]]:
+    """素材画像统计，附各模块单次调用的估算输入 token (原文 vs 画像)"""
+    stats = inputs.get("material_profile")
+    if not stats or not stats["used"]:
+        return stats
+    modules = {}
+    for module in modules_list:
+        module_request = build_module_request(module, "", "", "", inputs["transcript_content"], inputs["curriculum_imgs"])
+        if module_request is None:
+            continue
+        prompt, media = module_request
+        base_tokens = estimate_tokens(prompt) + MEDIA_TOKEN_ESTIMATE * len(as_media_list(media))
+        modules[module] = {
+            "input_tokens_raw": base_tokens + stats["source_tokens"],
+            "input_tokens_profile": base_tokens + stats["profile_tokens"],
+            "input_tokens_saved": stats["source_tokens"] - stats["profile_tokens"],
+        }
+    return {**stats, "modules": modules, "input_tokens_saved": sum(entry["input_tokens_saved"] for entry in modules.values())}
+
+def split_motivation_response(response: str):
+    """拆分动机模块输出，返回 (trends, draft)"""
+    if "[TRENDS_START]" in response and "[DRAFT_START]" in response:
+        trends_part = response.split("[TRENDS_START]")[1].split("[TRENDS_END]")[0].strip()
+        draft_part = response.split("[DRAFT_START]")[1].split("[DRAFT_END]")[0].strip()
+        return trends_part, draft_part
+    return "", response
+
+class DelimitedStreamParser:
+    """增量解析带分隔符的流式输出，把文本块按所在区段分发
+
+    markers 为 {分隔符: 之后进入的区段名}，区段名为 None 的文本 (区段之外) 被丢弃。
+    分隔符可能被拆在相邻两个文本块之间：缓冲区末尾可能是某个分隔符开头的部分会先保留，等下一块到达再判断。
+    fallback_section 不为空时，若开头 fallback_after 个字符内没有出现任何分隔符，之后 (包括已缓冲的) 文本都归入该区段。
+    """
+
+    def __init__(self, markers: Dict[str, Optional[str]], fallback_section: Optional[str] = None, fallback_after: int = 200):
+        self.markers = sorted(markers, key=len, reverse=True)
+        self.sections = markers
+        self.fallback_section = fallback_section
+        self.fallback_after = fallback_after
+        self.section: Optional[str] = None
+        self.seen_marker = False
+        self._buffer = ""
+        self._section_start = True
+
+    def feed(self, text: str) -> List[tuple]:
+        """返回 [("marker", 分隔符, None) | ("text", 区段名, 文本)]"""
+        self._buffer += text
+        events = []
+        while True:
+            found = [(self._buffer.find(marker), marker) for marker in self.markers]
+            found = [(index, marker) for index, marker in found if index >= 0]
+            if not found:
+                break
+            index, marker = min(found, key=lambda item: item[0])
+            self._emit(self._buffer[:index], events)
+            self._buffer = self._buffer[index + len(marker):]
+            self.section = self.sections[marker]
+            self.seen_marker = True
+            self._section_start = True
+            events.append(("marker", marker, None))
+
+        if not self.seen_marker and self.fallback_section is not None:
+            if len(self._buffer) < self.fallback_after:
+                return events
+            self.section = self.fallback_section
+            self.seen_marker = True
+        keep = self._partial_marker_length()
+        self._emit(self._buffer[:len(self._buffer) - keep], events)
+        self._buffer = self._buffer[len(self._buffer) - keep:]
+        return events
+
+    def close(self) -> List[tuple]:
+        """流结束时输出缓冲区中剩余的文本"""
+        if not self.seen_marker and self.fallback_section is not None:
+            self.section = self.fallback_section
+        events = []
+        self._emit(self._buffer, events)
+        self._buffer = ""
+        return events
+
+    def _partial_marker_length(self) -> int:
+        for length in range(min(len(self._buffer), max(map(len, self.markers)) - 1), 0, -1):
+            tail = self._buffer[-length:]
+            if any(marker.startswith(tail) for marker in self.markers):
+                return length
+        return 0
+
+    def _emit(self, text: str, events: List[tuple]):
+        if self.section is None:
+            return
+        if self._section_start:
+            # 去掉分隔符后的换行与空白
+            text = text.lstrip()
+        if text:
+            self._section_start = False
+            events.append(("text", self.section, text))
+
+MOTIVATION_STREAM_MARKERS = {
+    "[TRENDS_START]": "trends",
+    "[TRENDS_END]": None,
+    "[DRAFT_START]": "draft",
+    "[DRAFT_END]": None,
+}
+
+REFINE_SECTION_MARKER = "===SECTION==="
+REFINE_STREAM_MARKERS = {
+    REFINE_SECTION_MARKER: None,
+    "[[LOGIC]]": "logic",
+    "[[DRAFT]]": "draft",
+}
+
+def parse_refine_section(sec: str) -> Optional[Dict[str, str]]:
+    """解析旧文书分析中的单个段落，不含核心标记时返回 None"""
+    if not sec.strip():
+        return None
+    # 过滤不包含核心标记的段落
+    if "[[LOGIC]]" not in sec and "[[DRAFT]]" not in sec:
+        return None
+
+    logic_part = ""
+    draft_part = ""
+    if "[[LOGIC]]" in sec:
+        parts = sec.split("[[DRAFT]]")
+        logic_part = parts[0].replace("[[LOGIC]]", "").replace("Part 1:", "").strip()
+        if len(parts) > 1:
+            draft_part = parts[1].replace("Part 2:", "").strip()
+    else:
+        draft_part = sec.strip()
+    return {"logic": logic_part, "draft": draft_part}
+
+def build_refine_analysis_result(response: str) -> Dict[str, Any]:
+    """把分析响应解析为结构化段落"""
+    parsed_data = [section for section in map(parse_refine_section, response.split(REFINE_SECTION_MARKER)) if section]
+    return {
+        "success": True,
+        "analysis_result": response,
+        "sections_data": parsed_data
+    }
+
+def emit_section_chunks(emit: Callable[..., None], module: str, events: List[tuple]):
+    """把 DelimitedStreamParser 的文本事件作为 <区段>_chunk 事件推送"""
+    for kind, section, text in events:
+        if kind == "text":
+            emit(f"{section}_chunk", {'module': module, 'chunk': text})
+
+def assemble_chinese_draft(generated_sections: Dict[str, str]) -> str:
+    """按 display_order 拼接完整中文初稿"""
+    full_chinese_draft = ""
+    for module in display_order:
+        if module in generated_sections:
+            full_chinese_draft += f"--- {modules[module]} ---\n"
+            full_chinese_draft += generated_sections[module] + "\n\n"
+    return full_chinese_draft.strip()
+
+def build_translation_prompt(chinese_text: str, spelling_preference: str) -> str:
+    """构建单个模块的中译英提示词"""
+    spelling_instruction = "\n【SPELLING RULE】: STRICTLY use British English spelling (e.g., colour, analyse, programme, centre)."
+    if spelling_preference == "American":
+        spelling_instruction = "\n【SPELLING RULE】: STRICTLY use American English spelling (e.g., color, analyze, program, center)."
+
+    return f"{TRANSLATION_RULES_BASE}\n{spelling_instruction}\n【Input Text】:\n{chinese_text}"
+
+def assemble_english_draft(translations: Dict[str, str]) -> str:
+    """按 display_order 拼接完整英文译文 (未知模块排在最后)"""
+    ordered = [m for m in display_order if m in translations] + [m for m in translations if m not in display_order]
+    return "\n\n".join(f"--- {english_modules.get(m, m)} ---\n{translations[m]}" for m in ordered)
+
+ANNOTATION_PATTERN = re.compile(r'【[^】]*】|\[[^\]]*\]')
+SECTION_HEADER_PATTERN = re.compile(r'^\s*---.*---\s*$')
+DIFF_TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]|[A-Za-z0-9_\'’-]+|\s+|[^\sA-Za-z0-9_\u4e00-\u9fff]')
+
+def strip_annotations(text: str) -> str:
+    return ANNOTATION_PATTERN.sub('', text)
+
+def find_edit_spans(paragraphs: List[str], is_target: Callable[[str], bool]) -> List[List[int]]:
+    """返回需要修改的段落区间 [start, end] (含两端)
+
+    只有批注、没有正文的段落 (批注单独成行) 视为针对上一段，连同上一段一起修改；
+    相邻或重叠的区间会被合并，分段标题 (--- X ---) 不会被修改。
+    """
+    spans = []
+    for index, paragraph in enumerate(paragraphs):
+        if SECTION_HEADER_PATTERN.match(paragraph) or not is_target(paragraph):
+            continue
+        start = index
+        if not strip_annotations(paragraph).strip() and index > 0 and not SECTION_HEADER_PATTERN.match(paragraphs[index - 1]):
+            start = index - 1
+        if spans and start <= spans[-1][1] + 1:
+            spans[-1][1] = index
+        else:
+            spans.append([start, index])
+    return spans
+
+def highlight_changes(original: str, edited: str) -> str:
+    """对比原文与修改后的文本，把新增或改写的部分用 ** 包裹"""
+    old_tokens = DIFF_TOKEN_PATTERN.findall(original)
+    new_tokens = DIFF_TOKEN_PATTERN.findall(edited)
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+
+    # 先标记每个新 token 是否为改动，再把连续的改动 (中间只隔空白) 合并成一段
+    changed = [False] * len(new_tokens)
+    for tag, _, _, j1, j2 in matcher.get_opcodes():
+        if tag in ("replace", "insert"):
+            for j in range(j1, j2):
+                changed[j] = not new_tokens[j].isspace()
+    output = []
+    run = []
+    for token, is_changed in zip(new_tokens, changed):
+        if is_changed or (run and token.isspace()):
+            run.append(token)
+            continue
+        if run:
+            output.append(_wrap_highlight("".join(run)))
+            run = []
+        output.append(token)
+    if run:
+        output.append(_wrap_highlight("".join(run)))
+    return "".join(output)
+
+def _wrap_highlight(segment: str) -> str:
+    core = segment.rstrip()
+    return f"**{core}**{segment[len(core):]}" if core else segment
+
+async def edit_annotated_paragraphs(
+    text: str,
+    is_target: Callable[[str], bool],
+    build_prompt: Callable[[str], str],
+    api_key: str,
+    model_name: str,
+    use_cache: bool = True,
+    highlight: bool = False,
+    max_concurrency: int = GENERATION_CONCURRENCY,
+    emit: Optional[Callable[..., None]] = None,
+):
+    """只把带批注的段落 (附少量只读上下文) 并发发送给模型，再拼回未改动的原文
+
+    返回 (edited_text, stats)。highlight=True 时在本地对比原文，用 ** 标出改动。
+    传入 emit 时流式调用，推送带 span 下标的文本块，每段改完后推送 span_complete。
+    """
+    # 奇数下标是原样保留的换行分隔符，拼接时不会改变原文格式
+    parts = re.split(r'(\n+)', text)
+    paragraphs = parts[0::2]
+    spans = find_edit_spans(paragraphs, is_target)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    def span_text(start: int, end: int) -> str:
+        return "".join(parts[2 * start:2 * end + 1])
+
+    async def edit_span(index: int, start: int, end: int) -> str:
+        before = "\n".join(p for p in paragraphs[max(0, start - EDIT_CONTEXT_PARAGRAPHS):start] if p.strip())
+        after = "\n".join(p for p in paragraphs[end + 1:end + 1 + EDIT_CONTEXT_PARAGRAPHS] if p.strip())
+        async with semaphore:
+            response = await generate_text(
+                api_key=api_key,
+                model_name=model_name,
+                use_cache=use_cache,
+                prompt=with_edit_context(build_prompt(span_text(start, end)), before, after),
+                on_chunk=chunk_emitter(emit, span=index)
+            )
+        edited = response.strip().replace("**", "")
+        if highlight:
+            edited = highlight_changes(strip_annotations(span_text(start, end)), edited)
+        if emit is not None:
+            emit("span_complete", {"span": index, "paragraphs": [start, end], "text": edited})
+        return edited
+
+    edited_spans = await asyncio.gather(*(edit_span(index, start, end) for index, (start, end) in enumerate(spans)))
+
+    output = []
+    cursor = 0
+    for (start, end), edited in zip(spans, edited_spans):
+        output.append("".join(parts[cursor:2 * start]))
+        output.append(edited)
+        cursor = 2 * end + 1
+    output.append("".join(parts[cursor:]))
+
+    stats = {
+        "paragraphs": sum(1 for p in paragraphs if p.strip()),
+        "edited_paragraphs": sum(end - start + 1 for start, end in spans),
+        "calls": len(spans),
+        "chars_total": len(text),
+        "chars_sent": sum(len(span_text(start, end)) for start, end in spans),
+    }
+    return "".join(output), stats
+
+async def generate_modules_concurrently(
+    modules_list: List[str],
+    api_key: str,
+    model_name: str,
+    target_school_name: str,
+    counselor_strategy: str,
+    curriculum_text: str,
+    student_background_text: str,
+    transcript_content,
+    curriculum_imgs,
+    max_concurrency: int = GENERATION_CONCURRENCY,
+    use_cache: bool = True,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    on_module_complete: Optional[Callable[..., Awaitable[None]]] = None,
+):
+    """并发生成多个模块，返回 (generated_sections, motivation_trends, module_status)
+
+    每个模块独立计时与报错：某个模块失败或超时不会影响其他模块的结果。
+    传入 semaphore 时与其他调用方共享并发上限 (多校批量生成)。
+    on_module_complete(module, response, status) 在每个模块结束时被调用 (用于记录任务进度)。
+    """
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run_module(module: str):
+        # 每个模块在 gather 创建的独立任务中运行，标签只作用于本模块的调用
+        gemini_module_label.set(module)
+        module_request = build_module_request(
+            module, target_school_name, counselor_strategy, curriculum_text,
+            transcript_content, curriculum_imgs
+        )
+        if module_request is None:
+            return module, None, {"success": False, "error": f"Unknown module: {module}"}
+        prompt, current_media = module_request
+
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    gemini_generate(
+                        api_key=api_key,
+                        model_name=model_name,
+                        prompt=prompt,
+                        media_content=current_media,
+                        text_context=student_background_text,
+                        use_cache=use_cache
+                    ),
+                    timeout=MODULE_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                error = GeminiError(f"Module timed out after {MODULE_TIMEOUT_SECONDS:.0f}s", kind="timeout", status=504, retryable=True)
+            except Exception as e:
+                error = classify_gemini_error(e)
+            else:
+                elapsed = round(time.perf_counter() - started, 3)
+                return module, response, {"success": True, "elapsed_seconds": elapsed}
+            elapsed = round(time.perf_counter() - started, 3)
+
+        logger.warning("Module %s failed after %.1fs: %s", module, elapsed, error)
+        return module, None, {
+            "success": False,
+            "error": str(error),
+            "error_kind": error.kind,
+            "retryable": error.retryable,
+            "elapsed_seconds": elapsed
+        }
+
+    async def run_and_report(module: str):
+        result = await run_module(module)
+        if on_module_complete is not None:
+            await on_module_complete(*result)
+        return result
+
+    results = await asyncio.gather(*(run_and_report(module) for module in modules_list))
+
+    generated_sections = {}
+    motivation_trends = ""
+    module_status = {}
+    for module, response, status in results:
+        module_status[module] = status
+        if response is None:
+            continue
+        final_text = response.strip()
+        # Special handling for Motivation module
+        if module == "Motivation":
+            trends_part, final_text = split_motivation_response(response)
+            if trends_part:
+                motivation_trends = trends_part
+        generated_sections[module] = final_text
+
+    return generated_sections, motivation_trends, module_status
+
+
+async def generate_statement_payload(
+    api_key: str,
+    model_name: str,
+    use_cache: bool,
+    target_school_name: str,
+    counselor_strategy: str,
+    modules_list: List[str],
+    curriculum_text: str,
+    material_file: Optional[UploadFile],
+    transcript_file: Optional[UploadFile],
+    curriculum_files: Optional[List[UploadFile]],
+    max_concurrency: int = GENERATION_CONCURRENCY,
+    on_module_complete: Optional[Callable[..., Awaitable[None]]] = None,
+    material_profile: Optional[bool] = None,
+) -> Dict[str, Any]:
+    """解析学生输入并并发生成所选模块，返回 /api/generate 的响应内容"""
+    inputs = await prepare_student_inputs(material_file, transcript_file, curriculum_files)
+    await distill_material_profile(inputs, api_key, model_name, use_cache, material_profile)
+
+    # Generate selected modules concurrently (bounded per request)
+    generated_sections, motivation_trends, module_status = await generate_modules_concurrently(
+        modules_list=modules_list,
+        api_key=api_key,
+        model_name=model_name,
+        use_cache=use_cache,
+        target_school_name=target_school_name,
+        counselor_strategy=counselor_strategy,
+        curriculum_text=curriculum_text,
+        student_background_text=inputs["student_background_text"],
+        transcript_content=inputs["transcript_content"],
+        curriculum_imgs=inputs["curriculum_imgs"],
+        max_concurrency=max_concurrency,
+        on_module_complete=on_module_complete
+    )
+
+    return {
+        "success": True,
+        "generated_sections": generated_sections,
+        "full_chinese_draft": assemble_chinese_draft(generated_sections),
+        "motivation_trends": motivation_trends,
+        "module_status": module_status,
+        "failed_modules": [m for m, status in module_status.items() if not status["success"]],
+        "material_extraction": extraction_summary(inputs["material_extraction"]),
+        "material_profile": material_profile_report(inputs, modules_list),
+        "image_preprocessing": inputs["image_preprocessing"],
+        "transcript_extraction": inputs["transcript_extraction"]
+    }
+
+class ExperienceInputError(ValueError):
+    """经历分析的输入无效 (缺少素材或文件格式不支持)"""
+
+# 经历分析的三个阶段及其在响应中的字段名
+EXPERIENCE_STAGES = {
+    "extract": "extracted_experiences",
+    "match": "matched_intersections",
+    "research": "research_insights",
+}
+
+def make_experience_cache_key(material_digest: str, model_name: str) -> str:
+    """经历提取结果的缓存键：素材文件哈希 + 模型 + 提取提示词"""
+    payload = json.dumps({
+        "v": 1,
+        "stage": "extract",
+        "model": model_name,
+        "prompt": hashlib.sha256(get_prompt_extract_experiences().encode("utf-8")).hexdigest(),
+        "material": material_digest,
+    })
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def run_experience_stages(
+    api_key: str,
+    model_name: str,
+    target_school_name: str,
+    curriculum_text: str,
+    curriculum_imgs,
+    material_file: Optional[UploadFile],
+    manual_experiences: Optional[str],
+    use_cache: bool = True,
+):
+    """依次执行 提取经历 → 匹配课程 → 调研洞察，每完成一个阶段 yield 一次结果
+
+    提取阶段按素材文件哈希缓存：同一份素材换学校重新分析时跳过文件解析和提取调用。
+    """
+    loop = asyncio.get_running_loop()
+
+    # 1. 提取课外经历（从文件或手动输入）
+    started = time.perf_counter()
+    stage = {"stage": "extract", "cached": False, "material_extraction": None}
+    if material_file:
+        file_bytes = await read_upload_bytes(material_file)
+        cache_key = make_experience_cache_key(hashlib.sha256(file_bytes).hexdigest(), model_name)
+        experiences_text = None
+        if use_cache and LLM_CACHE_ENABLED:
+            experiences_text = await loop.run_in_executor(_llm_executor, llm_cache.get, cache_key)
+            metrics.inc("ps_cache_requests_total", cache="extraction", result="miss" if experiences_text is None else "hit")
+        if experiences_text is not None:
+            stage["cached"] = True
+        else:
+            material_extraction = await extract_material_bytes(material_file.filename, file_bytes)
+            if material_extraction["text"] is None:
+                raise ExperienceInputError("只支持 .docx 或 .pdf 文件")
+            stage["material_extraction"] = extraction_summary(material_extraction)
+            with gemini_module("extract_experiences"):
+                experiences_text = await gemini_generate(
+                    api_key=api_key,
+                    model_name=model_name,
+                    use_cache=use_cache,
+                    prompt=get_prompt_extract_experiences(),
+                    text_context=material_extraction["text"]
+                )
+            if LLM_CACHE_ENABLED:
+                await loop.run_in_executor(_llm_executor, llm_cache.set, cache_key, model_name, experiences_text)
+    elif manual_experiences:
+        experiences_text = manual_experiences
+    else:
+        raise ExperienceInputError("请提供文件或手动输入课外经历")
+    stage.update(text=experiences_text, elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+    yield stage
+
+    # 2. 匹配经历与课程设置
+    started = time.perf_counter()
+    with gemini_module("match_curriculum"):
+        matched_intersections = await gemini_generate(
+            api_key=api_key,
+            model_name=model_name,
+            use_cache=use_cache,
+            prompt=get_prompt_match_experiences_curriculum(
+                target_school_name=target_school_name,
+                curriculum_text=curriculum_text or "",
+                experiences_text=experiences_text
+            ),
+            media_content=curriculum_imgs if curriculum_imgs else None
+        )
+    yield {"stage": "match", "text": matched_intersections, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    # 3. 进行调研并输出洞察
+    started = time.perf_counter()
+    with gemini_module("research_insights"):
+        research_insights = await gemini_generate(
+            api_key=api_key,
+            model_name=model_name,
+            use_cache=use_cache,
+            prompt=get_prompt_research_insights(
+                target_school_name=target_school_name,
+                matched_intersections=matched_intersections
+            )
+        )
+    yield {"stage": "research", "text": research_insights, "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+def build_experience_analysis_result(stages: List[Dict[str, Any]], image_preprocessing: Dict[str, Any]) -> Dict[str, Any]:
+    """把各阶段结果组装为 /api/analyze-experiences 的响应"""
+    result = {"success": True}
+    stage_timings = {}
+    material_extraction = None
+    for stage in stages:
+        result[EXPERIENCE_STAGES[stage["stage"]]] = stage["text"]
+        stage_timings[stage["stage"]] = {"elapsed_ms": stage["elapsed_ms"], "cached": stage.get("cached", False)}
+        if stage["stage"] == "extract":
+            material_extraction = stage["material_extraction"]
+    result.update(
+        stage_timings=stage_timings,
+        material_extraction=material_extraction,
+        image_preprocessing=image_preprocessing
+    )
+    return result
+
+# ==========================================
+# 本地AI词汇扫描 (黑名单词汇与句式，只把命中的句子发送给模型)
+# ==========================================
+# 以下词表对应 build_remove_ai_vocab_prompt 中的黑名单，修改提示词时请同步更新；
+# 翻译提示词的禁用词 (TRANSLATION_BANNED_WORDS) 与精修提示词的副词 (REFINE_AVOID_ADVERBS) 直接共用同一份列表
+AI_VOCAB_WORDS = [
+    "address", "cultivate", "master", "permit", "leverage", "utilize",
+    "command of", "commitment", "comprehension", "mastery", "privilege", "tenure", "testament",
+]
+AI_VOCAB_PHRASES = [
+    "draw from", "drawn to", "look forward to", "my goal is to", "building on this", "deep comprehension",
+    "显著提升", "深入理解",
+]
+# 陈腐的比喻 ("旅程" / "工具箱" / "交汇点")；单独的 journey 不算
+AI_VOCAB_METAPHORS = [
+    r"(?:academic|career|research|learning|intellectual|professional)\s+journey",
+    r"skill\s*-?\s*sets?", r"tool\s*-?\s*kits?", r"(?:the\s+)?intersections?\s+(?:of|between)",
+    "旅程", "工具箱", "交汇点",
+]
+# 公式化因果句式 (By doing X, I was able to Y / ...thereby...)
+AI_VOCAB_STRUCTURES = [
+    r"by\s+\w+ing\b[^.!?;\n]{0,200}?,\s*(?:I|we)\s+(?:was|were)\s+able\s+to",
+    r"thereby",
+]
+# master 后接这些内容时是学位名称 (Master's / Master of Science / masters degree)，不算黑名单用法
+DEGREE_FOLLOWER_PATTERN = re.compile(
+    r"['’]s?\b|['’]?\s+(?:of|degrees?|programmes?|programs?|courses?|students?|thesis|level)\b",
+    re.IGNORECASE
+)
+# 翻译禁用词中的常用词只在被禁用的含义下命中 (laid the foundation / my vision for / highlighted how 不算)，
+# 以及无法按字面匹配的句式
+AI_VOCAB_TERM_PATTERNS = {
+    "thus (when used with -ing)": r"thus,?\s+\w+ing",
+    "not only... but also": r"not\s+only\b[^.!?;\n]{0,120}?\bbut\s+also",
+    "foundation": r"(?:solid|strong|firm|robust|sturdy)\s+foundations?",
+    "vision": r"visions?\s+(?:of|to)",
+    "highlight": r"highlight(?:s|ed|ing)?\s+(?:the\s+)?(?:importance|significance|need|value|potential)",
+    "bridge": r"bridg(?:e|es|ed|ing)\s+(?:the\s+)?(?:gaps?|divide)|bridge\s+between",
+    "landscape": r"landscapes?(?!\s+(?:architecture|design|painting|photography|ecology))",
+}
+# 这些词前面是对应的修饰词时是普通名词 (email address / work permit)，不是黑名单中的动词用法
+AI_VOCAB_NOUN_CONTEXTS = {
+    "address": re.compile(r"(?:e-?mail|home|mailing|postal|ip|web|street|billing|shipping|return|permanent)\s+$", re.IGNORECASE),
+    "permit": re.compile(r"(?:work|study|residence|parking|travel|building|research)\s+$", re.IGNORECASE),
+}
+# 副词+动词/形容词：只检查提示词中点名的副词，其余 -ly 词 (butterfly / monopoly / previously) 不算
+AI_VOCAB_ADVERBS = list(dict.fromkeys(
+    [word.lower() for word in TRANSLATION_BANNED_WORDS["Adjectives/Adverbs"] if word.endswith("ly")]
+    + REFINE_AVOID_ADVERBS
+))
+# "Demonstrate" 不严格禁用，只在重复出现时提示
+AI_VOCAB_REPEAT_LIMIT = {"demonstrate": 1}
+
+def _inflected(term: str) -> str:
+    """把词表中的原形扩展为匹配常见屈折变化的正则 (reveal → reveals/revealed/revealing)
+
+    短语只变化第一个词 (look forward to → looking forward to)，副词和短虚词保持原样。
+    """
+    first, *rest = term.split()
+    head = re.escape(first)
+    if first.isascii() and len(first) > 3 and not first.endswith("ly"):
+        if first.endswith("y") and first[-2] not in "aeiou":
+            head = f"{re.escape(first[:-1])}(?:y|ies|ied|ying)"
+        elif first.endswith("e"):
+            head = f"{re.escape(first[:-1])}(?:e|es|ed|ing)"
+        else:
+            # 末尾辅音可能双写 (permit → permitted)
+            head = f"{head}(?:{re.escape(first[-1])}?(?:s|es|ed|ing))?"
+    return head + "".join(rf"\s+{re.escape(word)}" for word in rest)
+
+def _translation_vocab_terms() -> List[tuple]:
+    """把翻译提示词的禁用词表转换为 [(rule, term, pattern)]"""
+    terms = []
+    for category, words in TRANSLATION_BANNED_WORDS.items():
+        for word in words:
+            term = word.lower()
+            if term in AI_VOCAB_ADVERBS:
+                continue
+            if term in AI_VOCAB_TERM_PATTERNS:
+                rule = "structure" if category in ("Connectors", "Phrases") else "word"
+                terms.append((rule, term, AI_VOCAB_TERM_PATTERNS[term]))
+            else:
+                terms.append(("phrase" if " " in term else "word", term, _inflected(term)))
+    return terms
+
+def _build_ai_vocab_rules() -> List[tuple]:
+    """返回 [(rule, term, pattern)]
+
+    组合正则在同一位置按顺序尝试各分支，所以句式排在最前，其余按词条长度从长到短排列
+    (testament to 优先于 testament)。同一词条同时出现在两份黑名单中时只保留第一条。
+    """
+    rules = [("structure", pattern, pattern) for pattern in AI_VOCAB_STRUCTURES]
+    terms = [("phrase", phrase, _inflected(phrase)) for phrase in AI_VOCAB_PHRASES]
+    terms += [("word", word, _inflected(word)) for word in AI_VOCAB_WORDS]
+    terms += [("repeated", word, _inflected(word)) for word in AI_VOCAB_REPEAT_LIMIT]
+    terms += [("metaphor", pattern, pattern) for pattern in AI_VOCAB_METAPHORS]
+    terms += [("adverb", adverb, re.escape(adverb)) for adverb in AI_VOCAB_ADVERBS]
+    seen = {term for _, term, _ in rules}
+    unique = []
+    for rule in terms + _translation_vocab_terms():
+        if rule[1] not in seen:
+            seen.add(rule[1])
+            unique.append(rule)
+    rules += sorted(unique, key=lambda rule: -len(rule[1]))
+    return rules
+
+def _compile_ai_vocab_pattern(rules: List[tuple]) -> re.Pattern:
+    """把所有规则编译成一个组合正则，命名分组 r<i> 对应 rules[i]
+
+    英文分支按首字母分组并加前瞻，每个词首只尝试同一首字母的少数分支，比逐个尝试全部分支快数倍；
+    中文词条没有词边界，单独放在最后。
+    """
+    by_initial = {}
+    generic = []
+    chinese = []
+    for index, (_, _, pattern) in enumerate(rules):
+        branch = f"(?P<r{index}>{pattern})"
+        if re.search(r'[\u4e00-\u9fff]', pattern):
+            chinese.append(branch)
+        elif pattern[0].isalpha() or pattern[0] == ",":
+            by_initial.setdefault(pattern[0].lower(), []).append(branch)
+        else:
+            generic.append(branch)
+    english = [f"(?={re.escape(initial)})(?:{'|'.join(branches)})" for initial, branches in by_initial.items()]
+    return re.compile(rf"\b(?:{'|'.join(english + generic)})\b|{'|'.join(chinese)}", re.IGNORECASE)
+
+AI_VOCAB_RULES = _build_ai_vocab_rules()
+AI_VOCAB_PATTERN = _compile_ai_vocab_pattern(AI_VOCAB_RULES)
+SENTENCE_SPLIT_PATTERN = re.compile(r'((?<=[.!?])\s+|(?<=[。！？；])\s*|\n+)')
+
+def is_sentence_start(text: str, position: int) -> bool:
+    """position 之前 (跳过空白与左引号/括号) 是否为文本开头或句末标点"""
+    before = text[:position].rstrip(" \t\"'“‘(（")
+    return not before or before[-1] in ".!?。！？；\n"
+
+def is_exempt_vocab_hit(text: str, match: re.Match, rule: str, term: str) -> bool:
+    """学位名称、专有名词、标签和普通名词用法不算命中
+
+    词条在句中首字母大写、后接冒号 (Address: / Vision:)、前面是 email / work 这类修饰词，
+    或 master 后接 's / of / degree 等。
+    """
+    if rule in ("structure", "adverb"):
+        return False
+    if text.startswith(":", match.end()):
+        return True
+    noun_context = AI_VOCAB_NOUN_CONTEXTS.get(term)
+    if noun_context is not None and noun_context.search(text, max(0, match.start() - 40), match.start()):
+        return True
+    matched = match.group()
+    # 句中首字母大写的是机构、课程或学位名称 (Computer Vision / Master of Science / Gates Foundation)
+    if matched[0].isupper() and not is_sentence_start(text, match.start()):
+        return True
+    lowered = matched.lower()
+    is_master = lowered.startswith("master") and not lowered.startswith("mastery")
+    return is_master and DEGREE_FOLLOWER_PATTERN.match(text, match.end()) is not None
+
+def scan_ai_vocab(text: str) -> List[Dict[str, Any]]:
+    """扫描黑名单词汇与句式，返回命中列表 [{start, end, text, rule, term}]"""
+    hits = []
+    repeated = {}
+    for match in AI_VOCAB_PATTERN.finditer(text):
+        rule, term, _ = AI_VOCAB_RULES[int(match.lastgroup[1:])]
+        if is_exempt_vocab_hit(text, match, rule, term):
+            continue
+        hit = {"start": match.start(), "end": match.end(), "text": match.group(), "rule": rule, "term": term}
+        if rule == "repeated":
+            repeated.setdefault(term, []).append(hit)
+            continue
+        hits.append(hit)
+    for term, term_hits in repeated.items():
+        if len(term_hits) > AI_VOCAB_REPEAT_LIMIT[term]:
+            hits.extend(term_hits)
+    hits.sort(key=lambda hit: hit["start"])
+    return hits
+
+def split_sentences(text: str) -> List[str]:
+    """按句末标点和换行切分，奇数下标是原样保留的分隔符"""
+    return SENTENCE_SPLIT_PATTERN.split(text)
+
+def lint_ai_vocab(text: str) -> Dict[str, Any]:
+    """/api/lint 的响应内容：命中列表、按规则统计、以及含命中的句子"""
+    hits = scan_ai_vocab(text)
+    parts = split_sentences(text)
+    flagged = []
+    offset = 0
+    for index, part in enumerate(parts):
+        end = offset + len(part)
+        if index % 2 == 0:
+            sentence_hits = [hit for hit in hits if offset <= hit["start"] < end]
+            if sentence_hits:
+                flagged.append({"start": offset, "end": end, "text": part, "terms": [hit["text"] for hit in sentence_hits]})
+        offset = end
+    counts = {}
+    for hit in hits:
+        counts[hit["rule"]] = counts.get(hit["rule"], 0) + 1
+    return {"clean": not hits, "hits": hits, "counts": counts, "flagged_sentences": flagged}
+
+async def remove_ai_vocab_sentences(
+    text: str,
+    api_key: str,
+    model_name: str,
+    use_cache: bool = True,
+    max_concurrency: int = GENERATION_CONCURRENCY,
+    emit: Optional[Callable[..., None]] = None,
+):
+    """本地扫描后只把含黑名单词汇/句式的句子 (附前后句作只读上下文) 并发发送给模型
+
+    返回 (cleaned_text, stats)。没有命中时直接返回原文，不调用模型。
+    传入 emit 时与 edit_annotated_paragraphs 相同，按句推送文本块与 span_complete。
+    """
+    parts = split_sentences(text)
+    hits = scan_ai_vocab(text)
+    starts = []  # 每个句子 (偶数下标) 在原文中的起始位置
+    offset = 0
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            starts.append(offset)
+        offset += len(part)
+    flagged = {}
+    for hit in hits:
+        # 跨句的句式命中算在起始句；键是 parts 中的下标
+        index = 2 * (bisect.bisect_right(starts, hit["start"]) - 1)
+        flagged.setdefault(index, []).append(hit["text"])
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    def neighbour(index: int, step: int) -> str:
+        index += 2 * step
+        return parts[index].strip() if 0 <= index < len(parts) else ""
+
+    async def clean_sentence(span: int, index: int) -> str:
+        sentence = parts[index]
+        async with semaphore:
+            response = await generate_text(
+                api_key=api_key,
+                model_name=model_name,
+                use_cache=use_cache,
+                prompt=with_edit_context(
+                    build_remove_ai_vocab_prompt(sentence, flagged[index]),
+                    neighbour(index, -1), neighbour(index, 1)
+                ),
+                on_chunk=chunk_emitter(emit, span=span)
+            )
+        cleaned = response.strip().replace("**", "")
+        if emit is not None:
+            emit("span_complete", {"span": span, "sentence": index // 2, "text": cleaned})
+        # 保留原句首尾空白，避免拼接后粘连
+        leading = sentence[:len(sentence) - len(sentence.lstrip())]
+        trailing = sentence[len(sentence.rstrip()):]
+        return leading + cleaned + trailing
+
+    indices = sorted(flagged)
+    stats = {
+        "sentences": sum(1 for sentence in parts[0::2] if sentence.strip()),
+        "edited_sentences": len(indices),
+        "calls": len(indices),
+        "hits": len(hits),
+        "chars_total": len(text),
+        "chars_sent": sum(len(parts[index]) for index in indices),
+    }
+    cleaned = await asyncio.gather(*(clean_sentence(span, index) for span, index in enumerate(indices)))
+    for index, sentence in zip(indices, cleaned):
+        parts[index] = sentence
+    return "".join(parts), stats
+
+# ==========================================
+# 异步任务 (Job)：后台运行长时间生成，进度与结果存入 SQLite
+# ==========================================
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+class JobStore:
+    """基于 SQLite 的任务库，记录任务状态、各模块结果与最终响应
+
+    与响应缓存一样由同一台机器上的所有 worker 共享：任务在接收请求的 worker 中运行，
+    任意 worker 都可以查询或订阅其进度。
+    """
+
+    def __init__(self, path: str, retention_seconds: float):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS jobs ("
+                        "id TEXT PRIMARY KEY, kind TEXT, request_hash TEXT, status TEXT, total INTEGER, "
+                        "result TEXT, error TEXT, error_kind TEXT, created_at REAL, updated_at REAL, finished_at REAL)"
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_request ON jobs(kind, request_hash)")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS job_modules ("
+                        "job_id TEXT, module TEXT, status TEXT, result TEXT, finished_at REAL, "
+                        "PRIMARY KEY (job_id, module))"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def create_or_reuse(self, kind: str, request_hash: str, total: int, reuse_finished: bool = True):
+        """创建任务，返回 (job_id, created)
+
+        相同请求已有未中断的进行中任务 (或保留期内的成功任务) 时直接复用，
+        客户端超时重试不会再触发一次完整生成。
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._purge(conn, now)
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE kind = ? AND request_hash = ? AND ("
+                    "(status IN ('queued', 'running') AND updated_at > ?) OR (? AND status = 'succeeded')"
+                    ") ORDER BY created_at DESC LIMIT 1",
+                    (kind, request_hash, now - JOB_STALE_SECONDS, int(reuse_finished))
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return row[0], False
+                job_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, request_hash, status, total, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                    (job_id, kind, request_hash, total, now, now)
+                )
+                conn.execute("COMMIT")
+                return job_id, True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _purge(self, conn, now: float):
+        expired = [r[0] for r in conn.execute(
+            "SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (now - self.retention_seconds,)
+        ).fetchall()]
+        for job_id in expired:
+            conn.execute("DELETE FROM job_modules WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def _update(self, sql: str, params: tuple):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(sql, params)
+
+    def set_running(self, job_id: str):
+        self._update("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def heartbeat(self, job_id: str):
+        self._update("UPDATE jobs SET updated_at = ? WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id))
+
+    def record_module(self, job_id: str, module: str, result: Optional[str], status: Dict[str, Any]):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_modules (job_id, module, status, result, finished_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, module, json.dumps(status), result, now)
+            )
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def finish(self, job_id: str, result: Dict[str, Any]):
+        now = time.time()
+        self._update(
+            "UPDATE jobs SET status = 'succeeded', result = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result, ensure_ascii=False), now, now, job_id)
+        )
+
+    def fail(self, job_id: str, error: str, error_kind: str):
+        now = time.time()
+        self._update(
+            "UPDATE jobs SET status = 'failed', error = ?, error_kind = ?, updated_at = ?, finished_at = ? WHERE id = ?",
+            (error, error_kind, now, now, job_id)
+        )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT kind, status, total, result, error, error_kind, created_at, updated_at, finished_at "
+                "FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            kind, status, total, result, error, error_kind, created_at, updated_at, finished_at = row
+            if status in JOB_ACTIVE_STATUSES and now - updated_at > JOB_STALE_SECONDS:
+                # 运行任务的 worker 已退出 (重启/崩溃)，不会再有结果
+                status, error, error_kind, finished_at = "failed", "Job interrupted (worker stopped)", "interrupted", now
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, error_kind = ?, finished_at = ? WHERE id = ?",
+                    (status, error, error_kind, finished_at, job_id)
+                )
+            modules = {
+                module: {"status": json.loads(module_status), "result": module_result}
+                for module, module_status, module_result in conn.execute(
+                    "SELECT module, status, result FROM job_modules WHERE job_id = ? ORDER BY finished_at", (job_id,)
+                ).fetchall()
+            }
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "progress": {"completed": len(modules), "total": total},
+            "modules": modules,
+            "result": json.loads(result) if result else None,
+            "error": error,
+            "error_kind": error_kind,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "expires_at": finished_at + self.retention_seconds if finished_at else None,
+        }
+
+job_store = JobStore(JOB_STORE_PATH, JOB_RETENTION_SECONDS)
+_job_semaphore = asyncio.Semaphore(max(1, JOB_CONCURRENCY))
+_job_tasks = set()
+
+async def snapshot_upload(upload: Optional[UploadFile]) -> Optional[UploadFile]:
+    """把上传文件读入内存，返回请求结束后仍可读取的副本 (供后台任务使用)"""
+    if upload is None:
+        return None
+    data = await upload.read()
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=upload.filename,
+        headers=Headers({"content-type": upload.content_type or ""})
+    )
+
+def make_job_request_hash(kind: str, fields: Dict[str, Any], uploads: List[Optional[UploadFile]]) -> str:
+    """按 任务类型 + 表单字段 + 上传文件内容 计算请求指纹，用于识别重复提交"""
+    payload = json.dumps({
+        "kind": kind,
+        "fields": fields,
+        "files": [
+            hashlib.sha256(upload.file.getvalue()).hexdigest() if upload is not None else None
+            for upload in uploads
+        ],
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def api_key_digest(api_key: str) -> str:
+    """API Key 的摘要，参与任务指纹，避免不同 Key 的请求复用同一任务"""
+    return hashlib.sha256(resolve_api_key(api_key).encode("utf-8")).hexdigest()
+
+async def job_heartbeat(job_id: str):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        await asyncio.to_thread(job_store.heartbeat, job_id)
+
+async def run_job(job_id: str, job_fn: Callable[[str], Awaitable[Dict[str, Any]]]):
+    """在后台运行任务：排队、心跳并把最终结果或错误写入任务库"""
+    heartbeat = asyncio.create_task(job_heartbeat(job_id))
+    try:
+        async with _job_semaphore:
+            await asyncio.to_thread(job_store.set_running, job_id)
+            try:
+                result = await job_fn(job_id)
+            except asyncio.CancelledError:
+                job_store.fail(job_id, "Job cancelled (server shutting down)", "cancelled")
+                raise
+            except Exception as e:
+                if isinstance(e, HTTPException):
+                    error, error_kind = str(e.detail), "invalid_input"
+                elif isinstance(e, ExperienceInputError):
+                    error, error_kind = str(e), "invalid_input"
+                else:
+                    error, error_kind = str(e), classify_gemini_error(e).kind
+                logger.warning("Job %s failed: %s", job_id, error)
+                await asyncio.to_thread(job_store.fail, job_id, error, error_kind)
+            else:
+                await asyncio.to_thread(job_store.finish, job_id, result)
+    finally:
+        heartbeat.cancel()
+
+def submit_job(job_id: str, job_fn: Callable[[str], Awaitable[Dict[str, Any]]]):
+    task = asyncio.create_task(run_job(job_id, job_fn))
+    # 保留任务引用，避免被垃圾回收
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+
+def job_accepted_response(job_id: str, created: bool) -> JSONResponse:
+    return JSONResponse(status_code=202, content={
+        "success": True,
+        "job_id": job_id,
+        "reused": not created,
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events"
+    })
+
+@app.on_event("shutdown")
+async def cancel_running_jobs():
+    for task in list(_job_tasks):
+        task.cancel()
+    await asyncio.gather(*_job_tasks, return_exceptions=True)
+
+# ==========================================
+# 可续传的 SSE 流：合并文本块、心跳、事件 id 与 Last-Event-ID 续传
+# ==========================================
+class StreamReplayStore:
+    """基于 SQLite 的 SSE 事件缓冲区，由同一台机器上的所有 worker 共享
+
+    生成所在的 worker 定期写入新事件 (每个流只保留最近 STREAM_REPLAY_MAX_EVENTS 个)；
+    客户端带 Last-Event-ID 重连到其他 worker 时，从这里补发并继续跟随后续事件。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS stream_events ("
+                        "stream_id TEXT, seq INTEGER, frame TEXT, PRIMARY KEY (stream_id, seq))"
+                    )
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS streams ("
+                        "stream_id TEXT PRIMARY KEY, done INTEGER, follower_seen REAL, updated_at REAL)"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def append(self, stream_id: str, frames: List[tuple], done: bool):
+        """写入新事件 [(seq, frame)] 并裁掉超出保留数量的旧事件"""
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO stream_events (stream_id, seq, frame) VALUES (?, ?, ?)",
+                [(stream_id, seq, frame) for seq, frame in frames]
+            )
+            if frames:
+                conn.execute(
+                    "DELETE FROM stream_events WHERE stream_id = ? AND seq <= ?",
+                    (stream_id, frames[-1][0] - STREAM_REPLAY_MAX_EVENTS)
+                )
+            conn.execute(
+                "INSERT INTO streams (stream_id, done, follower_seen, updated_at) VALUES (?, ?, 0, ?) "
+                "ON CONFLICT(stream_id) DO UPDATE SET done = excluded.done, updated_at = excluded.updated_at",
+                (stream_id, int(done), now)
+            )
+            if done:
+                # 顺带清理过期的流
+                expired = now - STREAM_REPLAY_TTL_SECONDS
+                conn.execute("DELETE FROM stream_events WHERE stream_id IN (SELECT stream_id FROM streams WHERE updated_at < ?)", (expired,))
+                conn.execute("DELETE FROM streams WHERE updated_at < ?", (expired,))
+
+    def read(self, stream_id: str, after_seq: int) -> Optional[tuple]:
+        """返回 (保留的最早序号, [(seq, frame)], 是否已结束)；流不存在或已过期时返回 None"""
+        with closing(self._connect()) as conn:
+            # 先读结束标记：已结束时，随后读到的事件一定完整
+            row = conn.execute(
+                "SELECT done FROM streams WHERE stream_id = ? AND updated_at > ?",
+                (stream_id, time.time() - STREAM_REPLAY_TTL_SECONDS)
+            ).fetchone()
+            if row is None:
+                return None
+            first_seq = conn.execute("SELECT MIN(seq) FROM stream_events WHERE stream_id = ?", (stream_id,)).fetchone()[0]
+            frames = conn.execute(
+                "SELECT seq, frame FROM stream_events WHERE stream_id = ? AND seq > ? ORDER BY seq",
+                (stream_id, after_seq)
+            ).fetchall()
+        return first_seq, frames, bool(row[0])
+
+    def touch(self, stream_id: str):
+        """记录其他 worker 上仍有客户端在跟随该流"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE streams SET follower_seen = ? WHERE stream_id = ?", (time.time(), stream_id))
+
+    def follower_seen(self, stream_id: str) -> float:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT follower_seen FROM streams WHERE stream_id = ?", (stream_id,)).fetchone()
+        return row[0] if row else 0.0
+
+stream_replay_store = StreamReplayStore(STREAM_REPLAY_STORE_PATH)
+
+class StreamFailed(Exception):
+    """produce 以此结束时，payload 原样作为 error 事件发送 (不加 error_message 前缀)"""
+
+    def __init__(self, payload: Dict[str, Any]):
+        super().__init__(payload.get("error", ""))
+        self.payload = payload
+
+class StreamSession:
+    """一次可续传的 SSE 输出：生成在后台任务中运行，与客户端连接解耦
+
+    连续的同类文本块 (除 chunk 外字段相同) 在 STREAM_COALESCE_MS 内或累计到 STREAM_COALESCE_BYTES 时合并为一个事件。
+    每个事件带 "<stream_id>:<序号>" 形式的 id，最近的事件保留在内存中，并定期同步到共享存储供其他 worker 续传。
+    最后一个连接断开后生成继续运行 STREAM_RESUME_GRACE_SECONDS，期间没有客户端重连则取消，以免浪费 token。
+    """
+
+    def __init__(self):
+        self.stream_id = uuid.uuid4().hex
+        self.frames = deque(maxlen=STREAM_REPLAY_MAX_EVENTS)
+        self.seq = 0
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+        self.listeners = 0
+        self._changed = asyncio.Event()
+        self._pending = None  # [(event, 其他字段), 文本块列表, 字节数]
+        self._flush_handle = None
+        self._unsynced: List[tuple] = []
+        self._synced_done = False
+        self._sync_task: Optional[asyncio.Task] = None
+
+    def emit(self, event: Optional[str], data):
+        chunk = data.get("chunk") if isinstance(data, dict) else None
+        if not isinstance(chunk, str):
+            self._flush_pending()
+            self._append(event, data)
+            return
+        key = (event, {k: v for k, v in data.items() if k != "chunk"})
+        if self._pending is None or self._pending[0] != key:
+            self._flush_pending()
+            self._pending = [key, [], 0]
+        self._pending[1].append(chunk)
+        self._pending[2] += len(chunk.encode("utf-8"))
+        if STREAM_COALESCE_MS <= 0 or self._pending[2] >= STREAM_COALESCE_BYTES:
+            self._flush_pending()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(STREAM_COALESCE_MS / 1000, self._flush_pending)
+
+    def _flush_pending(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending is None:
+            return
+        (event, fields), chunks, _ = self._pending
+        self._pending = None
+        self._append(event, {**fields, "chunk": "".join(chunks)})
+
+    def _append(self, event: Optional[str], data):
+        self.seq += 1
+        frame = f"id: {self.stream_id}:{self.seq}\n" + sse_event(event, data)
+        self.frames.append((self.seq, frame))
+        self._unsynced.append((self.seq, frame))
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.ensure_future(self._sync())
+
+    async def _sync(self):
+        """批量把新事件写入共享存储，供重连到其他 worker 的客户端读取"""
+        while self._unsynced or (self.done and not self._synced_done):
+            if not self.done:
+                await asyncio.sleep(STREAM_REPLAY_SYNC_SECONDS)
+            frames, self._unsynced = self._unsynced, []
+            done = self.done
+            try:
+                await asyncio.to_thread(stream_replay_store.append, self.stream_id, frames, done)
+            except sqlite3.Error as e:
+                logger.warning("SSE replay sync failed for %s: %s", self.stream_id, e)
+            self._synced_done = done
+
+    def frames_after(self, seq: int) -> List[tuple]:
+        if not self.frames:
+            return []
+        start = max(seq - self.frames[0][0] + 1, 0)
+        return list(itertools.islice(self.frames, start, None))
+
+    async def wait(self, timeout: float) -> bool:
+        """等待新事件，超时返回 False"""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def run(self, produce: Callable[[Callable[..., None]], Awaitable[Dict[str, Any]]], error_message: str):
+        try:
+            self.emit("complete", await produce(self.emit))
+        except asyncio.CancelledError:
+            logger.info("SSE stream %s abandoned: no client reconnected within %.0fs", self.stream_id, STREAM_RESUME_GRACE_SECONDS)
+        except StreamFailed as e:
+            self.emit("error", e.payload)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            error_payload = {'error': f"{error_message}: {detail}"}
+            if isinstance(e, GeminiError):
+                error_payload.update({'error_kind': e.kind, 'retryable': e.retryable})
+            self.emit("error", error_payload)
+        finally:
+            self._flush_pending()
+            self.done = True
+            self._notify()
+            # 结束后在内存中再保留一段时间，之后的重连从共享存储读取
+            asyncio.get_running_loop().call_later(STREAM_RESUME_GRACE_SECONDS, _stream_sessions.pop, self.stream_id, None)
+
+    def attach(self):
+        self.listeners += 1
+
+    def detach(self):
+        self.listeners -= 1
+        if self.listeners == 0 and not self.done:
+            self._schedule_abandon_check()
+
+    def _schedule_abandon_check(self):
+        asyncio.get_running_loop().call_later(STREAM_RESUME_GRACE_SECONDS, lambda: asyncio.ensure_future(self._abandon_if_idle()))
+
+    async def _abandon_if_idle(self):
+        if self.listeners or self.done:
+            return
+        try:
+            seen = await asyncio.to_thread(stream_replay_store.follower_seen, self.stream_id)
+        except sqlite3.Error:
+            seen = 0.0
+        if time.time() - seen < STREAM_RESUME_GRACE_SECONDS:
+            # 客户端已重连到其他 worker，稍后再检查
+            self._schedule_abandon_check()
+            return
+        self.task.cancel()
+
+_stream_sessions: Dict[str, StreamSession] = {}
+
+def parse_last_event_id(value: Optional[str]) -> Optional[tuple]:
+    """解析 "<stream_id>:<序号>" 形式的 Last-Event-ID"""
+    stream_id, _, seq = (value or "").strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+def replay_gap_event(stream_id: str, after_seq: int, first_seq: int) -> str:
+    """重连时部分事件已被裁掉：提示客户端以最后的 complete 事件为准"""
+    return sse_event("replay_gap", {"last_event_id": f"{stream_id}:{after_seq}", "first_available_id": f"{stream_id}:{first_seq}"})
+
+async def follow_session(http_request: Request, session: StreamSession, after_seq: int):
+    """推送本 worker 上 session 中 after_seq 之后的事件，空闲时发送心跳注释"""
+    session.attach()
+    try:
+        while True:
+            frames = session.frames_after(after_seq)
+            if frames and frames[0][0] > after_seq + 1:
+                yield replay_gap_event(session.stream_id, after_seq, frames[0][0])
+            for seq, frame in frames:
+                yield frame
+                after_seq = seq
+            if session.seq > after_seq:
+                continue
+            if session.done:
+                return
+            if not await session.wait(STREAM_HEARTBEAT_SECONDS):
+                yield ": ping\n\n"
+                if await http_request.is_disconnected():
+                    return
+    finally:
+        session.detach()
+
+async def follow_replay_store(http_request: Request, stream_id: str, after_seq: int):
+    """从共享存储补发并跟随其他 worker 上的流"""
+    idle = 0.0
+    while True:
+        found = await asyncio.to_thread(stream_replay_store.read, stream_id, after_seq)
+        if found is None:
+            return
+        first_seq, frames, done = found
+        if frames and frames[0][0] > after_seq + 1:
+            yield replay_gap_event(stream_id, after_seq, first_seq)
+        for seq, frame in frames:
+            yield frame
+            after_seq = seq
+        if done:
+            return
+        idle = 0.0 if frames else idle + STREAM_REPLAY_POLL_SECONDS
+        if idle >= STREAM_HEARTBEAT_SECONDS:
+            idle = 0.0
+            yield ": ping\n\n"
+            if await http_request.is_disconnected():
+                return
+        await asyncio.to_thread(stream_replay_store.touch, stream_id)
+        await asyncio.sleep(STREAM_REPLAY_POLL_SECONDS)
+
+def stream_events(http_request: Request, produce: Callable[[Callable[..., None]], Awaitable[Dict[str, Any]]], error_message: str) -> StreamingResponse:
+    """以可续传的 SSE 推送 produce(emit) 运行过程中的事件
+
+    produce 通过 emit(event, data) 推送文本块与进度，返回值与对应的非流式接口相同，作为最后的 complete 事件发送；
+    出错时发送 error 事件。请求带有仍在保留期内的 Last-Event-ID 时，只补发之后的事件，不会重新生成。
+    """
+    resume = parse_last_event_id(http_request.headers.get("last-event-id"))
+
+    async def event_generator():
+        if resume is not None:
+            stream_id, after_seq = resume
+            session = _stream_sessions.get(stream_id)
+            if session is not None:
+                async for frame in follow_session(http_request, session, after_seq):
+                    yield frame
+                return
+            try:
+                found = await asyncio.to_thread(stream_replay_store.read, stream_id, after_seq)
+            except sqlite3.Error:
+                found = None
+            if found is not None:
+                async for frame in follow_replay_store(http_request, stream_id, after_seq):
+                    yield frame
+                return
+            logger.info("SSE stream %s can no longer be resumed; starting a new one", stream_id)
+
+        session = StreamSession()
+        _stream_sessions[session.stream_id] = session
+        session.task = asyncio.ensure_future(session.run(produce, error_message))
+        async for frame in follow_session(http_request, session, 0):
+            yield frame
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+# ==========================================
+# 幂等键与重复请求合并 (single-flight)
+# ==========================================
+# 没有 Idempotency-Key 的请求只合并进行中的重复请求；完成后的结果只保留给已在等待的请求读取，新请求不会回放
+IDEMPOTENCY_COALESCE_SECONDS = 10
+
+class IdempotencyStore:
+    """基于 SQLite 的幂等表，由同一台机器上的所有 worker 共享
+
+    每个键记录请求指纹、状态 (in_progress / done) 以及完成后的响应。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS idempotency ("
+                        "key TEXT PRIMARY KEY, fingerprint TEXT, status TEXT, status_code INTEGER, "
+                        "response TEXT, updated_at REAL, expires_at REAL)"
+                    )
+                    conn.commit()
+                    self._initialized = True
+        return conn
+
+    def begin(self, key: str, fingerprint: str, replace_done: bool = False):
+        """尝试占用键，返回 (state, status_code, response)
+
+        state 为 "new" (已占用，由调用方执行)、"in_progress" (其他请求正在执行)、
+        "done" (可直接回放) 或 "mismatch" (同一幂等键对应了不同的请求内容)。
+        replace_done 为 True 时已完成的记录不回放，直接重新占用。
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+                row = conn.execute(
+                    "SELECT fingerprint, status, status_code, response, updated_at FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                # 占用者超过等待上限仍未完成 (worker 已退出) 时允许接管
+                if (
+                    row is None
+                    or (replace_done and row[1] == "done")
+                    or (row[1] == "in_progress" and now - row[4] > IDEMPOTENCY_WAIT_SECONDS)
+                ):
+                    conn.execute(
+                        "INSERT OR REPLACE INTO idempotency (key, fingerprint, status, updated_at, expires_at) "
+                        "VALUES (?, ?, 'in_progress', ?, ?)",
+                        (key, fingerprint, now, now + IDEMPOTENCY_WAIT_SECONDS * 2)
+                    )
+                    conn.execute("COMMIT")
+                    return "new", None, None
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row[0] != fingerprint:
+            return "mismatch", None, None
+        return row[1], row[2], row[3]
+
+    def complete(self, key: str, status_code: int, response: str, retain_seconds: float):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE idempotency SET status = 'done', status_code = ?, response = ?, updated_at = ?, expires_at = ? WHERE key = ?",
+                (status_code, response, now, now + retain_seconds, key)
+            )
+
+    def release(self, key: str):
+        """请求失败时释放键，允许客户端重试"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM idempotency WHERE key = ? AND status = 'in_progress'", (key,))
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_STORE_PATH)
+# 当前 worker 内进行中的请求：key -> (asyncio.Task, 指纹)，重复请求直接等待同一个任务
+_inflight_requests: Dict[str, tuple] = {}
+
+async def fingerprint_arguments(arguments: Dict[str, Any]) -> str:
+    """按端点参数 (请求体模型、表单字段、上传文件内容) 计算请求指纹"""
+    async def normalize(value):
+        if isinstance(value, BaseModel):
+            return value.model_dump()
+        # 表单解析得到的是 starlette 的 UploadFile (fastapi 版本是其子类)
+        if isinstance(value, StarletteUploadFile):
+            data = await value.read()
+            await value.seek(0)
+            return {"filename": value.filename, "sha256": hashlib.sha256(data).hexdigest()}
+        if isinstance(value, list):
+            return [await normalize(item) for item in value]
+        return value
+
+    normalized = {name: await normalize(value) for name, value in arguments.items() if not isinstance(value, Request)}
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def stored_response(status_code: int, body: str, header: Optional[str] = None) -> Response:
+    """用保存的状态码与 JSON 内容构造响应；header 标明是回放还是合并的结果"""
+    return Response(
+        content=body,
+        status_code=status_code,
+        media_type="application/json",
+        headers={header: "true"} if header else None
+    )
+
+async def run_idempotent(http_request: Request, endpoint: str, fingerprint: str, compute: Callable[[], Awaitable[Response]]) -> Response:
+    """按 Idempotency-Key (或请求内容哈希) 去重执行 compute
+
+    - 同一 worker 内的重复请求等待同一个任务并共享结果；
+    - 其他 worker 上的重复请求通过共享幂等表等待并读取结果；
+    - 带 Idempotency-Key 的成功响应保留 IDEMPOTENCY_TTL_SECONDS，之后的重试直接回放；
+    - 没有 Idempotency-Key 的请求只与进行中的请求合并，不回放已完成的结果。
+    """
+    idempotency_key = http_request.headers.get("Idempotency-Key")
+    if idempotency_key:
+        key = f"{endpoint}:key:{idempotency_key}"
+        retain_seconds = IDEMPOTENCY_TTL_SECONDS
+    else:
+        key = f"{endpoint}:hash:{fingerprint}"
+        retain_seconds = IDEMPOTENCY_COALESCE_SECONDS
+
+    async def acquire_and_execute():
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waiting = False
+        while True:
+            # 无幂等键时，只有开始时就在等待的请求才读取完成结果
+            state, status_code, body = await asyncio.to_thread(
+                idempotency_store.begin, key, fingerprint, not idempotency_key and not waiting
+            )
+            if state == "new":
+                break
+            if state == "mismatch":
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+            if state == "done":
+                llm_stats["requests_replayed"] += 1
+                metrics.inc("ps_cache_requests_total", cache="idempotency", result="replayed")
+                return status_code, body, "Idempotent-Replayed" if idempotency_key else "Idempotent-Coalesced"
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=409, detail="An identical request is still in progress")
+            waiting = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        try:
+            response = await compute()
+        except BaseException:
+            await asyncio.to_thread(idempotency_store.release, key)
+            raise
+        body = response.body.decode("utf-8")
+        if response.status_code < 400:
+            await asyncio.to_thread(idempotency_store.complete, key, response.status_code, body, retain_seconds)
+        else:
+            await asyncio.to_thread(idempotency_store.release, key)
+        return response.status_code, body, None
+
+    entry = _inflight_requests.get(key)
+    if entry is not None:
+        task, inflight_fingerprint = entry
+        if inflight_fingerprint != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request body")
+        llm_stats["requests_coalesced"] += 1
+        metrics.inc("ps_cache_requests_total", cache="idempotency", result="coalesced")
+        status_code, body, _ = await asyncio.shield(task)
+        return stored_response(status_code, body, "Idempotent-Coalesced")
+
+    task = asyncio.ensure_future(acquire_and_execute())
+    _inflight_requests[key] = (task, fingerprint)
+    # 发起方被取消时任务继续执行，完成后才移除，等待中的重复请求仍能拿到结果
+    task.add_done_callback(lambda _: _inflight_requests.pop(key, None))
+    status_code, body, header = await asyncio.shield(task)
+    return stored_response(status_code, body, header)
+
+def idempotent(endpoint: str):
+    """端点装饰器：支持 Idempotency-Key 并合并进行中的相同请求
+
+    被装饰的端点需要声明 http_request: Request 参数。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            if not IDEMPOTENCY_ENABLED:
+                return await func(**kwargs)
+            fingerprint = await fingerprint_arguments(kwargs)
+            return await run_idempotent(kwargs["http_request"], endpoint, fingerprint, lambda: func(**kwargs))
+        return wrapper
+    return decorator
+
 # ==========================================
 # 4. API 端点
 # ==========================================
@@ -858,10 +3958,146 @@ display_order = ["Motivation", "Academic", "Internship", "Why_School", "Career_G
 def read_root():
     return {"message": "Personal Statement Writing API", "status": "running"}
 
+@app.get("/api/llm/stats")
+def llm_call_stats():
+    """当前 worker 的 Gemini 调用计数、熔断器状态与客户端池大小"""
+    return {
+        "counters": dict(llm_stats),
+        "circuit_breakers": {name: breaker.state for name, breaker in _circuit_breakers.items()},
+        "client_pool": gemini_client_pool.stats()
+    }
+
+@app.get("/api/cache/stats")
+def cache_stats():
+    """Gemini 响应缓存命中统计 (所有 worker 共享)"""
+    return llm_cache.stats()
+
+_warmup_task: Optional[asyncio.Task] = None
+_importtime_report: Optional[Dict[str, Any]] = None
+_importtime_lock = asyncio.Lock()
+
+async def warm_up_imports_later():
+    await asyncio.sleep(IMPORT_WARMUP_DELAY_SECONDS)
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(_llm_executor, warm_up_imports)
+    startup_timings["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Warm-up imports finished in %.0fms", startup_timings["warmup_ms"])
+
+@app.on_event("startup")
+async def schedule_import_warmup():
+    global _warmup_task
+    startup_timings["startup_complete_ms"] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 1)
+    if IMPORT_WARMUP_ENABLED:
+        _warmup_task = asyncio.create_task(warm_up_imports_later())
+
+@app.on_event("shutdown")
+def cancel_import_warmup():
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+
+def parse_importtime(output: str, limit: int = 15) -> Dict[str, Any]:
+    """解析 python -X importtime 的输出，返回顶层模块与自身耗时最长的模块 (毫秒)"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": round(int(self_us) / 1000, 1),
+            "cumulative_ms": round(int(cumulative_us) / 1000, 1),
+        })
+    top_level = sorted((e for e in entries if e["depth"] == 0), key=lambda e: -e["cumulative_ms"])
+    return {
+        "total_ms": round(sum(e["cumulative_ms"] for e in top_level), 1),
+        "top_level": [{k: e[k] for k in ("module", "cumulative_ms")} for e in top_level[:limit]],
+        "slowest_self": [{k: e[k] for k in ("module", "self_ms")} for e in sorted(entries, key=lambda e: -e["self_ms"])[:limit]],
+    }
+
+async def run_importtime_report() -> Dict[str, Any]:
+    """在子进程中以 -X importtime 导入 main 并预热全部依赖，每个 worker 只运行一次"""
+    global _importtime_report
+    async with _importtime_lock:
+        if _importtime_report is None:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, "-X", "importtime", "-c", "import main; main.warm_up_imports()",
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE
+            )
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=120)
+            _importtime_report = parse_importtime(stderr.decode("utf-8", "replace"))
+        return _importtime_report
+
+@app.get("/api/debug/startup")
+async def startup_report(importtime: bool = False):
+    """冷启动耗时：main.py 导入、启动完成、后台预热，以及各延迟导入依赖的加载耗时与触发方式
+
+    importtime=true 时附带子进程 python -X importtime 的明细 (首次调用需要几秒)。
+    """
+    report = {
+        "pid": os.getpid(),
+        "timings": startup_timings,
+        "warmup_enabled": IMPORT_WARMUP_ENABLED,
+        "lazy_imports": {
+            module._name: {"subsystem": module._subsystem, "loaded": module._module is not None, **lazy_import_stats.get(module._name, {})}
+            for module in LAZY_MODULES
+        },
+    }
+    if importtime:
+        try:
+            report["importtime"] = await run_importtime_report()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"importtime 分析失败: {str(e)}")
+    return report
+
+_metrics_flush_task: Optional[asyncio.Task] = None
+
+async def flush_metrics_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        await loop.run_in_executor(_llm_executor, flush_metrics)
+
+@app.on_event("startup")
+async def start_metrics_flush():
+    global _metrics_flush_task
+    if METRICS_ENABLED:
+        # 先写入本 worker 的心跳，再清理已退出 worker 留下的行
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_llm_executor, flush_metrics)
+        await loop.run_in_executor(_llm_executor, metrics_store.prune)
+        _metrics_flush_task = asyncio.create_task(flush_metrics_periodically())
+
+@app.on_event("shutdown")
+def stop_metrics_flush():
+    if _metrics_flush_task is not None:
+        _metrics_flush_task.cancel()
+        flush_metrics()
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指标 (所有 worker 汇总；其他 worker 的数据最多滞后 METRICS_FLUSH_SECONDS)"""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    loop = asyncio.get_running_loop()
+
+    def collect() -> str:
+        flush_metrics()
+        metrics_store.prune()
+        return render_prometheus(metrics_store.collect())
+
+    body = await loop.run_in_executor(_llm_executor, collect)
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/api/generate")
+@idempotent("generate")
 async def generate_personal_statement(
+    http_request: Request,
     api_key: str = Form(""),
     model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
     target_school_name: str = Form(...),
     counselor_strategy: str = Form(""),
     selected_modules: str = Form(...),  # JSON string of list
@@ -870,108 +4106,38 @@ async def generate_personal_statement(
     transcript_file: Optional[UploadFile] = File(None),
     curriculum_text: Optional[str] = Form(None),
     curriculum_files: Optional[List[UploadFile]] = File([]),
+    max_concurrency: int = Form(GENERATION_CONCURRENCY),
+    material_profile: Optional[bool] = Form(None),
 ):
     """生成个人陈述各个模块的内容"""
     try:
-        # Parse selected modules
-        modules_list = json.loads(selected_modules)
-
-        # Read material file
-        student_background_text = ""
-        if material_file:
-            file_bytes = await material_file.read()
-            if material_file.filename.endswith('.docx'):
-                student_background_text = read_word_file(file_bytes)
-            elif material_file.filename.endswith('.pdf'):
-                student_background_text = read_pdf_text(file_bytes)
-
-        # Prepare media content
-        transcript_content = []
-        if transcript_file:
-            file_bytes = await transcript_file.read()
-            if transcript_file.content_type == "application/pdf":
-                transcript_content.append({
-                    "mime_type": "application/pdf",
-                    "data": file_bytes
-                })
-            else:
-                # For image files
-                transcript_content.append(Image.open(io.BytesIO(file_bytes)))
-
-        curriculum_imgs = []
-        if curriculum_files:
-            for img_file in curriculum_files:
-                file_bytes = await img_file.read()
-                curriculum_imgs.append(Image.open(io.BytesIO(file_bytes)))
-
-        # Generate content for each selected module
-        generated_sections = {}
-        motivation_trends = ""
-
-        for module in modules_list:
-            # Get appropriate prompt
-            if module == "Motivation":
-                prompt = get_prompt_motivation(target_school_name)
-                current_media = None
-            elif module == "Career_Goal":
-                prompt = get_prompt_career(target_school_name, counselor_strategy)
-                current_media = None
-            elif module == "Academic":
-                prompt = get_prompt_academic(target_school_name)
-                current_media = transcript_content
-            elif module == "Why_School":
-                prompt = get_prompt_whyschool(target_school_name, counselor_strategy, curriculum_text or "")
-                current_media = curriculum_imgs
-            elif module == "Internship":
-                prompt = get_prompt_internship(target_school_name)
-                current_media = None
-            else:
-                continue
-
-            # Call Gemini API
-            response = get_gemini_response(
-                api_key=api_key,
-                model_name=model_name,
-                prompt=prompt,
-                media_content=current_media,
-                text_context=student_background_text
-            )
-
-            final_text = response.strip()
-
-            # Special handling for Motivation module
-            if module == "Motivation":
-                if "[TRENDS_START]" in response and "[DRAFT_START]" in response:
-                    trends_part = response.split("[TRENDS_START]")[1].split("[TRENDS_END]")[0].strip()
-                    draft_part = response.split("[DRAFT_START]")[1].split("[DRAFT_END]")[0].strip()
-                    motivation_trends = trends_part
-                    final_text = draft_part
-                else:
-                    final_text = response
-
-            generated_sections[module] = final_text
-
-        # Build full Chinese draft
-        full_chinese_draft = ""
-        for module in display_order:
-            if module in generated_sections:
-                full_chinese_draft += f"--- {modules[module]} ---\n"
-                full_chinese_draft += generated_sections[module] + "\n\n"
-
-        return JSONResponse(content={
-            "success": True,
-            "generated_sections": generated_sections,
-            "full_chinese_draft": full_chinese_draft.strip(),
-            "motivation_trends": motivation_trends
-        })
+        payload = await generate_statement_payload(
+            api_key=api_key,
+            model_name=model_name,
+            use_cache=not bypass_cache,
+            target_school_name=target_school_name,
+            counselor_strategy=counselor_strategy,
+            modules_list=json.loads(selected_modules),
+            curriculum_text=curriculum_text or "",
+            material_file=material_file,
+            transcript_file=transcript_file,
+            curriculum_files=curriculum_files,
+            max_concurrency=max_concurrency,
+            material_profile=material_profile
+        )
+        return JSONResponse(content=payload)
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"Generation failed: {str(e)}")
 
 @app.post("/api/generate-stream")
 async def generate_personal_statement_stream(
+    request: Request,
     api_key: str = Form(""),
     model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
     target_school_name: str = Form(...),
     counselor_strategy: str = Form(""),
     selected_modules: str = Form(...),  # JSON string of list
@@ -980,127 +4146,229 @@ async def generate_personal_statement_stream(
     transcript_file: Optional[UploadFile] = File(None),
     curriculum_text: Optional[str] = Form(None),
     curriculum_files: Optional[List[UploadFile]] = File([]),
+    material_profile: Optional[bool] = Form(None),
 ):
-    """流式生成个人陈述各个模块的内容"""
-    async def event_generator():
+    """流式生成个人陈述各个模块的内容
+
+    文本块按时间/字节合并后推送；事件带 id，断线后带 Last-Event-ID 重连可从中断处继续，不会重新生成。
+    """
+    # 生成在与连接解耦的后台任务中运行，客户端断开后请求的上传文件可能已关闭，先读入内存
+    material_file = await snapshot_upload(material_file)
+    transcript_file = await snapshot_upload(transcript_file)
+    curriculum_files = [await snapshot_upload(upload) for upload in curriculum_files or []]
+
+    async def produce(emit):
+        # 中止生成时用于估算节省 token 的进度信息
+        remaining_modules: List[str] = []
+        current_output = ""
+        completed_tokens: List[int] = []
         try:
             # Parse selected modules
             modules_list = json.loads(selected_modules)
 
-            # Read material file
-            student_background_text = ""
-            if material_file:
-                file_bytes = await material_file.read()
-                if material_file.filename.endswith('.docx'):
-                    student_background_text = read_word_file(file_bytes)
-                elif material_file.filename.endswith('.pdf'):
-                    student_background_text = read_pdf_text(file_bytes)
-
-            # Prepare media content
-            transcript_content = []
-            if transcript_file:
-                file_bytes = await transcript_file.read()
-                if transcript_file.content_type == "application/pdf":
-                    transcript_content.append({
-                        "mime_type": "application/pdf",
-                        "data": file_bytes
-                    })
-                else:
-                    # For image files
-                    transcript_content.append(Image.open(io.BytesIO(file_bytes)))
-
-            curriculum_imgs = []
-            if curriculum_files:
-                for img_file in curriculum_files:
-                    file_bytes = await img_file.read()
-                    curriculum_imgs.append(Image.open(io.BytesIO(file_bytes)))
+            inputs = await prepare_student_inputs(material_file, transcript_file, curriculum_files)
+            await distill_material_profile(inputs, api_key, model_name, not bypass_cache, material_profile)
+            profile_report = material_profile_report(inputs, modules_list)
+            if profile_report:
+                emit("material_profile", profile_report)
+            student_background_text = inputs["student_background_text"]
+            transcript_content = inputs["transcript_content"]
+            curriculum_imgs = inputs["curriculum_imgs"]
 
             # Generate content for each selected module
             generated_sections = {}
             motivation_trends = ""
 
-            for module in modules_list:
+            for index, module in enumerate(modules_list):
+                remaining_modules = modules_list[index:]
+                current_output = ""
+
                 # Get appropriate prompt
-                if module == "Motivation":
-                    prompt = get_prompt_motivation(target_school_name)
-                    current_media = None
-                elif module == "Career_Goal":
-                    prompt = get_prompt_career(target_school_name, counselor_strategy)
-                    current_media = None
-                elif module == "Academic":
-                    prompt = get_prompt_academic(target_school_name)
-                    current_media = transcript_content
-                elif module == "Why_School":
-                    prompt = get_prompt_whyschool(target_school_name, counselor_strategy, curriculum_text or "")
-                    current_media = curriculum_imgs
-                elif module == "Internship":
-                    prompt = get_prompt_internship(target_school_name)
-                    current_media = None
-                else:
+                module_request = build_module_request(
+                    module, target_school_name, counselor_strategy, curriculum_text or "",
+                    transcript_content, curriculum_imgs
+                )
+                if module_request is None:
                     continue
+                prompt, current_media = module_request
 
                 # Send module start event
-                yield f"event: module_start\ndata: {json.dumps({'module': module})}\n\n"
+                emit("module_start", {'module': module})
 
                 # Call Gemini API with streaming
-                content_parts = [prompt]
-                if student_background_text:
-                    content_parts.append(f"\n【参考文档/背景信息 (简历或素材表)】:\n{student_background_text}")
-                if current_media:
-                    content_parts.extend(current_media) if isinstance(current_media, list) else content_parts.append(current_media)
-
-                effective_api_key = GOOGLE_API_KEY if GOOGLE_API_KEY else api_key
-                if not effective_api_key:
-                    yield f"data: Error: API Key is required.\n\n"
-                    return
-
-                genai.configure(api_key=effective_api_key)
-                model = genai.GenerativeModel(model_name)
-                response_stream = model.generate_content(content_parts, stream=True)
+                if not resolve_api_key(api_key):
+                    raise ValueError("API Key is required.")
 
                 full_response = ""
-                for chunk in response_stream:
-                    if chunk.text:
+                # 动机模块：趋势 (HTML) 与正文分别以 trends_chunk / draft_chunk 事件推送
+                section_parser = DelimitedStreamParser(MOTIVATION_STREAM_MARKERS, fallback_section="draft") if module == "Motivation" else None
+                gemini_module_label.set(module)
+                response_stream = gemini_stream(
+                    api_key=api_key,
+                    model_name=model_name,
+                    use_cache=not bypass_cache,
+                    prompt=prompt,
+                    media_content=current_media,
+                    text_context=student_background_text
+                )
+                try:
+                    async for text in response_stream:
                         # Send chunk as SSE
-                        yield f"data: {json.dumps({'module': module, 'chunk': chunk.text})}\n\n"
-                        full_response += chunk.text
+                        if section_parser is None:
+                            emit(None, {'module': module, 'chunk': text})
+                        else:
+                            emit_section_chunks(emit, module, section_parser.feed(text))
+                        full_response += text
+                        current_output = full_response
+                finally:
+                    # 提前退出时关闭生成器，从而中止上游 Gemini 流
+                    await response_stream.aclose()
+                if section_parser is not None:
+                    emit_section_chunks(emit, module, section_parser.close())
 
                 # Process full response for special handling
                 final_text = full_response.strip()
                 if module == "Motivation":
-                    if "[TRENDS_START]" in full_response and "[DRAFT_START]" in full_response:
-                        trends_part = full_response.split("[TRENDS_START]")[1].split("[TRENDS_END]")[0].strip()
-                        draft_part = full_response.split("[DRAFT_START]")[1].split("[DRAFT_END]")[0].strip()
+                    trends_part, final_text = split_motivation_response(full_response)
+                    if trends_part:
                         motivation_trends = trends_part
-                        final_text = draft_part
                         # Send trends separately
-                        yield f"event: trends\ndata: {json.dumps({'trends': trends_part})}\n\n"
-                    else:
-                        final_text = full_response
+                        emit("trends", {'trends': trends_part})
 
                 generated_sections[module] = final_text
+                completed_tokens.append(estimate_tokens(full_response))
                 # Send module complete event
-                yield f"event: module_complete\ndata: {json.dumps({'module': module})}\n\n"
+                emit("module_complete", {'module': module})
 
             # Build full Chinese draft
-            full_chinese_draft = ""
-            for module in display_order:
-                if module in generated_sections:
-                    full_chinese_draft += f"--- {modules[module]} ---\n"
-                    full_chinese_draft += generated_sections[module] + "\n\n"
+            full_chinese_draft = assemble_chinese_draft(generated_sections)
+
+            # Final result (sent as the complete event)
+            return {
+                'generated_sections': generated_sections,
+                'full_chinese_draft': full_chinese_draft,
+                'motivation_trends': motivation_trends,
+                'material_extraction': extraction_summary(inputs['material_extraction']),
+                'material_profile': profile_report,
+                'image_preprocessing': inputs['image_preprocessing'],
+                'transcript_extraction': inputs['transcript_extraction']
+            }
+
+        except asyncio.CancelledError:
+            log_abandoned_stream(remaining_modules, current_output, completed_tokens)
+            raise
+
+    return stream_events(request, produce, "Generation failed")
+
+@app.post("/api/generate-batch")
+async def generate_batch(
+    request: Request,
+    api_key: str = Form(""),
+    model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
+    schools: str = Form(...),  # JSON list of {target_school_name, counselor_strategy, curriculum_text}
+    selected_modules: str = Form(...),  # JSON string of list
+    material_file: Optional[UploadFile] = File(None),
+    transcript_file: Optional[UploadFile] = File(None),
+    curriculum_files: Optional[List[UploadFile]] = File([]),
+    max_concurrency: int = Form(BATCH_GENERATION_CONCURRENCY),
+    stream: bool = Form(False),
+    material_profile: Optional[bool] = Form(None),
+):
+    """为同一名学生批量生成多所学校的初稿
+
+    学生素材、成绩单与课程截图只解析一次；所有 学校×模块 调用共享同一个并发上限。
+    stream=True 时每完成一所学校即推送一次 school_complete 事件。
+    """
+    try:
+        modules_list = json.loads(selected_modules)
+        entries = [SchoolEntry(**entry) for entry in json.loads(schools)]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid schools or selected_modules: {str(e)}")
+    if not entries:
+        raise HTTPException(status_code=400, detail="schools must contain at least one entry")
+    if len(entries) > BATCH_MAX_SCHOOLS:
+        raise HTTPException(status_code=400, detail=f"Too many schools: {len(entries)} (limit {BATCH_MAX_SCHOOLS})")
 
-            # Send final result
-            yield f"event: complete\ndata: {json.dumps({'generated_sections': generated_sections, 'full_chinese_draft': full_chinese_draft.strip(), 'motivation_trends': motivation_trends})}\n\n"
+    try:
+        inputs = await prepare_student_inputs(material_file, transcript_file, curriculum_files)
+        # 画像只压缩一次，所有学校共享
+        await distill_material_profile(inputs, api_key, model_name, not bypass_cache, material_profile)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=http_status_for(e), detail=f"Batch generation failed: {str(e)}")
 
-        except Exception as e:
-            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+    started = time.perf_counter()
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    async def generate_school(index: int, entry: SchoolEntry) -> Dict[str, Any]:
+        school_started = time.perf_counter()
+        generated_sections, motivation_trends, module_status = await generate_modules_concurrently(
+            modules_list=modules_list,
+            api_key=api_key,
+            model_name=model_name,
+            use_cache=not bypass_cache,
+            target_school_name=entry.target_school_name,
+            counselor_strategy=entry.counselor_strategy,
+            curriculum_text=entry.curriculum_text,
+            student_background_text=inputs["student_background_text"],
+            transcript_content=inputs["transcript_content"],
+            curriculum_imgs=inputs["curriculum_imgs"],
+            semaphore=semaphore
+        )
+        return {
+            "index": index,
+            "target_school_name": entry.target_school_name,
+            "generated_sections": generated_sections,
+            "full_chinese_draft": assemble_chinese_draft(generated_sections),
+            "motivation_trends": motivation_trends,
+            "module_status": module_status,
+            "failed_modules": [m for m, status in module_status.items() if not status["success"]],
+            "elapsed_seconds": round(time.perf_counter() - school_started, 3)
+        }
+
+    def build_result(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        results = sorted(results, key=lambda result: result["index"])
+        return {
+            "success": True,
+            "schools": results,
+            "failed_schools": [r["target_school_name"] for r in results if r["failed_modules"]],
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+            "material_extraction": extraction_summary(inputs["material_extraction"]),
+            "material_profile": material_profile_report(inputs, modules_list),
+            "image_preprocessing": inputs["image_preprocessing"],
+            "transcript_extraction": inputs["transcript_extraction"]
+        }
+
+    if not stream:
+        results = await asyncio.gather(*(generate_school(i, entry) for i, entry in enumerate(entries)))
+        return JSONResponse(content=build_result(list(results)))
+
+    async def produce(emit):
+        tasks = [asyncio.ensure_future(generate_school(i, entry)) for i, entry in enumerate(entries)]
+        results = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                results.append(result)
+                emit("school_complete", result)
+            return build_result(results)
+        except asyncio.CancelledError:
+            logger.info("SSE stream abandoned; cancelled %d pending schools", len(tasks) - len(results))
+            raise
+        finally:
+            # 无人重连而被放弃或出错时取消尚未完成的学校
+            for task in tasks:
+                task.cancel()
+
+    return stream_events(request, produce, "Batch generation failed")
 
 @app.post("/api/analyze-experiences")
 async def analyze_experiences(
     api_key: str = Form(""),
     model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
     target_school_name: str = Form(...),
     curriculum_text: Optional[str] = Form(None),
     curriculum_files: Optional[List[UploadFile]] = File([]),
@@ -1109,170 +4377,221 @@ async def analyze_experiences(
 ):
     """分析学生经历，匹配课程设置，输出调研洞察"""
     try:
-        # 1. 处理课程图片（如果有）
+        # 处理课程图片（如果有）
         curriculum_imgs = []
+        image_preprocessing = {}
         if curriculum_files:
-            for img_file in curriculum_files:
-                file_bytes = await img_file.read()
-                curriculum_imgs.append(Image.open(io.BytesIO(file_bytes)))
-
-        # 2. 提取课外经历（从文件或手动输入）
-        experiences_text = ""
-
-        if material_file:
-            # 从文件提取文本
-            file_bytes = await material_file.read()
-            if material_file.filename.endswith('.docx'):
-                material_text = read_word_file(file_bytes)
-            elif material_file.filename.endswith('.pdf'):
-                material_text = read_pdf_text(file_bytes)
-            else:
-                return JSONResponse(
-                    content={"success": False, "error": "只支持 .docx 或 .pdf 文件"},
-                    status_code=400
-                )
+            curriculum_imgs, image_preprocessing["curriculum"] = await preprocess_image_uploads(curriculum_files)
 
-            # 调用Gemini提取经历
-            extract_prompt = get_prompt_extract_experiences()
-            experiences_text = get_gemini_response(
-                api_key=api_key,
-                model_name=model_name,
-                prompt=extract_prompt,
-                text_context=material_text
-            )
-        elif manual_experiences:
-            # 直接使用手动输入的经历
-            experiences_text = manual_experiences
-        else:
-            return JSONResponse(
-                content={"success": False, "error": "请提供文件或手动输入课外经历"},
-                status_code=400
-            )
+        stages = []
+        async for stage in run_experience_stages(
+            api_key, model_name, target_school_name, curriculum_text, curriculum_imgs,
+            material_file, manual_experiences, use_cache=not bypass_cache
+        ):
+            stages.append(stage)
 
-        # 2. 匹配经历与课程设置
-        match_prompt = get_prompt_match_experiences_curriculum(
-            target_school_name=target_school_name,
-            curriculum_text=curriculum_text or "",
-            experiences_text=experiences_text
-        )
+        return JSONResponse(content=build_experience_analysis_result(stages, image_preprocessing))
 
-        matched_intersections = get_gemini_response(
-            api_key=api_key,
-            model_name=model_name,
-            prompt=match_prompt,
-            media_content=curriculum_imgs if curriculum_imgs else None
-        )
-
-        # 3. 进行调研并输出洞察
-        research_prompt = get_prompt_research_insights(
-            target_school_name=target_school_name,
-            matched_intersections=matched_intersections
-        )
+    except ExperienceInputError as e:
+        return JSONResponse(content={"success": False, "error": str(e)}, status_code=400)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=http_status_for(e), detail=f"经历分析失败: {str(e)}")
 
-        research_insights = get_gemini_response(
-            api_key=api_key,
-            model_name=model_name,
-            prompt=research_prompt
-        )
+@app.post("/api/analyze-experiences-stream")
+async def analyze_experiences_stream(
+    request: Request,
+    api_key: str = Form(""),
+    model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
+    target_school_name: str = Form(...),
+    curriculum_text: Optional[str] = Form(None),
+    curriculum_files: Optional[List[UploadFile]] = File([]),
+    material_file: Optional[UploadFile] = File(None),
+    manual_experiences: Optional[str] = Form(None),
+):
+    """流式经历分析：每完成一个阶段 (extract / match / research) 推送一次 stage_complete 事件"""
+    # 分析在与连接解耦的后台任务中运行，先把上传文件读入内存
+    material_file = await snapshot_upload(material_file)
+    curriculum_files = [await snapshot_upload(upload) for upload in curriculum_files or []]
 
-        return JSONResponse(content={
-            "success": True,
-            "extracted_experiences": experiences_text,
-            "matched_intersections": matched_intersections,
-            "research_insights": research_insights
-        })
+    async def produce(emit):
+        stages = []
+        try:
+            curriculum_imgs = []
+            image_preprocessing = {}
+            if curriculum_files:
+                curriculum_imgs, image_preprocessing["curriculum"] = await preprocess_image_uploads(curriculum_files)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"经历分析失败: {str(e)}")
+            stage_iter = run_experience_stages(
+                api_key, model_name, target_school_name, curriculum_text, curriculum_imgs,
+                material_file, manual_experiences, use_cache=not bypass_cache
+            )
+            try:
+                async for stage in stage_iter:
+                    stages.append(stage)
+                    emit("stage_complete", dict(stage, field=EXPERIENCE_STAGES[stage['stage']]))
+            finally:
+                await stage_iter.aclose()
+
+            return build_experience_analysis_result(stages, image_preprocessing)
+
+        except asyncio.CancelledError:
+            logger.info("SSE stream abandoned; skipped experience stages after %s", [stage["stage"] for stage in stages])
+            raise
+        except ExperienceInputError as e:
+            raise StreamFailed({'error': str(e)})
+
+    return stream_events(request, produce, "经历分析失败")
+
+async def run_translation(request: TranslationRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """翻译中文内容到英文，返回 /api/translate 的响应内容"""
+    trans_prompt = build_translation_prompt(request.chinese_text, request.spelling_preference)
+
+    translated_text = await generate_text(
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        prompt=trans_prompt,
+        on_chunk=chunk_emitter(emit)
+    )
+
+    return {
+        "success": True,
+        "translated_text": translated_text.strip(),
+        "module": request.module_type
+    }
 
 @app.post("/api/translate")
-async def translate_content(request: TranslationRequest):
+@idempotent("translate")
+async def translate_content(request: TranslationRequest, http_request: Request):
     """翻译中文内容到英文"""
     try:
-        spelling_instruction = "\n【SPELLING RULE】: STRICTLY use British English spelling (e.g., colour, analyse, programme, centre)."
-        if request.spelling_preference == "American":
-            spelling_instruction = "\n【SPELLING RULE】: STRICTLY use American English spelling (e.g., color, analyze, program, center)."
-
-        trans_prompt = f"{TRANSLATION_RULES_BASE}\n{spelling_instruction}\n【Input Text】:\n{request.chinese_text}"
-
-        translated_text = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=trans_prompt
-        )
-
-        return JSONResponse(content={
-            "success": True,
-            "translated_text": translated_text.strip(),
-            "module": request.module_type
-        })
+        return JSONResponse(content=await run_translation(request))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Translation failed: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"Translation failed: {str(e)}")
+
+@app.post("/api/translate-stream")
+async def translate_content_stream(request: TranslationRequest, http_request: Request):
+    """流式翻译：文本块随生成推送，complete 事件与 /api/translate 的返回内容一致"""
+    return stream_events(http_request, lambda emit: run_translation(request, emit), "Translation failed")
+
+@app.post("/api/translate-batch")
+async def translate_batch(request: BatchTranslationRequest, http_request: Request):
+    """并发翻译多个模块；stream=True 时每完成一个模块即推送一次"""
+    semaphore = asyncio.Semaphore(max(1, request.max_concurrency))
+
+    async def translate_section(section: TranslationSection):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                translated_text = await gemini_generate(
+                    api_key=request.api_key,
+                    model_name=request.model_name,
+                    use_cache=not request.bypass_cache,
+                    prompt=build_translation_prompt(section.chinese_text, request.spelling_preference)
+                )
+            except Exception as e:
+                error = classify_gemini_error(e)
+                return section.module_type, None, {
+                    "success": False,
+                    "error": str(error),
+                    "error_kind": error.kind,
+                    "retryable": error.retryable,
+                    "elapsed_seconds": round(time.perf_counter() - started, 3)
+                }
+            return section.module_type, translated_text.strip(), {
+                "success": True,
+                "elapsed_seconds": round(time.perf_counter() - started, 3)
+            }
+
+    sections = [section for section in request.sections if section.chinese_text.strip()]
+
+    def build_result(results) -> Dict[str, Any]:
+        translations = {module: text for module, text, _ in results if text is not None}
+        module_status = {module: status for module, _, status in results}
+        return {
+            "success": True,
+            "translations": translations,
+            "full_translated_text": assemble_english_draft(translations),
+            "module_status": module_status,
+            "failed_modules": [m for m, status in module_status.items() if not status["success"]]
+        }
+
+    if not request.stream:
+        results = await asyncio.gather(*(translate_section(section) for section in sections))
+        return JSONResponse(content=build_result(results))
+
+    async def produce(emit):
+        tasks = [asyncio.ensure_future(translate_section(section)) for section in sections]
+        results = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                module, text, status = await next_done
+                results.append((module, text, status))
+                if text is not None:
+                    emit("translation", {'module': module, 'header': english_modules.get(module, module), 'translated_text': text, 'status': status})
+                else:
+                    emit("translation_error", {'module': module, 'status': status})
+            return build_result(results)
+        finally:
+            # 无人重连而被放弃或出错时取消尚未完成的翻译
+            for task in tasks:
+                task.cancel()
+
+    return stream_events(http_request, produce, "Batch translation failed")
+
+async def run_edit(request: EditRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """根据批注编辑内容，返回 /api/edit 的响应内容"""
+    # 只把带批注的段落 (英文稿中未加括号的中文也是指令) 发给模型，改动处在本地用 ** 标出
+    is_target = contains_annotation if request.is_chinese else (lambda p: contains_annotation(p) or contains_chinese(p))
+    edited_text, edit_stats = await edit_annotated_paragraphs(
+        text=request.text,
+        is_target=is_target,
+        build_prompt=lambda span: build_inline_edit_prompt(span, request.is_chinese),
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        highlight=True,
+        emit=emit
+    )
+
+    return {
+        "success": True,
+        "edited_text": edited_text.strip(),
+        "edit_stats": edit_stats
+    }
 
 @app.post("/api/edit")
 async def edit_content(request: EditRequest):
     """根据批注编辑内容"""
     try:
-        if request.is_chinese:
-            inline_prompt = f"""
-            【任务】作为专业留学文书编辑，根据文中的嵌入式批注（中文方括号【】内的文字）修改文章。
-            【输入文本】\n{request.text}
-            【执行步骤】
-            1. 扫描文中所有的中文方括号 `【】`。括号内的文字即为用户的修改指令。
-            2. 根据指令，修改括号紧邻的前文句子或段落。
-            3. **必须删除**原文中的括号及括号内的修改指令。
-            4. 保持未被批注的部分原封不动。
-            5. **高亮变化**：将**所有被修改后产生的新文字**用 Markdown 双星号 `**` 包裹（例如：**new text**），以便用户一眼看出改了哪里。
-            {CLEAN_OUTPUT_RULES}
-            """
-        else:
-            inline_prompt = f"""
-            【任务】你是一位顶尖的留学文书编辑。请根据用户在英文文本中嵌入的中文，对文章进行修改和润色。
-
-            【输入文本及批注】
-            {request.text}
-
-            【批注规则说明】
-            1.  **修改指令 `【中文内容】`**: 如果发现中文被中文方括号 `【】` 包围，这代表一条修改指令。请根据指令内容，修改它前面的英文句子。
-            2.  **翻译并插入**: 如果发现一段中文**没有被任何括号包围**，请将这段中文翻译成地道的英文，并无缝地插入到文本的那个位置。
-
-            【核心风格指令】
-            所有的修改和翻译都必须严格遵守以下【ANTI-AI STYLE GUIDE】。
-            {TRANSLATION_RULES_BASE}
-
-            【输出要求】
-            1.  完成所有修改和翻译。
-            2.  **必须删除**原文中所有的中文内容和 `【】` 括号。
-            3.  **必须保留**所有的分段标题（例如 `--- Motivation ---`）。
-            4.  将**所有被修改或新增的英文部分**用 Markdown 双星号 `**` 包裹，以便用户识别。
-            5.  最终输出完整的、保留了分段结构的英文文本。
-            """
-
-        edited_text = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=inline_prompt
-        )
-
-        return JSONResponse(content={
-            "success": True,
-            "edited_text": edited_text.strip()
-        })
+        return JSONResponse(content=await run_edit(request))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Edit failed: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"Edit failed: {str(e)}")
+
+@app.post("/api/edit-stream")
+async def edit_content_stream(request: EditRequest, http_request: Request):
+    """流式批注编辑：按段推送文本块与 span_complete，complete 事件与 /api/edit 的返回内容一致"""
+    return stream_events(http_request, lambda emit: run_edit(request, emit), "Edit failed")
 
 @app.post("/api/generate-word")
 async def generate_word_document(request: WordGenerationRequest):
     """生成Word文档"""
     try:
-        docx_bytes = create_word_docx(
-            content=request.content,
-            header_text=request.header_text,
-            font_name=request.font_name,
-            is_chinese=request.is_chinese
-        )
+        # 在线程池中生成，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        with metrics.timer("ps_stage_duration_seconds", stage="word_generation"):
+            docx_bytes = await loop.run_in_executor(_llm_executor, functools.partial(
+                create_word_docx,
+                content=request.content,
+                header_text=request.header_text,
+                font_name=request.font_name,
+                is_chinese=request.is_chinese
+            ))
 
         # Determine filename
         if request.is_chinese:
@@ -1280,19 +4599,21 @@ async def generate_word_document(request: WordGenerationRequest):
         else:
             filename = "personal_statement_en.docx"
 
-        return StreamingResponse(
-            io.BytesIO(docx_bytes),
+        # 文档已在内存中，整体返回 (StreamingResponse 迭代 BytesIO 会按换行符拆成大量小块)
+        return Response(
+            content=docx_bytes,
             media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Word generation failed: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"Word generation failed: {str(e)}")
 
 @app.post("/api/generate-header")
 async def generate_header(
     api_key: str = Form(""),
     model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
     target_school_name: str = Form(...)
 ):
     """生成中英文页眉"""
@@ -1311,9 +4632,10 @@ async def generate_header(
         Output ONLY the two strings separated by a pipe symbol (|). Do not add any other text.
         """
 
-        header_res = get_gemini_response(
+        header_res = await gemini_generate(
             api_key=api_key,
             model_name=model_name,
+            use_cache=not bypass_cache,
             prompt=header_prompt
         )
 
@@ -1339,139 +4661,355 @@ async def generate_header(
             "header_en": f"Personal Statement for {target_school_name}"
         })
 
-# ==========================================
-# 润色功能API端点
-# ==========================================
-@app.post("/api/refine/analyze")
-async def refine_analyze(request: RefineAnalysisRequest):
-    """旧文书分析，生成中英混合段落"""
+@app.post("/api/jobs/generate")
+async def submit_generation_job(
+    api_key: str = Form(""),
+    model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
+    target_school_name: str = Form(...),
+    counselor_strategy: str = Form(""),
+    selected_modules: str = Form(...),  # JSON string of list
+    spelling_preference: str = Form("British"),
+    material_file: Optional[UploadFile] = File(None),
+    transcript_file: Optional[UploadFile] = File(None),
+    curriculum_text: Optional[str] = Form(None),
+    curriculum_files: Optional[List[UploadFile]] = File([]),
+    max_concurrency: int = Form(GENERATION_CONCURRENCY),
+    material_profile: Optional[bool] = Form(None),
+):
+    """以后台任务方式运行 /api/generate，立即返回 job_id"""
     try:
-        # 构建分析提示词
-        prompt = build_analysis_prompt(
-            school=request.target_school,
-            major=request.target_major,
-            old_text=request.old_ps,
-            new_course_text=request.course_info or "",
-            has_images=False,  # 暂时不支持图片上传
-            strategy_text=request.strategy or ""
-        )
-
-        # 调用Gemini API
-        response = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=prompt
-        )
+        modules_list = json.loads(selected_modules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid selected_modules: {str(e)}")
+
+    material_copy = await snapshot_upload(material_file)
+    transcript_copy = await snapshot_upload(transcript_file)
+    curriculum_copies = [await snapshot_upload(upload) for upload in curriculum_files or []]
+    request_hash = make_job_request_hash("generate", {
+        "api_key": api_key_digest(api_key),
+        "model_name": model_name,
+        "target_school_name": target_school_name,
+        "counselor_strategy": counselor_strategy,
+        "selected_modules": modules_list,
+        "curriculum_text": curriculum_text or "",
+        "material_profile": MATERIAL_PROFILE_ENABLED if material_profile is None else material_profile,
+    }, [material_copy, transcript_copy] + curriculum_copies)
+    # bypass_cache 时只与进行中的相同任务合并，不复用已完成的结果
+    job_id, created = await asyncio.to_thread(
+        job_store.create_or_reuse, "generate", request_hash, len(modules_list), not bypass_cache
+    )
+
+    if created:
+        async def job_fn(job_id: str) -> Dict[str, Any]:
+            async def record_module(module: str, response: Optional[str], status: Dict[str, Any]):
+                text = split_motivation_response(response)[1] if module == "Motivation" and response else response
+                await asyncio.to_thread(job_store.record_module, job_id, module, text.strip() if text else None, status)
+
+            return await generate_statement_payload(
+                api_key=api_key,
+                model_name=model_name,
+                use_cache=not bypass_cache,
+                target_school_name=target_school_name,
+                counselor_strategy=counselor_strategy,
+                modules_list=modules_list,
+                curriculum_text=curriculum_text or "",
+                material_file=material_copy,
+                transcript_file=transcript_copy,
+                curriculum_files=curriculum_copies,
+                max_concurrency=max_concurrency,
+                on_module_complete=record_module,
+                material_profile=material_profile
+            )
 
-        # 解析响应数据为结构化段落
-        raw_sections = response.split('===SECTION===')
-        parsed_data = []
+        submit_job(job_id, job_fn)
+    return job_accepted_response(job_id, created)
 
-        for sec in raw_sections:
-            if not sec.strip():
-                continue
-            # 过滤不包含核心标记的段落
-            if "[[LOGIC]]" not in sec and "[[DRAFT]]" not in sec:
-                continue
+@app.post("/api/jobs/analyze-experiences")
+async def submit_experience_analysis_job(
+    api_key: str = Form(""),
+    model_name: str = Form("gemini-2.5-pro"),
+    bypass_cache: bool = Form(False),
+    target_school_name: str = Form(...),
+    curriculum_text: Optional[str] = Form(None),
+    curriculum_files: Optional[List[UploadFile]] = File([]),
+    material_file: Optional[UploadFile] = File(None),
+    manual_experiences: Optional[str] = Form(None),
+):
+    """以后台任务方式运行 /api/analyze-experiences，立即返回 job_id"""
+    if not material_file and not manual_experiences:
+        return JSONResponse(content={"success": False, "error": "请提供文件或手动输入课外经历"}, status_code=400)
+
+    material_copy = await snapshot_upload(material_file)
+    curriculum_copies = [await snapshot_upload(upload) for upload in curriculum_files or []]
+    request_hash = make_job_request_hash("analyze-experiences", {
+        "api_key": api_key_digest(api_key),
+        "model_name": model_name,
+        "target_school_name": target_school_name,
+        "curriculum_text": curriculum_text or "",
+        "manual_experiences": manual_experiences or "",
+    }, [material_copy] + curriculum_copies)
+    job_id, created = await asyncio.to_thread(
+        job_store.create_or_reuse, "analyze-experiences", request_hash, len(EXPERIENCE_STAGES), not bypass_cache
+    )
+
+    if created:
+        async def job_fn(job_id: str) -> Dict[str, Any]:
+            curriculum_imgs = []
+            image_preprocessing = {}
+            if curriculum_copies:
+                curriculum_imgs, image_preprocessing["curriculum"] = await preprocess_image_uploads(curriculum_copies)
+
+            stages = []
+            async for stage in run_experience_stages(
+                api_key, model_name, target_school_name, curriculum_text, curriculum_imgs,
+                material_copy, manual_experiences, use_cache=not bypass_cache
+            ):
+                stages.append(stage)
+                await asyncio.to_thread(
+                    job_store.record_module, job_id, stage["stage"], stage["text"],
+                    {"success": True, "elapsed_ms": stage["elapsed_ms"], "cached": stage.get("cached", False)}
+                )
+            return build_experience_analysis_result(stages, image_preprocessing)
+
+        submit_job(job_id, job_fn)
+    return job_accepted_response(job_id, created)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询任务状态、进度、已完成模块的结果以及最终结果"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return JSONResponse(content=job)
+
+@app.get("/api/jobs/{job_id}/events")
+async def subscribe_job(job_id: str, request: Request):
+    """以 SSE 订阅任务进度：每有模块完成推送 progress，结束时推送 complete 或 error"""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def produce(emit):
+        nonlocal job
+        reported = set()
+        while True:
+            for module, entry in job["modules"].items():
+                if module not in reported:
+                    reported.add(module)
+                    emit("progress", {'module': module, 'progress': job['progress'], **entry})
+            if job["status"] == "succeeded":
+                return job["result"]
+            if job["status"] == "failed":
+                raise StreamFailed({'error': job['error'], 'error_kind': job['error_kind']})
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            job = await asyncio.to_thread(job_store.get, job_id)
+            if job is None:
+                raise StreamFailed({'error': "Job not found or expired", 'error_kind': "not_found"})
+
+    # 订阅本身可续传；任务在后台独立运行，订阅被放弃不影响任务
+    return stream_events(request, produce, "Job failed")
 
-            logic_part = ""
-            draft_part = ""
-            if "[[LOGIC]]" in sec:
-                parts = sec.split("[[DRAFT]]")
-                logic_part = parts[0].replace("[[LOGIC]]", "").replace("Part 1:", "").strip()
-                if len(parts) > 1:
-                    draft_part = parts[1].replace("Part 2:", "").strip()
-            else:
-                draft_part = sec.strip()
+# ==========================================
+# 润色功能API端点
+# ==========================================
+async def run_refine_analyze(request: RefineAnalysisRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """旧文书分析，返回 /api/refine/analyze 的响应内容
 
-            parsed_data.append({"logic": logic_part, "draft": draft_part})
+    传入 emit 时各段落的 logic / draft 随生成以 logic_chunk / draft_chunk 推送，
+    每个段落结束后推送 section_complete (解析规则与非流式相同)。
+    """
+    # 构建分析提示词
+    prompt = build_analysis_prompt(
+        school=request.target_school,
+        major=request.target_major,
+        old_text=request.old_ps,
+        new_course_text=request.course_info or "",
+        has_images=False,  # 暂时不支持图片上传
+        strategy_text=request.strategy or ""
+    )
+    parser = DelimitedStreamParser(REFINE_STREAM_MARKERS)
+    full_response = ""
+    raw_index = 0
+    section_count = 0
+
+    def finish_section():
+        # 分隔符已完整出现在 full_response 中，按非流式规则解析刚结束的段落
+        nonlocal raw_index, section_count
+        section = parse_refine_section(full_response.split(REFINE_SECTION_MARKER)[raw_index])
+        raw_index += 1
+        if section is not None:
+            emit("section_complete", {"section": section_count, **section})
+            section_count += 1
+
+    def route(events: List[tuple]):
+        for kind, section, value in events:
+            if kind == "text":
+                emit(f"{section}_chunk", {"section": section_count, "chunk": value})
+            elif section == REFINE_SECTION_MARKER:
+                finish_section()
+
+    def on_chunk(text: str):
+        nonlocal full_response
+        full_response += text
+        route(parser.feed(text))
+
+    # 调用Gemini API
+    response = await generate_text(
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        prompt=prompt,
+        on_chunk=on_chunk if emit is not None else None
+    )
+    if emit is not None:
+        route(parser.close())
+        finish_section()
+
+    # 解析响应数据为结构化段落
+    return build_refine_analysis_result(response)
 
-        return JSONResponse(content={
-            "success": True,
-            "analysis_result": response,
-            "sections_data": parsed_data
-        })
+@app.post("/api/refine/analyze")
+@idempotent("refine/analyze")
+async def refine_analyze(request: RefineAnalysisRequest, http_request: Request):
+    """旧文书分析，生成中英混合段落"""
+    try:
+        return JSONResponse(content=await run_refine_analyze(request))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"分析失败: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"分析失败: {str(e)}")
+
+@app.post("/api/refine/analyze-stream")
+async def refine_analyze_stream(request: RefineAnalysisRequest, http_request: Request):
+    """流式旧文书分析，complete 事件与 /api/refine/analyze 的返回内容一致"""
+    return stream_events(http_request, lambda emit: run_refine_analyze(request, emit), "分析失败")
+
+MISSING_ANNOTATION_ERROR = "未检测到批注标记。请在文本中添加【】或[]形式的批注。"
+
+async def run_refine_edit(request: RefineEditRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """段落批注修改，返回 /api/refine/edit 的响应内容"""
+    # 只修改带批注的段落，输出语言按整段文本是否含中文决定
+    has_chinese = contains_chinese(request.text)
+    response, edit_stats = await edit_annotated_paragraphs(
+        text=request.text,
+        is_target=contains_annotation,
+        build_prompt=lambda span: build_refine_prompt(span, has_chinese),
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        emit=emit
+    )
+
+    return {
+        "success": True,
+        "refined_text": response.strip(),
+        "edit_stats": edit_stats
+    }
 
 @app.post("/api/refine/edit")
-async def refine_edit(request: RefineEditRequest):
+@idempotent("refine/edit")
+async def refine_edit(request: RefineEditRequest, http_request: Request):
     """段落批注修改"""
     try:
         # 检查是否包含批注标记
         if not contains_annotation(request.text):
             return JSONResponse(content={
                 "success": False,
-                "error": "未检测到批注标记。请在文本中添加【】或[]形式的批注。"
+                "error": MISSING_ANNOTATION_ERROR
             }, status_code=400)
 
-        # 构建修改提示词
-        has_chinese = contains_chinese(request.text)
-        prompt = build_refine_prompt(request.text, has_chinese)
+        return JSONResponse(content=await run_refine_edit(request))
 
-        # 调用Gemini API
-        response = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=prompt
-        )
+    except Exception as e:
+        raise HTTPException(status_code=http_status_for(e), detail=f"修改失败: {str(e)}")
 
+@app.post("/api/refine/edit-stream")
+async def refine_edit_stream(request: RefineEditRequest, http_request: Request):
+    """流式段落批注修改，complete 事件与 /api/refine/edit 的返回内容一致"""
+    if not contains_annotation(request.text):
         return JSONResponse(content={
-            "success": True,
-            "refined_text": response.strip()
-        })
-
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"修改失败: {str(e)}")
+            "success": False,
+            "error": MISSING_ANNOTATION_ERROR
+        }, status_code=400)
+    return stream_events(http_request, lambda emit: run_refine_edit(request, emit), "修改失败")
+
+async def run_refine_translate_hybrid(request: HybridTranslateRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """中英混合文本翻译，返回 /api/refine/translate-hybrid 的响应内容"""
+    # 构建翻译提示词
+    prompt = build_translate_prompt(request.hybrid_text, request.style)
+
+    # 调用Gemini API
+    response = await generate_text(
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        prompt=prompt,
+        on_chunk=chunk_emitter(emit)
+    )
+
+    return {
+        "success": True,
+        "translated_text": response.strip(),
+        "style": request.style
+    }
 
 @app.post("/api/refine/translate-hybrid")
-async def refine_translate_hybrid(request: HybridTranslateRequest):
+@idempotent("refine/translate-hybrid")
+async def refine_translate_hybrid(request: HybridTranslateRequest, http_request: Request):
     """中英混合文本翻译"""
     try:
-        # 构建翻译提示词
-        prompt = build_translate_prompt(request.hybrid_text, request.style)
-
-        # 调用Gemini API
-        response = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=prompt
-        )
-
-        return JSONResponse(content={
-            "success": True,
-            "translated_text": response.strip(),
-            "style": request.style
-        })
+        return JSONResponse(content=await run_refine_translate_hybrid(request))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"翻译失败: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"翻译失败: {str(e)}")
+
+@app.post("/api/refine/translate-hybrid-stream")
+async def refine_translate_hybrid_stream(request: HybridTranslateRequest, http_request: Request):
+    """流式中英混合文本翻译，complete 事件与 /api/refine/translate-hybrid 的返回内容一致"""
+    return stream_events(http_request, lambda emit: run_refine_translate_hybrid(request, emit), "翻译失败")
+
+async def run_refine_remove_ai_vocab(request: RemoveAIVocabRequest, emit: Optional[Callable[..., None]] = None) -> Dict[str, Any]:
+    """去除AI写作高频词汇，返回 /api/refine/remove-ai-vocab 的响应内容"""
+    # 本地扫描黑名单，只把命中的句子并发发送给模型；没有命中时不调用模型
+    response, edit_stats = await remove_ai_vocab_sentences(
+        text=request.text,
+        api_key=request.api_key,
+        model_name=request.model_name,
+        use_cache=not request.bypass_cache,
+        emit=emit
+    )
+
+    return {
+        "success": True,
+        "cleaned_text": response.strip(),
+        "edit_stats": edit_stats
+    }
 
 @app.post("/api/refine/remove-ai-vocab")
-async def refine_remove_ai_vocab(request: RemoveAIVocabRequest):
+@idempotent("refine/remove-ai-vocab")
+async def refine_remove_ai_vocab(request: RemoveAIVocabRequest, http_request: Request):
     """去除AI写作高频词汇"""
     try:
-        # 构建去除AI词汇提示词
-        prompt = build_remove_ai_vocab_prompt(request.text)
-
-        # 调用Gemini API
-        response = get_gemini_response(
-            api_key=request.api_key,
-            model_name=request.model_name,
-            prompt=prompt
-        )
-
-        return JSONResponse(content={
-            "success": True,
-            "cleaned_text": response.strip()
-        })
+        return JSONResponse(content=await run_refine_remove_ai_vocab(request))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"去除AI词汇失败: {str(e)}")
+        raise HTTPException(status_code=http_status_for(e), detail=f"去除AI词汇失败: {str(e)}")
+
+@app.post("/api/refine/remove-ai-vocab-stream")
+async def refine_remove_ai_vocab_stream(request: RemoveAIVocabRequest, http_request: Request):
+    """流式去除AI词汇：按句推送文本块与 span_complete，complete 事件与 /api/refine/remove-ai-vocab 的返回内容一致"""
+    return stream_events(http_request, lambda emit: run_refine_remove_ai_vocab(request, emit), "去除AI词汇失败")
+
+@app.post("/api/lint")
+async def lint_text(request: LintRequest):
+    """本地扫描AI写作高频词汇和句式 (不调用模型)"""
+    result = lint_ai_vocab(request.text)
+    return JSONResponse(content={"success": True, **result})
 
 # 注：/api/refine/export 直接使用现有的 /api/generate-word 端点
 
+startup_timings["module_import_ms"] = round((time.perf_counter() - _MODULE_LOAD_STARTED) * 1000, 1)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# main 在导入时读取配置：把各 SQLite 存储放进临时目录，关闭响应缓存，避免测试之间互相影响
+_tmp_dir = tempfile.mkdtemp(prefix="ps_tests_")
+for _name in ("STREAM_REPLAY_STORE", "JOB_STORE", "IDEMPOTENCY_STORE", "METRICS_STORE"):
+    os.environ.setdefault(f"{_name}_PATH", os.path.join(_tmp_dir, f"{_name.lower()}.sqlite3"))
+os.environ.setdefault("LLM_CACHE_PATH", os.path.join(_tmp_dir, "llm_cache.sqlite3"))
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("GOOGLE_API_KEY", "")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
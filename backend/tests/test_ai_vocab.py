@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+import main
+
+
+def terms(text):
+    return [hit["text"] for hit in main.scan_ai_vocab(text)]
+
+
+@pytest.mark.parametrize("sentence", [
+    "I am applying for the Master of Science in Business Analytics at Imperial College London.",
+    "After completing my Master's degree, I plan to join a consulting firm in Shanghai.",
+    "Many masters students in my cohort chose the thesis track.",
+    "My final-year project in Computer Vision classified retinal images with a CNN.",
+    "I interned at the Gates Foundation, where I cleaned survey data from rural clinics.",
+    "This course laid the foundation for my later work on time-series forecasting.",
+    "My vision for the next five years is to lead a small analytics team.",
+    "The journey from Beijing to Hangzhou took four hours, so I reviewed my notes on the train.",
+    "Working at Address Labs, I built a geocoding pipeline for delivery routes.",
+    "The seminar highlighted how pricing models react to sudden supply shocks.",
+    "The butterfly effect explains why monopoly pricing spread so quickly.",
+    "I previously worked as a teaching assistant for introductory statistics.",
+    "Address: 12 Queen Street, London.",
+    "Please send the offer letter to my email address.",
+    "I applied for a study permit before the semester started.",
+])
+def test_realistic_sentences_are_clean(sentence):
+    assert terms(sentence) == []
+
+
+@pytest.mark.parametrize("sentence, expected", [
+    ("I hope to master causal inference methods during the programme.", ["master"]),
+    ("Master the basics first, my supervisor told me.", ["Master"]),
+    ("My goal is to leverage data to address inequality in healthcare.", ["My goal is to", "leverage", "address"]),
+    ("I have always been drawn to econometrics.", ["drawn to"]),
+    ("My academic journey began with a statistics elective.", ["academic journey"]),
+    ("By analysing the sales data, I was able to cut stockouts by 12%.",
+     ["By analysing the sales data, I was able to"]),
+    ("The model reduced latency, thereby improving user retention.", ["thereby"]),
+    ("他在实习中显著提升了模型准确率。", ["显著提升"]),
+    ("I deeply analysed the logs and successfully completed the migration.", ["deeply", "successfully"]),
+    ("Additionally, I delved into the realm of behavioural finance.", ["Additionally", "delved into", "realm"]),
+    ("The course gave me a solid foundation to bridge the gap between theory and practice.",
+     ["solid foundation", "bridge the gap"]),
+    ("The results underscore a pivotal shift, thus revealing new demand.", ["underscore", "pivotal", "thus revealing"]),
+])
+def test_blacklisted_usage_is_flagged(sentence, expected):
+    assert terms(sentence) == expected
+
+
+def test_translation_blacklist_is_shared_with_the_prompt():
+    for words in main.TRANSLATION_BANNED_WORDS.values():
+        for word in words:
+            assert word in main.TRANSLATION_RULES_BASE
+            assert any(term == word.lower() for _, term, _ in main.AI_VOCAB_RULES)
+
+
+def test_demonstrate_only_flagged_when_repeated():
+    assert terms("The project demonstrated my ability to work with messy data.") == []
+    text = "The internship demonstrated my rigour. The thesis demonstrates my curiosity."
+    assert terms(text) == ["demonstrated", "demonstrates"]
+
+
+def test_clean_statement_skips_the_model(monkeypatch):
+    async def fail(**kwargs):
+        raise AssertionError("model should not be called")
+
+    monkeypatch.setattr(main, "generate_text", fail)
+    text = (
+        "I am applying for the Master of Science in Data Science. "
+        "During my Master's thesis on Computer Vision, I labelled 20,000 images with two classmates."
+    )
+    cleaned, stats = asyncio.run(main.remove_ai_vocab_sentences(text, "key", "gemini-test"))
+    assert cleaned == text
+    assert stats["calls"] == 0
+
+
+def test_only_flagged_sentences_are_sent(monkeypatch):
+    sent = []
+
+    async def fake_generate(prompt, on_chunk=None, **kwargs):
+        sent.append(prompt)
+        return "I learned causal inference."
+
+    monkeypatch.setattr(main, "generate_text", fake_generate)
+    text = "I studied at Fudan University. I hope to master causal inference. I enjoy rowing."
+    cleaned, stats = asyncio.run(main.remove_ai_vocab_sentences(text, "key", "gemini-test"))
+    assert cleaned == "I studied at Fudan University. I learned causal inference. I enjoy rowing."
+    assert stats["calls"] == 1
+    assert "本地扫描命中（优先处理）：** master" in sent[0]
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+import pytest
+
+import main
+
+
+def retryable_error():
+    return main.GeminiError("503 Service Unavailable", kind="unavailable", status=503, retryable=True)
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """阈值 1、立即进入 half-open 的熔断器，注册给 gemini-test 模型"""
+    breaker = main.CircuitBreaker("gemini-test", failure_threshold=1, reset_seconds=0.0)
+    monkeypatch.setitem(main._circuit_breakers, "gemini-test", breaker)
+    return breaker
+
+
+def test_opens_after_threshold_and_closes_on_success():
+    breaker = main.CircuitBreaker("m", failure_threshold=2, reset_seconds=60)
+    assert breaker.before_call() is False
+    breaker.record_failure(retryable_error())
+    assert breaker.state == "closed"
+    breaker.record_failure(retryable_error())
+    assert breaker.state == "open"
+    with pytest.raises(main.GeminiCircuitOpenError):
+        breaker.before_call()
+
+
+def test_non_retryable_errors_do_not_open():
+    breaker = main.CircuitBreaker("m", failure_threshold=1, reset_seconds=60)
+    breaker.record_failure(main.GeminiError("bad key", kind="auth", status=401))
+    assert breaker.state == "closed"
+
+
+def test_half_open_allows_a_single_probe(breaker):
+    breaker.record_failure(retryable_error())
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+    with pytest.raises(main.GeminiCircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_failed_probe_reopens(breaker):
+    breaker.record_failure(retryable_error())
+    breaker.reset_seconds = 60
+    breaker._opened_at -= 60
+    assert breaker.before_call() is True
+    breaker.record_failure(retryable_error())
+    assert breaker.state == "open"
+
+
+def test_cancelled_generate_probe_is_released(breaker, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_call(**kwargs):
+        started.set()
+        release.wait(5)
+        return "late"
+
+    monkeypatch.setattr(main, "get_gemini_response", blocking_call)
+    breaker.record_failure(retryable_error())
+
+    async def scenario():
+        task = asyncio.create_task(main.gemini_generate("key", "gemini-test", "prompt"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+    # 取消既不算成功也不算失败：仍是 half-open，但下一次调用可以重新探测
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+
+
+def test_stream_closed_early_releases_probe(breaker, monkeypatch):
+    def chunks(*args, **kwargs):
+        cancellation = args[6]
+        for text in ("a", "b", "c"):
+            if cancellation.cancelled:
+                return
+            yield text
+
+    monkeypatch.setattr(main, "iter_gemini_chunks", chunks)
+    breaker.record_failure(retryable_error())
+
+    async def scenario():
+        stream = main.gemini_stream("key", "gemini-test", "prompt")
+        assert await stream.__anext__() == "a"
+        await stream.aclose()
+
+    asyncio.run(scenario())
+    assert breaker.state == "half_open"
+    assert breaker.before_call() is True
+
+
+def test_stream_success_closes_circuit(breaker, monkeypatch):
+    monkeypatch.setattr(main, "iter_gemini_chunks", lambda *args, **kwargs: iter(["a", "b"]))
+    breaker.record_failure(retryable_error())
+
+    async def scenario():
+        return [text async for text in main.gemini_stream("key", "gemini-test", "prompt")]
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert breaker.state == "closed"
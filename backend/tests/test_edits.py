@@ -0,0 +1,76 @@
+import asyncio
+
+import main
+
+
+def test_highlight_changes_marks_replaced_and_inserted_words():
+    assert main.highlight_changes("I like data analysis.", "I love data analysis.") == "I **love** data analysis."
+    assert main.highlight_changes("I like data analysis.", "I really love data science.") == "I **really love** data **science**."
+    assert main.highlight_changes("我喜欢数据分析。", "我热爱数据分析。") == "我**热爱**数据分析。"
+
+
+def test_highlight_changes_leaves_identical_text_alone():
+    assert main.highlight_changes("Same text.", "Same text.") == "Same text."
+
+
+def test_annotation_only_paragraph_is_edited_with_the_previous_one():
+    paragraphs = ["--- A ---", "第一段", "【改得更具体】", "第三段", "第四段 [shorter]"]
+    assert main.find_edit_spans(paragraphs, main.contains_annotation) == [[1, 2], [4, 4]]
+
+
+def test_section_headers_are_never_edited():
+    paragraphs = ["--- Motivation 【标题】 ---", "正文"]
+    assert main.find_edit_spans(paragraphs, main.contains_annotation) == []
+
+
+def run_edit(text, monkeypatch, highlight=False, emit=None):
+    prompts = []
+
+    async def fake_generate(prompt, on_chunk=None, **kwargs):
+        prompts.append(prompt)
+        if on_chunk is not None:
+            on_chunk("edited ")
+            on_chunk("paragraph")
+        return "edited paragraph"
+
+    monkeypatch.setattr(main, "generate_text", fake_generate)
+    result = asyncio.run(main.edit_annotated_paragraphs(
+        text=text,
+        is_target=main.contains_annotation,
+        build_prompt=lambda span: f"EDIT:{span}",
+        api_key="key",
+        model_name="gemini-test",
+        highlight=highlight,
+        emit=emit,
+    ))
+    return result, prompts
+
+
+def test_only_annotated_paragraphs_are_sent(monkeypatch):
+    text = "--- Motivation ---\nfirst paragraph\n\nsecond paragraph [tighten]\nthird paragraph"
+    (edited, stats), prompts = run_edit(text, monkeypatch)
+    assert edited == "--- Motivation ---\nfirst paragraph\n\nedited paragraph\nthird paragraph"
+    assert stats["calls"] == 1
+    assert stats["edited_paragraphs"] == 1
+    assert stats["chars_sent"] == len("second paragraph [tighten]")
+    assert len(prompts) == 1 and "EDIT:second paragraph [tighten]" in prompts[0]
+
+
+def test_unannotated_text_makes_no_calls(monkeypatch):
+    text = "first paragraph\nsecond paragraph"
+    (edited, stats), prompts = run_edit(text, monkeypatch)
+    assert edited == text
+    assert stats["calls"] == 0
+    assert prompts == []
+
+
+def test_highlight_and_stream_events(monkeypatch):
+    events = []
+    text = "first paragraph [a]\nkeep\nlast paragraph [b]"
+    (edited, stats), _ = run_edit(text, monkeypatch, highlight=True, emit=lambda event, data: events.append((event, data)))
+    assert edited == "**edited** paragraph\nkeep\n**edited** paragraph"
+    assert stats["calls"] == 2
+    completes = sorted((data["span"], data["paragraphs"]) for event, data in events if event == "span_complete")
+    assert completes == [(0, [0, 0]), (1, [2, 2])]
+    for span in (0, 1):
+        assert "".join(data["chunk"] for event, data in events if event is None and data["span"] == span) == "edited paragraph"
@@ -0,0 +1,51 @@
+"""GeminiClientPool 依赖 google-generativeai 的私有实现 (_ClientManager / GenerativeModel._client)
+
+升级 SDK 时这些测试会先失败，提醒同步修改 GeminiClientPool。
+"""
+import functools
+
+import pytest
+
+import main
+
+genai_client = pytest.importorskip("google.generativeai.client")
+glm = pytest.importorskip("google.ai.generativelanguage")
+
+
+def test_private_client_manager_still_exists():
+    assert hasattr(genai_client, "_ClientManager")
+    manager = genai_client._ClientManager()
+    manager.configure(api_key="test-key")
+    client = manager.get_default_client("generative")
+    assert callable(client.generate_content)
+    assert callable(client.stream_generate_content)
+
+
+def test_pool_injects_per_key_clients_with_timeouts():
+    pool = main.GeminiClientPool(idle_seconds=60)
+    model_a = pool.get_model("key-a", "gemini-pro")
+    model_b = pool.get_model("key-b", "gemini-pro")
+    assert model_a._client is pool._clients["key-a"][0]
+    assert model_b._client is pool._clients["key-b"][0]
+    assert model_a._client is not model_b._client
+    assert pool.get_model("key-a", "gemini-pro") is model_a
+
+    generate = model_a._client.generate_content
+    assert isinstance(generate, functools.partial)
+    assert generate.keywords["timeout"] == main.LLM_CALL_TIMEOUT_SECONDS
+    assert model_a._client.stream_generate_content.keywords["timeout"] == main.LLM_STREAM_TIMEOUT_SECONDS
+
+
+def test_generative_model_sends_requests_through_injected_client():
+    calls = []
+
+    class RecordingClient:
+        def generate_content(self, request, **kwargs):
+            calls.append(request)
+            return glm.GenerateContentResponse(candidates=[{"content": {"parts": [{"text": "hello"}]}}])
+
+    model = main.genai.GenerativeModel("gemini-pro")
+    assert hasattr(model, "_client")
+    model._client = RecordingClient()
+    assert model.generate_content("ping").text == "hello"
+    assert len(calls) == 1
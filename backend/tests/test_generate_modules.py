@@ -0,0 +1,78 @@
+import asyncio
+
+import main
+
+MODULES = ["Motivation", "Academic", "Internship", "Why_School", "Career_Goal"]
+
+
+def run_generation(monkeypatch, respond, modules=MODULES, max_concurrency=5):
+    """gemini_generate 换成 respond(module)，返回 generate_modules_concurrently 的结果与最大并发数"""
+    active = {"now": 0, "peak": 0}
+
+    async def fake_generate(**kwargs):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        try:
+            return await respond(main.gemini_module_label.get())
+        finally:
+            active["now"] -= 1
+
+    monkeypatch.setattr(main, "gemini_generate", fake_generate)
+    result = asyncio.run(main.generate_modules_concurrently(
+        modules_list=modules,
+        api_key="key",
+        model_name="gemini-test",
+        target_school_name="UCL MSc Business Analytics",
+        counselor_strategy="",
+        curriculum_text="",
+        student_background_text="素材",
+        transcript_content=[],
+        curriculum_imgs=[],
+        max_concurrency=max_concurrency,
+    ))
+    return result, active["peak"]
+
+
+def test_modules_run_concurrently(monkeypatch):
+    async def respond(module):
+        await asyncio.sleep(0.05)
+        return f"{module} 段落"
+
+    (sections, trends, status), peak = run_generation(monkeypatch, respond)
+    assert peak == len(MODULES)
+    assert sections == {module: f"{module} 段落" for module in MODULES}
+    assert all(status[module]["success"] for module in MODULES)
+
+
+def test_concurrency_limit_is_respected(monkeypatch):
+    async def respond(module):
+        await asyncio.sleep(0.02)
+        return "ok"
+
+    _, peak = run_generation(monkeypatch, respond, max_concurrency=2)
+    assert peak == 2
+
+
+def test_failed_and_timed_out_modules_do_not_affect_others(monkeypatch):
+    monkeypatch.setattr(main, "MODULE_TIMEOUT_SECONDS", 0.1)
+
+    async def respond(module):
+        if module == "Academic":
+            raise main.GeminiError("quota exceeded", kind="rate_limited", status=429, retryable=True)
+        if module == "Internship":
+            await asyncio.sleep(1)
+        return f"{module} 段落"
+
+    (sections, _, status), _ = run_generation(monkeypatch, respond)
+    assert set(sections) == {"Motivation", "Why_School", "Career_Goal"}
+    assert (status["Academic"]["success"], status["Academic"]["error_kind"]) == (False, "rate_limited")
+    assert (status["Internship"]["success"], status["Internship"]["error_kind"]) == (False, "timeout")
+
+
+def test_motivation_trends_are_split_out(monkeypatch):
+    async def respond(module):
+        return "[TRENDS_START]趋势[TRENDS_END][DRAFT_START]正文[DRAFT_END]"
+
+    (sections, trends, _), _ = run_generation(monkeypatch, respond, modules=["Motivation"])
+    assert trends == "趋势"
+    assert sections == {"Motivation": "正文"}
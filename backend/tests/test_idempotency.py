@@ -0,0 +1,106 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def translate_calls(monkeypatch):
+    """替换 /api/translate 背后的模型调用，记录调用次数"""
+    calls = []
+    monkeypatch.setattr(main, "IDEMPOTENCY_ENABLED", True)
+
+    async def fake_generate(prompt, **kwargs):
+        calls.append(prompt)
+        await asyncio.sleep(0.2)
+        return f"translation {len(calls)}"
+
+    monkeypatch.setattr(main, "generate_text", fake_generate)
+    return calls
+
+
+def translate_body(text=None):
+    return {"api_key": "", "model_name": "gemini-test", "module_type": "Motivation", "chinese_text": text or uuid.uuid4().hex}
+
+
+def post_all(*requests):
+    async def scenario():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post("/api/translate", **request) for request in requests))
+    return asyncio.run(scenario())
+
+
+def test_idempotency_key_replays_the_first_response(translate_calls):
+    key = uuid.uuid4().hex
+    body = translate_body()
+    first, = post_all({"json": body, "headers": {"Idempotency-Key": key}})
+    second, = post_all({"json": body, "headers": {"Idempotency-Key": key}})
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json()
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert len(translate_calls) == 1
+
+
+def test_reused_key_with_different_body_is_rejected(translate_calls):
+    key = uuid.uuid4().hex
+    first, = post_all({"json": translate_body(), "headers": {"Idempotency-Key": key}})
+    second, = post_all({"json": translate_body(), "headers": {"Idempotency-Key": key}})
+    assert first.status_code == 200
+    assert second.status_code == 422
+    assert len(translate_calls) == 1
+
+
+def test_concurrent_identical_requests_are_coalesced(translate_calls):
+    body = translate_body()
+    responses = post_all({"json": body}, {"json": body}, {"json": body})
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert len({r.text for r in responses}) == 1
+    assert sum(r.headers.get("Idempotent-Coalesced") == "true" for r in responses) == 2
+    assert len(translate_calls) == 1
+
+
+def test_different_requests_are_not_coalesced(translate_calls):
+    responses = post_all({"json": translate_body()}, {"json": translate_body()})
+    assert [r.status_code for r in responses] == [200, 200]
+    assert len(translate_calls) == 2
+
+
+def test_failed_request_releases_the_key(translate_calls, monkeypatch):
+    async def failing_generate(prompt, **kwargs):
+        raise main.GeminiError("503", kind="unavailable", status=503, retryable=True)
+
+    key = uuid.uuid4().hex
+    body = translate_body()
+    monkeypatch.setattr(main, "generate_text", failing_generate)
+    failed, = post_all({"json": body, "headers": {"Idempotency-Key": key}})
+    assert failed.status_code == 503
+
+    async def fake_generate(prompt, **kwargs):
+        return "ok"
+
+    monkeypatch.setattr(main, "generate_text", fake_generate)
+    retried, = post_all({"json": body, "headers": {"Idempotency-Key": key}})
+    assert retried.status_code == 200
+    assert retried.json()["translated_text"] == "ok"
+
+
+def test_finished_keyless_requests_are_not_replayed(translate_calls):
+    body = translate_body()
+    first, = post_all({"json": body})
+    second, = post_all({"json": {**body, "bypass_cache": True}})
+    third, = post_all({"json": body})
+    assert [r.status_code for r in (first, second, third)] == [200, 200, 200]
+    assert "Idempotent-Coalesced" not in third.headers
+    assert len(translate_calls) == 3
+
+
+def test_finished_rows_are_only_read_by_waiting_requests(tmp_path):
+    store = main.IdempotencyStore(str(tmp_path / "idempotency.sqlite3"))
+    assert store.begin("key", "fp")[0] == "new"
+    assert store.begin("key", "fp", True)[0] == "in_progress"
+    store.complete("key", 200, "{}", 10)
+    assert store.begin("key", "fp") == ("done", 200, "{}")
+    assert store.begin("key", "fp", True)[0] == "new"
@@ -0,0 +1,31 @@
+import asyncio
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+import main
+
+
+def png_upload(name, color="white"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+    buffer.seek(0)
+    return UploadFile(file=buffer, filename=name)
+
+
+def test_duplicate_images_are_dropped(monkeypatch):
+    monkeypatch.setattr(main, "get_doc_executor", lambda: None)
+    uploads = [png_upload("a.png"), png_upload("b.png"), png_upload("c.png", "black")]
+    media, stats = asyncio.run(main.preprocess_image_uploads(uploads))
+    assert len(media) == 2
+    assert (stats["images_in"], stats["images_out"], stats["duplicates_dropped"]) == (3, 2, 1)
+
+
+def test_oversized_images_are_rejected(monkeypatch):
+    monkeypatch.setattr(main, "get_doc_executor", lambda: None)
+    monkeypatch.setattr(main, "DOC_MAX_BYTES", 10)
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(main.preprocess_image_uploads([png_upload("a.png")]))
+    assert excinfo.value.status_code == 413
@@ -0,0 +1,85 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def store(tmp_path):
+    return main.JobStore(str(tmp_path / "jobs.sqlite3"), retention_seconds=3600)
+
+
+def test_job_lifecycle(store):
+    job_id, created = store.create_or_reuse("generate", "hash-1", total=2)
+    assert created
+    assert store.get(job_id)["status"] == "queued"
+
+    store.set_running(job_id)
+    store.record_module(job_id, "Academic", "学术段落", {"success": True})
+    job = store.get(job_id)
+    assert job["status"] == "running"
+    assert job["progress"] == {"completed": 1, "total": 2}
+    assert job["modules"]["Academic"]["result"] == "学术段落"
+
+    store.record_module(job_id, "Internship", "实习段落", {"success": True})
+    store.finish(job_id, {"success": True, "generated_sections": {"Academic": "学术段落"}})
+    job = store.get(job_id)
+    assert job["status"] == "succeeded"
+    assert job["progress"]["completed"] == 2
+    assert job["result"]["generated_sections"] == {"Academic": "学术段落"}
+    assert job["expires_at"] is not None
+
+
+def test_identical_requests_reuse_the_job(store):
+    job_id, _ = store.create_or_reuse("generate", "hash-1", total=1)
+    assert store.create_or_reuse("generate", "hash-1", total=1) == (job_id, False)
+    other_id, created = store.create_or_reuse("analyze", "hash-1", total=1)
+    assert created and other_id != job_id
+
+
+def test_finished_jobs_are_reused_unless_bypassed(store):
+    job_id, _ = store.create_or_reuse("generate", "hash-1", total=1)
+    store.finish(job_id, {"success": True})
+    assert store.create_or_reuse("generate", "hash-1", total=1) == (job_id, False)
+    new_id, created = store.create_or_reuse("generate", "hash-1", total=1, reuse_finished=False)
+    assert created and new_id != job_id
+
+
+def test_failed_jobs_are_not_reused(store):
+    job_id, _ = store.create_or_reuse("generate", "hash-1", total=1)
+    store.fail(job_id, "Gemini unavailable", "unavailable")
+    job = store.get(job_id)
+    assert (job["status"], job["error"], job["error_kind"]) == ("failed", "Gemini unavailable", "unavailable")
+    new_id, created = store.create_or_reuse("generate", "hash-1", total=1)
+    assert created and new_id != job_id
+
+
+def test_stale_jobs_are_reported_as_interrupted(store, monkeypatch):
+    job_id, _ = store.create_or_reuse("generate", "hash-1", total=1)
+    store.set_running(job_id)
+    monkeypatch.setattr(main, "JOB_STALE_SECONDS", -1)
+    job = store.get(job_id)
+    assert (job["status"], job["error_kind"]) == ("failed", "interrupted")
+
+
+def test_expired_jobs_are_purged(tmp_path):
+    store = main.JobStore(str(tmp_path / "jobs.sqlite3"), retention_seconds=-1)
+    job_id, _ = store.create_or_reuse("generate", "hash-1", total=1)
+    store.finish(job_id, {"success": True})
+    store.create_or_reuse("generate", "hash-2", total=1)
+    assert store.get(job_id) is None
+
+
+def test_running_jobs_are_not_shared_across_api_keys(store, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(main, "job_store", store)
+    monkeypatch.setattr(main, "submit_job", lambda job_id, job_fn: None)
+    client = TestClient(main.app)
+    form = {"target_school_name": "UCL", "manual_experiences": "社团经历"}
+
+    first = client.post("/api/jobs/analyze-experiences", data={**form, "api_key": "key-a"}).json()
+    same_key = client.post("/api/jobs/analyze-experiences", data={**form, "api_key": "key-a"}).json()
+    other_key = client.post("/api/jobs/analyze-experiences", data={**form, "api_key": "key-b"}).json()
+    assert same_key["job_id"] == first["job_id"]
+    assert other_key["job_id"] != first["job_id"]
+    assert not other_key["reused"]
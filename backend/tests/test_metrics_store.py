@@ -0,0 +1,32 @@
+import time
+
+import main
+
+
+def make_store(path):
+    return main.MetricsStore(str(path / "metrics.sqlite3"))
+
+
+def test_values_are_summed_across_workers(tmp_path):
+    first, second = make_store(tmp_path), make_store(tmp_path)
+    first.write([("ps_requests_total", (("route", "/a"),), 2)])
+    second.write([("ps_requests_total", (("route", "/a"),), 3)])
+    assert first.collect() == {("ps_requests_total", (("route", "/a"),)): 5}
+
+
+def test_stale_workers_are_pruned(tmp_path):
+    live, dead = make_store(tmp_path), make_store(tmp_path)
+    dead.write([("ps_requests_total", (), 7)])
+    time.sleep(0.05)
+    live.write([("ps_requests_total", (), 1)])
+    assert live.prune(stale_seconds=0.02) == 1
+    assert live.collect() == {("ps_requests_total", ()): 1}
+
+
+def test_heartbeat_is_written_without_changes(tmp_path):
+    store = make_store(tmp_path)
+    store.write([("ps_requests_total", (), 1)])
+    time.sleep(0.05)
+    store.write([])
+    assert store.prune(stale_seconds=0.02) == 0
+    assert store.collect() == {("ps_requests_total", ()): 1}
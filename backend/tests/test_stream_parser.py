@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+import main
+
+MOTIVATION_RESPONSES = [
+    "[TRENDS_START]\n<ul><li>AI 监管趋严</li></ul>\n[TRENDS_END]\n[DRAFT_START]\n我对金融科技的兴趣源于一次实习。\n[DRAFT_END]",
+    "前言会被丢弃 [TRENDS_START]趋势[TRENDS_END] 中间 [DRAFT_START]  正文第一段。\n\n正文第二段。  [DRAFT_END] 结尾",
+    "[TRENDS_START][TRENDS_END][DRAFT_START]只有正文[DRAFT_END]",
+    "模型没有按格式输出，整段都是正文。" * 20,
+    "短文本",
+]
+
+
+def random_chunks(text, rng):
+    chunks = []
+    position = 0
+    while position < len(text):
+        size = rng.randint(1, 12)
+        chunks.append(text[position:position + size])
+        position += size
+    return chunks
+
+
+def parse_stream(chunks, **kwargs):
+    parser = main.DelimitedStreamParser(main.MOTIVATION_STREAM_MARKERS, **kwargs)
+    sections = {}
+    for chunk in chunks:
+        for kind, section, text in parser.feed(chunk):
+            if kind == "text":
+                sections[section] = sections.get(section, "") + text
+    for kind, section, text in parser.close():
+        sections[section] = sections.get(section, "") + text
+    return sections
+
+
+@pytest.mark.parametrize("response", MOTIVATION_RESPONSES)
+def test_random_chunkings_match_split_motivation_response(response):
+    trends, draft = main.split_motivation_response(response)
+    rng = random.Random(response)
+    for _ in range(200):
+        sections = parse_stream(random_chunks(response, rng), fallback_section="draft")
+        assert sections.get("trends", "").strip() == trends
+        assert sections.get("draft", "").strip() == draft.strip()
+
+
+def test_marker_split_across_chunks_is_not_leaked():
+    sections = parse_stream(["[TRENDS_", "START]趋势[TREN", "DS_END][DRAFT_START]正文[DRAFT_E", "ND]"])
+    assert sections == {"trends": "趋势", "draft": "正文"}
+
+
+def test_fallback_waits_for_enough_text_before_giving_up_on_markers():
+    parser = main.DelimitedStreamParser(main.MOTIVATION_STREAM_MARKERS, fallback_section="draft", fallback_after=10)
+    assert parser.feed("12345") == []
+    assert parser.feed("67890abc") == [("text", "draft", "1234567890abc")]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import main
+
+CHUNKS = ["第一块", "第二块", "第三块", "第四块"]
+
+
+@pytest.fixture
+def translate_stream(monkeypatch):
+    """/api/translate-stream 背后的模型调用逐块输出 CHUNKS，记录调用次数"""
+    calls = []
+    monkeypatch.setattr(main, "STREAM_COALESCE_MS", 0)
+
+    async def fake_generate(prompt, on_chunk=None, **kwargs):
+        calls.append(prompt)
+        for chunk in CHUNKS:
+            await asyncio.sleep(0.01)
+            on_chunk(chunk)
+        return "".join(CHUNKS)
+
+    monkeypatch.setattr(main, "generate_text", fake_generate)
+    return calls
+
+
+def parse_events(body):
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = {"event": "message"}
+        for line in frame.split("\n"):
+            name, _, value = line.partition(": ")
+            fields[name] = value
+        if "data" in fields:
+            events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+BODY = {"api_key": "", "model_name": "gemini-test", "module_type": "Motivation", "chinese_text": "我喜欢数据"}
+
+
+def run_requests(*headers_list, between=None):
+    async def scenario():
+        responses = []
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            for headers in headers_list:
+                if callable(headers):
+                    headers = headers(responses)
+                response = await client.post("/api/translate-stream", json=BODY, headers=headers)
+                responses.append(parse_events(response.text))
+                if between is not None:
+                    await between(responses)
+        return responses
+    return asyncio.run(scenario())
+
+
+def test_events_carry_sequential_ids(translate_stream):
+    events, = run_requests({})
+    stream_id = events[0][0].rpartition(":")[0]
+    assert [event_id for event_id, _, _ in events] == [f"{stream_id}:{seq}" for seq in range(1, len(events) + 1)]
+    assert [data["chunk"] for _, event, data in events if event == "message"] == CHUNKS
+    assert events[-1][1] == "complete"
+    assert events[-1][2]["translated_text"] == "".join(CHUNKS)
+
+
+def test_resume_replays_only_later_events_without_regenerating(translate_stream):
+    first, resumed = run_requests({}, lambda responses: {"Last-Event-ID": responses[0][1][0]})
+    assert resumed == first[2:]
+    assert len(translate_stream) == 1
+
+
+def stream_replay_done(stream_id):
+    found = main.stream_replay_store.read(stream_id, 0)
+    return found is not None and found[2]
+
+
+def test_resume_from_replay_store_on_another_worker(translate_stream):
+    async def forget_session(responses):
+        # 模拟重连落在另一个 worker：本进程内不再有该会话，只能从共享存储读取
+        stream_id = responses[0][0][0].rpartition(":")[0]
+        for _ in range(100):
+            if stream_replay_done(stream_id):
+                break
+            await asyncio.sleep(0.01)
+        main._stream_sessions.pop(stream_id, None)
+
+    first, resumed = run_requests({}, lambda responses: {"Last-Event-ID": responses[0][2][0]}, between=forget_session)
+    assert resumed == first[3:]
+    assert len(translate_stream) == 1
+
+
+def test_unknown_last_event_id_starts_a_new_stream(translate_stream):
+    events, = run_requests({"Last-Event-ID": "0123456789abcdef:3"})
+    assert events[-1][1] == "complete"
+    assert len(translate_stream) == 1
+
+
+def test_chunks_are_coalesced_within_the_window(translate_stream, monkeypatch):
+    monkeypatch.setattr(main, "STREAM_COALESCE_MS", 10_000)
+    events, = run_requests({})
+    assert [data["chunk"] for _, event, data in events if event == "message"] == ["".join(CHUNKS)]
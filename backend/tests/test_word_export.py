@@ -0,0 +1,26 @@
+import io
+
+import docx
+from docx.oxml.ns import qn
+
+import main
+
+
+def test_word_export_uses_template_styles():
+    data = main.create_word_docx("--- Motivation ---\n第一段\n\n第二段", "UCL 个人陈述", "SimSun", is_chinese=True)
+    doc = docx.Document(io.BytesIO(data))
+    assert [p.text for p in doc.paragraphs if p.text] == ["第一段", "第二段"]
+    header = doc.sections[0].header.paragraphs[0]
+    assert header.text == "UCL 个人陈述"
+    assert header._p.pPr.find(qn("w:pBdr")) is not None
+    assert doc.styles["Normal"].element.rPr.rFonts.get(qn("w:eastAsia")) == "SimSun"
+
+
+def test_template_is_not_modified_by_renders():
+    template = main.get_word_template("Times New Roman", False)
+    before = template.template_bytes
+    template.render("Header A", ["one"])
+    second = docx.Document(io.BytesIO(template.render("Header B", ["two"])))
+    assert [p.text for p in second.paragraphs if p.text] == ["two"]
+    assert second.sections[0].header.paragraphs[0].text == "Header B"
+    assert template.template_bytes == before
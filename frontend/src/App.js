@@ -4,6 +4,8 @@ import './App.css';
 
 // API configuration
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+// How many times a dropped generation stream is resumed before falling back
+const STREAM_MAX_RECONNECTS = 3;
 
 // Module mappings
 // const modules = {
@@ -290,67 +292,105 @@ function App() {
       formData.append('curriculum_files', file);
     });
 
-    try {
-      const response = await fetch(`${API_BASE_URL}/api/generate-stream`, {
-        method: 'POST',
-        body: formData,
-      });
-
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
-      let buffer = '';
-      let eventType = 'message';
+    // Reconnect with Last-Event-ID after a dropped connection; the backend
+    // replays the missed events instead of regenerating
+    let lastEventId = '';
+    let finished = false;
+    let reconnects = 0;
 
+    try {
       while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        buffer += decoder.decode(value, { stream: true });
-        const lines = buffer.split('\n');
-        buffer = lines.pop(); // Keep last incomplete line
+        try {
+          const response = await fetch(`${API_BASE_URL}/api/generate-stream`, {
+            method: 'POST',
+            body: formData,
+            headers: lastEventId ? { 'Last-Event-ID': lastEventId } : {},
+          });
+
+          if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+          }
 
-        for (let i = 0; i < lines.length; i++) {
-          const line = lines[i].trim();
-          if (line.startsWith('event: ')) {
-            eventType = line.slice(7);
-          } else if (line.startsWith('data: ')) {
-            const data = line.slice(6);
-            if (data === '') continue;
-
-            try {
-              const parsed = JSON.parse(data);
-
-              if (eventType === 'module_start') {
-                setStreamingModule(parsed.module);
-                setStreamingText('');
-              } else if (eventType === 'trends') {
-                setMotivationTrends(parsed.trends);
-              } else if (eventType === 'complete') {
-                // Final data
-                setGeneratedSections(parsed.generated_sections);
-                setFullChineseDraft(parsed.full_chinese_draft);
-                setMotivationTrends(prev => parsed.motivation_trends || prev);
-                // Generate headers
-                await generateHeaders();
-              } else if (eventType === 'error') {
-                throw new Error(parsed.error);
-              } else {
-                // Default data event (chunks)
-                if (parsed.chunk) {
-                  setStreamingText(prev => prev + parsed.chunk);
-                  // Also update fullChineseDraft incrementally
-                  setFullChineseDraft(prev => prev + parsed.chunk);
+          const reader = response.body.getReader();
+          const decoder = new TextDecoder();
+          let buffer = '';
+          let eventType = 'message';
+          let eventId = '';
+
+          while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop(); // Keep last incomplete line
+
+            for (let i = 0; i < lines.length; i++) {
+              const line = lines[i].trim();
+              if (line === '') {
+                // Blank line ends the event; the next one defaults to 'message'
+                eventType = 'message';
+                if (eventId) lastEventId = eventId;
+              } else if (line.startsWith('id: ')) {
+                eventId = line.slice(4);
+              } else if (line.startsWith('event: ')) {
+                eventType = line.slice(7);
+              } else if (line.startsWith('data: ')) {
+                const data = line.slice(6);
+                if (data === '') continue;
+
+                try {
+                  const parsed = JSON.parse(data);
+
+                  if (eventType === 'module_start') {
+                    setStreamingModule(parsed.module);
+                    setStreamingText('');
+                    if (parsed.module === 'Motivation') {
+                      setMotivationTrends('');
+                    }
+                  } else if (eventType === 'trends_chunk') {
+                    // Motivation trends arrive separately from the draft text
+                    setMotivationTrends(prev => prev + parsed.chunk);
+                  } else if (eventType === 'trends') {
+                    setMotivationTrends(parsed.trends);
+                  } else if (eventType === 'complete') {
+                    finished = true;
+                    // Final data
+                    setGeneratedSections(parsed.generated_sections);
+                    setFullChineseDraft(parsed.full_chinese_draft);
+                    setMotivationTrends(prev => parsed.motivation_trends || prev);
+                    // Generate headers
+                    await generateHeaders();
+                  } else if (eventType === 'error') {
+                    finished = true;
+                    throw new Error(parsed.error);
+                  } else if (eventType === 'draft_chunk' || eventType === 'message') {
+                    // Draft chunks (Motivation) and default data events (other modules)
+                    if (parsed.chunk) {
+                      setStreamingText(prev => prev + parsed.chunk);
+                      // Also update fullChineseDraft incrementally
+                      setFullChineseDraft(prev => prev + parsed.chunk);
+                    }
+                  }
+                } catch (e) {
+                  console.error('Failed to parse SSE data:', e);
                 }
               }
-            } catch (e) {
-              console.error('Failed to parse SSE data:', e);
             }
           }
+        } catch (error) {
+          if (finished || !lastEventId || reconnects >= STREAM_MAX_RECONNECTS) {
+            throw error;
+          }
+          console.warn('Stream interrupted, resuming:', error);
         }
+
+        if (finished) break;
+        if (!lastEventId || reconnects >= STREAM_MAX_RECONNECTS) {
+          throw new Error('Stream ended before completion');
+        }
+        reconnects += 1;
+        await new Promise(resolve => setTimeout(resolve, 1000 * reconnects));
       }
 
       // After streaming completes, set the final state
@@ -412,16 +452,27 @@ function App() {
     });
 
     try {
-      const response = await axios.post(`${API_BASE_URL}/api/generate`, formData, {
+      // Submit as a background job and poll, so long generations survive proxy timeouts
+      const submitted = await axios.post(`${API_BASE_URL}/api/jobs/generate`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data'
-        },
-        onUploadProgress: (progressEvent) => {
-          const percentCompleted = Math.round((progressEvent.loaded * 100) / progressEvent.total);
-          setLoadingProgress(percentCompleted);
         }
       });
 
+      let job = submitted.data;
+      do {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        job = (await axios.get(`${API_BASE_URL}${submitted.data.status_url}`)).data;
+        if (job.progress.total > 0) {
+          setLoadingProgress(Math.round((job.progress.completed * 100) / job.progress.total));
+        }
+      } while (job.status === 'queued' || job.status === 'running');
+
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+
+      const response = { data: job.result };
       if (response.data.success) {
         setGeneratedSections(response.data.generated_sections);
         setFullChineseDraft(response.data.full_chinese_draft);
@@ -491,21 +542,53 @@ function App() {
     }
 
     try {
-      const response = await axios.post(`${API_BASE_URL}/api/analyze-experiences`, formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data'
-        }
+      // Each stage (extract / match / research) is streamed as soon as it finishes
+      const response = await fetch(`${API_BASE_URL}/api/analyze-experiences-stream`, {
+        method: 'POST',
+        body: formData,
       });
 
-      if (response.data.success) {
-        setAnalysisResults({
-          extractedExperiences: response.data.extracted_experiences,
-          matchedIntersections: response.data.matched_intersections,
-          researchInsights: response.data.research_insights
-        });
-        showToast('✅ 经历分析与调研完成！');
-      } else {
-        alert('分析失败: ' + (response.data.error || '未知错误'));
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const stageFields = {
+        extracted_experiences: 'extractedExperiences',
+        matched_intersections: 'matchedIntersections',
+        research_insights: 'researchInsights'
+      };
+      setAnalysisResults({ extractedExperiences: '', matchedIntersections: '', researchInsights: '' });
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let eventType = 'message';
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Keep last incomplete line
+
+        for (const rawLine of lines) {
+          const line = rawLine.trim();
+          if (line === '') {
+            eventType = 'message';
+          } else if (line.startsWith('event: ')) {
+            eventType = line.slice(7);
+          } else if (line.startsWith('data: ')) {
+            const parsed = JSON.parse(line.slice(6));
+            if (eventType === 'stage_complete') {
+              setAnalysisResults(prev => ({ ...prev, [stageFields[parsed.field]]: parsed.text }));
+            } else if (eventType === 'complete') {
+              showToast('✅ 经历分析与调研完成！');
+            } else if (eventType === 'error') {
+              throw new Error(parsed.error);
+            }
+          }
+        }
       }
     } catch (error) {
       console.error('Analysis error:', error);
@@ -552,32 +635,71 @@ function App() {
     setLoading(true);
 
     try {
-      // Translate each section individually
-      const translatedSections = [];
-
-      for (const moduleKey of displayOrder) {
-        if (generatedSections[moduleKey]) {
-          const chineseText = generatedSections[moduleKey];
-          if (!chineseText.trim()) continue;
-
-          const requestData = {
-            api_key: '', // API key is now set via environment variable
-            model_name: modelName,
-            chinese_text: chineseText,
-            spelling_preference: spellingPreference,
-            module_type: moduleKey
-          };
-
-          const response = await axios.post(`${API_BASE_URL}/api/translate`, requestData);
-
-          if (response.data.success) {
-            const englishHeader = englishModules[moduleKey] || moduleKey;
-            translatedSections.push(`--- ${englishHeader} ---\n${response.data.translated_text}`);
+      // Translate all sections in one batch request; the server streams each module as it finishes
+      const sections = displayOrder
+        .filter(moduleKey => generatedSections[moduleKey] && generatedSections[moduleKey].trim())
+        .map(moduleKey => ({ module_type: moduleKey, chinese_text: generatedSections[moduleKey] }));
+
+      const requestData = {
+        api_key: '', // API key is now set via environment variable
+        model_name: modelName,
+        sections: sections,
+        spelling_preference: spellingPreference,
+        stream: true
+      };
+
+      const response = await fetch(`${API_BASE_URL}/api/translate-batch`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(requestData),
+      });
+
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+
+      const translations = {};
+      const assembleTranslations = () => displayOrder
+        .filter(moduleKey => translations[moduleKey])
+        .map(moduleKey => `--- ${englishModules[moduleKey] || moduleKey} ---\n${translations[moduleKey]}`)
+        .join('\n\n');
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let eventType = 'message';
+      let failedModules = [];
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Keep last incomplete line
+
+        for (const rawLine of lines) {
+          const line = rawLine.trim();
+          if (line === '') {
+            eventType = 'message';
+          } else if (line.startsWith('event: ')) {
+            eventType = line.slice(7);
+          } else if (line.startsWith('data: ')) {
+            const parsed = JSON.parse(line.slice(6));
+            if (eventType === 'translation') {
+              translations[parsed.module] = parsed.translated_text;
+              setFullTranslatedText(assembleTranslations());
+            } else if (eventType === 'complete') {
+              failedModules = parsed.failed_modules || [];
+            }
           }
         }
       }
 
-      setFullTranslatedText(translatedSections.join('\n\n'));
+      setFullTranslatedText(assembleTranslations());
+      if (failedModules.length > 0) {
+        alert('Translation failed for: ' + failedModules.join(', '));
+      }
       showToast('✅ Translation completed!');
     } catch (error) {
       console.error('Translation error:', error);
@@ -885,7 +1007,7 @@ function App() {
 
 
                     {/* Analysis results display */}
-                    {analysisResults.researchInsights && (
+                    {(analysisResults.extractedExperiences || analysisResults.researchInsights) && (
                       <div className="section" style={{ marginTop: '1rem', borderColor: 'var(--primary-color)' }}>
                         <h4>经历分析与调研结果</h4>
 